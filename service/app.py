@@ -8,7 +8,9 @@ import cv2
 from music_player.player import MusicPlayer
 import music_player.commands as cmd
 from voice_recognizer import VoiceRecognizer
-from gesture_recognizer import GestureRecognizer
+from camera_capture import CameraCapture
+from frame_scheduler import FrameRateScheduler
+from gesture_recognizer import GestureRecognizer, hand_features
 
 
 logging.basicConfig(
@@ -53,7 +55,11 @@ def main(page: ft.Page):
     MUSIC_PLAYER.start()
 
     threading.Thread(target=VOICE_RECOGNIZER.listen, daemon=True).start()
-    cap = cv2.VideoCapture(0)
+    capture = CameraCapture(0)
+    if not capture.start():
+        logging.error('Unable to read video')
+        exit(1)
+    frame_scheduler = FrameRateScheduler()
 
     page.title = "Music Player"
     page.theme_mode = ft.ThemeMode.LIGHT
@@ -268,49 +274,51 @@ def main(page: ft.Page):
                 logging.info(f'Run GESTURE command: {gesture_command}')
                 execute_command(gesture_command)
         
-        success, image = cap.read()
+        success, image = capture.read()
         if not success:
             logging.error('Unable to read video')
             exit(1)
+        frame_start = time.monotonic()
 
         image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
         result = GESTURE_RECOGNIZER.process_hands(image_rgb)
 
-        if result.multi_hand_landmarks:
-            for hand_landmarks in result.multi_hand_landmarks:
-                # mp_drawing.draw_landmarks(image, hand_landmarks, mp_hands.HAND_CONNECTIONS)
-                # fingers = GESTURE_RECOGNIZER.count_fingers(hand_landmarks)
+        # Every predicate of every hand in one pass
+        hands = hand_features(result.multi_hand_landmarks)
+        for thumbs_up, (index_x, _) in zip(hands.thumbs_up.tolist(), hands.index_pos.tolist()):
+            # mp_drawing.draw_landmarks(image, hand_landmarks, mp_hands.HAND_CONNECTIONS)
+            # fingers = hands.fingers
+            
+            if thumbs_up:
+                if playing_track != current_track:
+                    music_icons[current_track].visible = False
+                    MUSIC_PLAYER.stop()
+                    MUSIC_PLAYER.play(current_track)
+                    music_icons[current_track].visible = True
+                    playing_track = current_track
+                    play_pause_btn.icon = ft.Icons.PLAY_ARROW
+                    page.update()
+            else:
+                x = 1 - index_x
+                n = len(tracks)
+                original_track = current_track
+                for i in range(n):
+                    if x < (i+1)/n:
+                        current_track = i
+                        break
                 
-                if GESTURE_RECOGNIZER.is_thumbs_up(hand_landmarks):
-                    if playing_track != current_track:
-                        music_icons[current_track].visible = False
-                        MUSIC_PLAYER.stop()
-                        MUSIC_PLAYER.play(current_track)
-                        music_icons[current_track].visible = True
-                        playing_track = current_track
-                        play_pause_btn.icon = ft.Icons.PLAY_ARROW
-                        page.update()
-                else:
-                    x, _ = GESTURE_RECOGNIZER.get_index_pos(hand_landmarks)
-                    x = 1 - x
-                    n = len(tracks)
-                    original_track = current_track
-                    for i in range(n):
-                        if x < (i+1)/n:
-                            current_track = i
-                            break
-                    
-                    if current_track != original_track:
-                        update_track_selection(current_track)
-                        page.update()
-                # cmd = convert_fingers_to_cmd(fingers)
-                # if cmd:
-                #     GESTURE_RECOGNIZER.cmd_queue.put(cmd)
+                if current_track != original_track:
+                    update_track_selection(current_track)
+                    page.update()
+            # cmd = convert_fingers_to_cmd(fingers)
+            # if cmd:
+            #     GESTURE_RECOGNIZER.cmd_queue.put(cmd)
 
 
         if cv2.waitKey(5) & 0xFF == 27:
             break
-        time.sleep(0.1) # No need to exhaust cpu
+        frame_scheduler.update(len(hands.fingers) > 0)
+        frame_scheduler.wait(time.monotonic() - frame_start)
 
 if __name__ == "__main__":
     ft.app(target=main)
\ No newline at end of file
@@ -0,0 +1,144 @@
+"""
+Fitting scheduler weights to a synthetic review history, simulated with
+known weights so that the fit can be checked against them.
+
+    loss        one pass over every review: a per-review Python loop, as
+                the scheduler updates cards, against the vectorized
+                forward and backward pass of loss_and_gradient
+    fit         fit_users on one process and on --workers processes
+
+Run from the service directory:
+    python -m benchmarks.fsrs_optimizer --reviews 1000000 --users 200
+"""
+import argparse
+import math
+import os
+import time
+
+import numpy as np
+
+from flashcard_scheduler import AGAIN, DAY, DEFAULT_PARAMETERS, MAXIMUM_INTERVAL
+from fsrs_optimizer import ReviewSequences, fit_users, from_vector, loss_and_gradient, to_vector
+
+# The weights of the simulated students, around which each student varies
+TRUE_PARAMETERS = {
+    'initialDifficulty': 6.0,
+    'difficultyDelta': [1.2, 0.3, -0.3, -0.6],
+    'stabilityFactor': [0.0, 0.6, 1.1, 2.0],
+    'againStability': 0.8,
+    'initialStability': [0.6, 1.5, 3.0, 8.0],
+}
+
+
+def simulate(rng, cards, reviews, parameters):
+    """
+    Reviews of `cards` cards, `reviews` in all: each review happens after
+    the scheduled interval, give or take, and is recalled with the model's
+    probability. Returns (card, rating, reviewed_at) in shuffled order.
+    """
+    lengths = np.sort(rng.multinomial(reviews - cards, np.full(cards, 1 / cards)) + 1)[::-1]
+    difficulty_delta = np.asarray(parameters['difficultyDelta'])
+    stability_factor = np.asarray(parameters['stabilityFactor'])
+    card, rating, reviewed_at = [], [], []
+
+    now = rng.uniform(0, 365 * DAY, cards)
+    r = rng.choice(4, cards, p=[0.2, 0.2, 0.4, 0.2])
+    difficulty = np.clip(parameters['initialDifficulty'] + difficulty_delta[r], 1, 10)
+    stability = np.asarray(parameters['initialStability'])[r]
+    card.append(np.arange(cards))
+    rating.append(r)
+    reviewed_at.append(now.copy())
+    for position in range(1, lengths[0]):
+        active = int(np.count_nonzero(lengths > position))
+        stability, difficulty, now = stability[:active], difficulty[:active], now[:active]
+        elapsed = stability * rng.lognormal(0, 0.6, active)
+        now = now + elapsed * DAY
+        retrievability = np.exp(np.log(0.9) * elapsed / stability)
+        recalled = rng.random(active) < retrievability
+        r = np.where(recalled, rng.choice([1, 2, 3], active, p=[0.15, 0.6, 0.25]), AGAIN)
+        grown = stability * (1 + stability_factor[r] * (10 - difficulty) * (1 - retrievability))
+        stability = np.minimum(np.where(r == AGAIN, parameters['againStability'], grown), MAXIMUM_INTERVAL)
+        difficulty = np.clip(difficulty + difficulty_delta[r], 1, 10)
+        card.append(np.arange(active))
+        rating.append(r)
+        reviewed_at.append(now.copy())
+    order = rng.permutation(reviews)
+    return (np.concatenate(card)[order], np.concatenate(rating).astype(np.int8)[order],
+            np.concatenate(reviewed_at)[order])
+
+
+def student_parameters(rng):
+    return from_vector(to_vector(TRUE_PARAMETERS) * rng.uniform(0.8, 1.2, 13))
+
+
+def loop_loss(parameters, card, rating, reviewed_at):
+    # One review at a time, the way the scheduler walks a history
+    difficulty_delta, stability_factor = parameters['difficultyDelta'], parameters['stabilityFactor']
+    states = {}
+    loss = 0.0
+    for i in np.lexsort((reviewed_at, card)).tolist():
+        key, r, now = int(card[i]), int(rating[i]), float(reviewed_at[i])
+        state = states.get(key)
+        if state is None:
+            difficulty = min(10, max(1, parameters['initialDifficulty'] + difficulty_delta[r]))
+            states[key] = (parameters['initialStability'][r], difficulty, now)
+            continue
+        stability, difficulty, last = state
+        retrievability = math.exp(math.log(0.9) * (now - last) / DAY / stability)
+        probability = min(max(retrievability, 1e-6), 1 - 1e-6)
+        loss -= math.log(probability) if r != AGAIN else math.log1p(-probability)
+        if r == AGAIN:
+            stability = parameters['againStability']
+        else:
+            stability = min(stability * (1 + stability_factor[r] * (10 - difficulty) * (1 - retrievability)),
+                            MAXIMUM_INTERVAL)
+        states[key] = (stability, min(10, max(1, difficulty + difficulty_delta[r])), now)
+    return loss
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--reviews', type=int, default=1000000, help='in all')
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--reviews-per-card', type=int, default=10)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    per_user = args.reviews // args.users
+    truths, histories = {}, {}
+    for index in range(args.users):
+        user = f'student-{index}'
+        truths[user] = student_parameters(rng)
+        histories[user] = simulate(rng, max(per_user // args.reviews_per_card, 1), per_user, truths[user])
+    print(f'{args.users} students, {args.users * per_user} reviews')
+
+    start = time.perf_counter()
+    expected = sum(loop_loss(DEFAULT_PARAMETERS, *history) for history in histories.values())
+    loop = time.perf_counter() - start
+    sequences = ReviewSequences(list(histories.values()))
+    vectors = np.tile(to_vector(DEFAULT_PARAMETERS), (args.users, 1))
+    start = time.perf_counter()
+    vectorized = np.dot(loss_and_gradient(vectors, sequences, prior=0)[0], sequences.predictions)
+    batched = time.perf_counter() - start
+    assert math.isclose(expected, vectorized, rel_tol=1e-9), (expected, vectorized)
+    print(f'loss pass: loop {loop:.2f} s, vectorized with gradient {batched:.3f} s, {loop / batched:.0f}x')
+
+    for workers in sorted({1, args.workers}):
+        start = time.perf_counter()
+        fitted = fit_users(histories, workers)
+        print(f'fit on {workers} process(es): {time.perf_counter() - start:.1f} s')
+
+    losses = np.array([[fit['defaultLoss'], fit['loss']] for fit in fitted.values()])
+    error = np.array([np.abs(to_vector(fitted[user]['parameters']) - to_vector(truths[user]))
+                      for user in fitted]).mean(axis=0)
+    default_error = np.array([np.abs(to_vector(DEFAULT_PARAMETERS) - to_vector(truths[user]))
+                              for user in fitted]).mean(axis=0)
+    print(f'log loss per review: defaults {losses[:, 0].mean():.4f}, fitted {losses[:, 1].mean():.4f}')
+    print('mean absolute error of the weights, defaults -> fitted:')
+    print('  ' + ' '.join(f'{d:.2f}->{f:.2f}' for d, f in zip(default_error, error)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""
+Microbenchmark of the per-frame landmark predicates: the attribute-per-landmark
+implementation GestureRecognizer used to have against hand_features, which
+evaluates them all in one vectorized pass. hand_features is timed on the
+recognizer's landmark objects, converting them included, and on the
+(hands, 21, 3) arrays FrameAnalysis keeps.
+
+Run from the service directory:
+    python -m benchmarks.landmarks --hands 2 --frames 20000
+"""
+import argparse
+import math
+import random
+import time
+
+from gesture_recognizer import hand_features, landmarks_to_array
+
+
+class Landmark:
+    # Same shape as the tasks NormalizedLandmark, without importing mediapipe
+    __slots__ = ('x', 'y', 'z')
+
+    def __init__(self, x, y, z):
+        self.x, self.y, self.z = x, y, z
+
+
+def random_hands(rng, hands):
+    return [[Landmark(rng.random(), rng.random(), rng.random() * 0.1) for _ in range(21)]
+            for _ in range(hands)]
+
+
+# Reference implementations, as they were before hand_features
+def legacy_count_fingers(landmarks):
+    fingers_up = 0
+    for tip in [8, 12, 16, 20]:
+        if landmarks[tip].y < landmarks[tip - 2].y:
+            fingers_up += 1
+    return fingers_up
+
+def legacy_detect_thumb(landmarks):
+    return 1 if landmarks[4].y < landmarks[1].y else 0
+
+def legacy_get_index_pos(landmarks):
+    return (landmarks[8].x, landmarks[8].y)
+
+def legacy_is_thumbs_up(landmarks):
+    return (landmarks[4].y < landmarks[3].y < landmarks[2].y
+            and landmarks[8].y > landmarks[6].y
+            and landmarks[12].y > landmarks[10].y
+            and landmarks[16].y > landmarks[14].y
+            and landmarks[20].y > landmarks[18].y)
+
+def legacy_pointing_angle(landmarks):
+    dx = landmarks[8].x - landmarks[5].x
+    dy = landmarks[8].y - landmarks[5].y
+    return math.degrees(math.atan2(dy, dx))
+
+
+def legacy_frame(hands):
+    return [(legacy_count_fingers(hand), legacy_detect_thumb(hand), legacy_get_index_pos(hand),
+             legacy_is_thumbs_up(hand), legacy_pointing_angle(hand)) for hand in hands]
+
+
+def check_same_results(frames):
+    for hands in frames:
+        legacy = legacy_frame(hands)
+        for features in (hand_features(hands), hand_features(landmarks_to_array(hands))):
+            for i, (l_fingers, l_thumb, l_index, l_thumbs_up, l_angle) in enumerate(legacy):
+                assert l_fingers == features.fingers[i]
+                assert l_thumb == features.thumb[i]
+                assert l_thumbs_up == features.thumbs_up[i]
+                for axis in (0, 1):
+                    assert math.isclose(l_index[axis], features.index_pos[i, axis], abs_tol=1e-6)
+                assert math.isclose(l_angle, features.pointing_angle[i], abs_tol=1e-3)
+
+
+def run(fn, frames):
+    start = time.perf_counter()
+    for hands in frames:
+        fn(hands)
+    return (time.perf_counter() - start) / len(frames)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--hands', type=int, nargs='+', default=[1, 2, 4, 8, 32])
+    parser.add_argument('--frames', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    print(f"{'hands':>5} {'legacy us/frame':>16} {'features us/frame':>18} {'on arrays':>10} {'speedup':>8}")
+    for hands in args.hands:
+        frames = [random_hands(rng, hands) for _ in range(args.frames)]
+        check_same_results(frames[:200])
+        arrays = [landmarks_to_array(hands) for hands in frames]
+        legacy = run(legacy_frame, frames)
+        features = run(hand_features, frames)
+        on_arrays = run(hand_features, arrays)
+        print(f"{hands:>5} {legacy * 1e6:>16.2f} {features * 1e6:>18.2f} {on_arrays * 1e6:>10.2f} "
+              f"{legacy / on_arrays:>7.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,193 @@
+"""
+Picks the cheapest model configuration that still recognises the gestures
+of a set of labeled clips: every combination of the model assets,
+num_hands, detection and presence confidences and inference resolutions
+given is replayed through the gesture pipeline, as benchmarks.replay does,
+and its throughput and command accuracy are measured.
+
+    throughput  frames per second of cropping, color conversion, inference,
+                analysis and rules; decoding the clips is left out
+    accuracy    1 - edit distance between the commands sent and the labeled
+                ones / number of labeled commands, over every clip, at
+                least 0. Pointing and gesture commands both count.
+
+Labels are a JSON object of the commands each clip should send, in order,
+by clip path or file name:
+    {"next_page.mp4": ["next page"], "thumbs": ["ok", "bad"]}
+
+The configurations no other one beats on both throughput and accuracy are
+written to --out with the fastest of them whose accuracy is at least
+--min-accuracy, which the service loads at startup (GESTURE_MODEL_CONFIG,
+model_config.json by default). Clips replay in IMAGE mode with the
+service's default smoothing, so the tracking confidence, only used in the
+'live_stream' mode, keeps the value of --tracking-confidence.
+
+Run from the service directory:
+    python -m benchmarks.model_tuning clips/ --labels clips/labels.json --min-accuracy 0.95
+"""
+import argparse
+import itertools
+import json
+import os
+import tempfile
+import time
+
+from benchmarks.replay import STAGES, replay_clip
+from frame_source import IMAGE_EXTENSIONS
+from hand_roi import HandRoi
+from inference import create_recognizer, warm_up_recognizer
+from model_config import ModelConfig
+from review_log import format_time
+from smoothing import GestureSmoothing
+
+TIMED_STAGES = tuple(stage for stage in STAGES if stage != 'read')
+
+
+def clip_paths(paths):
+    """Clips among `paths`: a directory of images is a clip, any other directory holds clips"""
+    clips = []
+    for path in paths:
+        if not os.path.isdir(path) or any(name.lower().endswith(IMAGE_EXTENSIONS) for name in os.listdir(path)):
+            clips.append(path)
+            continue
+        clips.extend(os.path.join(path, name) for name in sorted(os.listdir(path))
+                     if not name.startswith('.') and not name.endswith('.json'))
+    return clips
+
+
+def clip_labels(labels, clip):
+    for key in (clip, os.path.normpath(clip), os.path.basename(os.path.normpath(clip))):
+        if key in labels:
+            return labels[key]
+    raise ValueError(f'No labels for {clip}')
+
+
+def edit_distance(sent, expected):
+    """Commands to insert, delete or replace to turn `sent` into `expected`"""
+    previous = list(range(len(expected) + 1))
+    for i, command in enumerate(sent, 1):
+        current = [i]
+        for j, label in enumerate(expected, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (command != label)))
+        previous = current
+    return previous[-1]
+
+
+def evaluate(config, recognizer, clips, labels, max_frames=None, default_fps=30.0):
+    """Throughput, accuracy and the commands sent per clip of `config`, run on `recognizer`"""
+    hand_roi = HandRoi.from_config(config.inference_config())
+    frames = 0
+    seconds = 0.0
+    errors = 0
+    expected_commands = 0
+    sent = {}
+    for clip in clips:
+        timings, events, _, clip_frames = replay_clip(clip, recognizer, hand_roi, max_frames, default_fps,
+                                                      GestureSmoothing.from_config(None))
+        frames += clip_frames
+        seconds += sum(sum(timings[stage]) for stage in TIMED_STAGES)
+        commands = sent[clip] = [event['command'] for event in events if event['command'] is not None]
+        expected = clip_labels(labels, clip)
+        errors += edit_distance(commands, expected)
+        expected_commands += len(expected)
+    return {
+        'fps': round(frames / seconds, 2) if seconds > 0 else 0.0,
+        'accuracy': round(max(0.0, 1 - errors / max(expected_commands, 1)), 4),
+        'commands': sent,
+    }
+
+
+def pareto_front(results):
+    """The results no other one beats on both fps and accuracy, fastest first"""
+    front = []
+    for result in sorted(results, key=lambda result: (-result['fps'], -result['accuracy'])):
+        if not front or result['accuracy'] > front[-1]['accuracy']:
+            front.append(result)
+    return front
+
+
+def select(front, min_accuracy):
+    """The fastest result of `front` meeting `min_accuracy`, else the most accurate one"""
+    meeting = [result for result in front if result['accuracy'] >= min_accuracy]
+    if meeting:
+        return meeting[0], True
+    return front[-1], False
+
+
+def write_tuning(path, document):
+    """Write atomically, the service may be reading it"""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temporary = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'w') as file:
+        json.dump(document, file, indent=1)
+    os.replace(temporary, path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('clips', nargs='+', help='video files, directories of images or directories of clips')
+    parser.add_argument('--labels', required=True, help='JSON object of the commands of each clip')
+    parser.add_argument('--min-accuracy', type=float, default=0.95)
+    parser.add_argument('--models', nargs='+', default=[ModelConfig.DEFAULTS['model']], help='.task files')
+    parser.add_argument('--num-hands', type=int, nargs='+', default=[1, 2])
+    parser.add_argument('--detection-confidence', type=float, nargs='+', default=[0.3, 0.5, 0.7])
+    parser.add_argument('--presence-confidence', type=float, nargs='+', default=[0.5])
+    parser.add_argument('--tracking-confidence', type=float, default=ModelConfig.DEFAULTS['min_tracking_confidence'])
+    parser.add_argument('--resolutions', type=int, nargs='+', default=[160, 224, 256, 320, 480],
+                        help='longest side of the inference input, 0 keeps the clip resolution')
+    parser.add_argument('--fps', type=float, default=30.0, help='clip rate when the source does not report one')
+    parser.add_argument('--max-frames', type=int, default=None, help='per clip')
+    parser.add_argument('--out', default='model_config.json')
+    args = parser.parse_args()
+
+    with open(args.labels) as f:
+        labels = json.load(f)
+    clips = clip_paths(args.clips)
+    for clip in clips:
+        clip_labels(labels, clip)
+
+    results = []
+    print(f"{'model':<28} {'hands':>5} {'detect':>6} {'presence':>8} {'res':>5} {'fps':>8} {'accuracy':>8}")
+    start = time.perf_counter()
+    for model, num_hands, detection, presence in itertools.product(
+            args.models, args.num_hands, args.detection_confidence, args.presence_confidence):
+        # Only the resolution changes between these runs, they share a recognizer
+        configs = [ModelConfig(model, num_hands, detection, presence, args.tracking_confidence, resolution)
+                   for resolution in args.resolutions]
+        recognizer = create_recognizer(**configs[0].recognizer_options())
+        try:
+            # The first inference pays for the setup, keep it out of the first run's throughput
+            warm_up_recognizer(recognizer)
+            for config in configs:
+                result = {'config': config.to_config(),
+                          **evaluate(config, recognizer, clips, labels, args.max_frames, args.fps)}
+                results.append(result)
+                print(f'{os.path.basename(model):<28} {num_hands:>5} {detection:>6} {presence:>8} '
+                      f"{config.resolution:>5} {result['fps']:>8.1f} {result['accuracy']:>8.3f}")
+        finally:
+            recognizer.close()
+
+    front = pareto_front(results)
+    selected, meets_floor = select(front, args.min_accuracy)
+    print(f'{len(results)} configurations in {time.perf_counter() - start:.0f} s, Pareto-optimal:')
+    for result in front:
+        mark = '*' if result is selected else ' '
+        print(f" {mark} {result['fps']:>8.1f} fps {result['accuracy']:>6.3f} {result['config']}")
+    if not meets_floor:
+        print(f'No configuration reaches an accuracy of {args.min_accuracy}, selected the most accurate one')
+
+    write_tuning(args.out, {
+        'version': 1,
+        'tuned_at': format_time(time.time()),
+        'clips': clips,
+        'min_accuracy': args.min_accuracy,
+        'meets_min_accuracy': meets_floor,
+        'selected': selected['config'],
+        'pareto': [{key: result[key] for key in ('config', 'fps', 'accuracy')} for result in front],
+        'results': results,
+    })
+    print(f'Wrote {args.out}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,237 @@
+"""
+Replays recorded clips through the full gesture pipeline as fast as possible,
+without a webcam: cropping/downscaling, color conversion, inference, frame
+analysis and rule/pointing evaluation. Reports the throughput, per-stage
+latency percentiles and the commands that would have been sent.
+
+A clip is a video file or a directory of images. Rule delays use the clip time
+(frame index / clip fps), so results do not depend on how fast the box is.
+
+With temporal smoothing (--window/--hysteresis) every frame also goes through
+an unsmoothed pipeline, and the report compares the two: how many events
+smoothing suppressed and how much later the remaining ones were sent.
+
+--record DIR also writes the landmarks of each clip to DIR/<clip>.landmarks,
+which benchmarks.rule_replay replays without running the model.
+
+Run from the service directory:
+    python -m benchmarks.replay clips/next_page.mp4 clips/thumbs/ --resolution 256
+"""
+import argparse
+import json
+import os
+import time
+
+import cv2
+import numpy as np
+
+from frame_analysis import FrameAnalysis
+from frame_source import open_frame_source, source_fps
+from gesture_pipeline import GesturePipeline
+from hand_roi import HandRoi
+from inference import create_recognizer, to_mp_image
+from landmark_recording import EXTENSION, LandmarkRecorder
+from smoothing import GestureSmoothing
+
+STAGES = ('read', 'prepare', 'color', 'inference', 'analysis', 'rules')
+PERCENTILES = (50, 95, 99)
+
+
+def replay_clip(path, recognizer, hand_roi, max_frames=None, default_fps=30.0, smoothing=None, recorder=None):
+    """
+    Run one clip through the pipeline. Returns the per-stage timings (seconds,
+    one entry per frame), the emitted events, the events an unsmoothed
+    pipeline emitted for the same frames and the number of frames. Every
+    analysed frame is written to `recorder`, a LandmarkRecorder, if given.
+    """
+    timings = {stage: [] for stage in STAGES}
+    events = []
+    raw_events = []
+    capture = open_frame_source(path)
+    fps = source_fps(capture, default_fps)
+    hand_roi.reset()
+
+    frame_index = 0
+    clip_time = 0.0
+
+    def collect(into):
+        return lambda is_pointing, command: into.append({
+            'clip': path,
+            'frame': frame_index,
+            'time': round(clip_time, 3),
+            'pointing': is_pointing,
+            'command': command,
+        })
+
+    pipeline = GesturePipeline(collect(events), smoothing=smoothing)
+    raw_pipeline = GesturePipeline(collect(raw_events)) if smoothing is not None else None
+    buffer = None
+    try:
+        while max_frames is None or frame_index < max_frames:
+            t0 = time.perf_counter()
+            success, image = capture.read(buffer)
+            if not success:
+                break
+            buffer = image
+            t1 = time.perf_counter()
+            cropped, region = hand_roi.prepare(image)
+            t2 = time.perf_counter()
+            image_rgb = cv2.cvtColor(cropped, cv2.COLOR_BGR2RGB)
+            t3 = time.perf_counter()
+            recognition_result = recognizer.recognize(to_mp_image(image_rgb))
+            t4 = time.perf_counter()
+            frame = FrameAnalysis.from_recognition(recognition_result, region)
+            hand_roi.update(frame.landmarks)
+            t5 = time.perf_counter()
+            clip_time = frame_index / fps
+            pipeline.process(frame, now=clip_time)
+            t6 = time.perf_counter()
+            if raw_pipeline is not None:
+                raw_pipeline.process(frame, now=clip_time)
+            if recorder is not None:
+                recorder.write(frame, clip_time)
+
+            for stage, start, end in zip(STAGES, (t0, t1, t2, t3, t4, t5), (t1, t2, t3, t4, t5, t6)):
+                timings[stage].append(end - start)
+            frame_index += 1
+    finally:
+        capture.release()
+    return timings, events, raw_events, frame_index
+
+
+def compare_smoothing(events, raw_events):
+    """
+    Event reduction and added latency of the smoothed events: each one is
+    matched with the latest unsmoothed event of the same kind and command
+    that came at or before it in the same clip.
+    """
+    delays = []
+    for event in events:
+        matches = [raw['time'] for raw in raw_events
+                   if raw['clip'] == event['clip'] and raw['pointing'] == event['pointing']
+                   and raw['command'] == event['command'] and raw['frame'] <= event['frame']]
+        if matches:
+            delays.append((event['time'] - max(matches)) * 1000)
+    comparison = {
+        'events_unsmoothed': len(raw_events),
+        'events_smoothed': len(events),
+        'event_reduction': round(1 - len(events) / len(raw_events), 3) if raw_events else 0.0,
+    }
+    if delays:
+        comparison['added_latency_ms'] = {
+            'mean': round(float(np.mean(delays)), 1),
+            **{f'p{p}': round(float(v), 1) for p, v in zip(PERCENTILES, np.percentile(delays, PERCENTILES))},
+            'max': round(float(np.max(delays)), 1),
+        }
+    return comparison
+
+
+def summarize(timings, frames, wall_time):
+    summary = {
+        'frames': frames,
+        'wall_time_s': round(wall_time, 3),
+        'fps': round(frames / wall_time, 2) if wall_time > 0 else None,
+        'stages_ms': {},
+    }
+    total = np.zeros(frames)
+    for stage in STAGES:
+        values = np.asarray(timings[stage]) * 1000
+        if len(values) == 0:
+            continue
+        total += values
+        summary['stages_ms'][stage] = {
+            f'p{p}': round(float(v), 3) for p, v in zip(PERCENTILES, np.percentile(values, PERCENTILES))
+        }
+    if frames:
+        summary['stages_ms']['total'] = {
+            f'p{p}': round(float(v), 3) for p, v in zip(PERCENTILES, np.percentile(total, PERCENTILES))
+        }
+    return summary
+
+
+def print_report(summary, events):
+    print(f"{summary['frames']} frames in {summary['wall_time_s']} s -> {summary['fps']} FPS")
+    print(f"{'stage':<10}" + ''.join(f"{f'p{p} ms':>10}" for p in PERCENTILES))
+    for stage, values in summary['stages_ms'].items():
+        print(f'{stage:<10}' + ''.join(f'{values[f"p{p}"]:>10.3f}' for p in PERCENTILES))
+    if 'smoothing' in summary:
+        comparison = summary['smoothing']
+        print(f"smoothing: {comparison['events_unsmoothed']} -> {comparison['events_smoothed']} events "
+              f"({comparison['event_reduction']:.1%} fewer)")
+        if 'added_latency_ms' in comparison:
+            latency = comparison['added_latency_ms']
+            print('  added latency ms: ' + ', '.join(f'{name} {value}' for name, value in latency.items()))
+    print(f'{len(events)} events')
+    for event in events:
+        kind = 'pointing' if event['pointing'] else 'command'
+        print(f"  {event['clip']} @{event['time']:.3f}s (frame {event['frame']}): {kind} {event['command']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('clips', nargs='+', help='video files or directories of images')
+    parser.add_argument('--model', default='gesture_recognizer.task')
+    parser.add_argument('--num-hands', type=int, default=2)
+    parser.add_argument('--resolution', type=int, default=HandRoi.DEFAULTS['resolution'],
+                        help='longest side of the inference input, 0 keeps the clip resolution')
+    parser.add_argument('--no-roi', action='store_true', help='always run on the full frame')
+    parser.add_argument('--margin', type=float, default=HandRoi.DEFAULTS['margin'])
+    parser.add_argument('--window', type=int, default=1, help='temporal smoothing window in frames (1 disables it)')
+    parser.add_argument('--min-votes', type=int, default=0, help='votes needed within the window, 0 for all of them')
+    parser.add_argument('--hysteresis', type=float, default=0.0, help='pointing angle hysteresis in degrees')
+    parser.add_argument('--fps', type=float, default=30.0, help='clip rate when the source does not report one')
+    parser.add_argument('--max-frames', type=int, default=None, help='per clip')
+    parser.add_argument('--json', metavar='PATH', help='also write the report as JSON')
+    parser.add_argument('--record', metavar='DIR', help='write the landmarks of each clip to DIR')
+    args = parser.parse_args()
+
+    recognizer = create_recognizer(model_asset_path=args.model, num_hands=args.num_hands)
+    hand_roi = HandRoi(roi=not args.no_roi, resolution=args.resolution, margin=args.margin)
+    smoothed = args.window > 1 or args.hysteresis > 0
+
+    timings = {stage: [] for stage in STAGES}
+    events = []
+    raw_events = []
+    frames = 0
+    start = time.perf_counter()
+    try:
+        for clip in args.clips:
+            # A fresh smoothing state per clip
+            smoothing = GestureSmoothing(args.window, args.min_votes, args.hysteresis) if smoothed else None
+            recorder = None
+            if args.record:
+                name = os.path.basename(os.path.normpath(clip))
+                recorder = LandmarkRecorder(os.path.join(args.record, os.path.splitext(name)[0] + EXTENSION),
+                                            {'source': clip, 'model': args.model, **hand_roi.to_config()})
+            try:
+                clip_timings, clip_events, clip_raw_events, clip_frames = replay_clip(
+                    clip, recognizer, hand_roi, args.max_frames, args.fps, smoothing, recorder)
+            finally:
+                if recorder is not None:
+                    recorder.close()
+            for stage in STAGES:
+                timings[stage].extend(clip_timings[stage])
+            events.extend(clip_events)
+            raw_events.extend(clip_raw_events)
+            frames += clip_frames
+    finally:
+        recognizer.close()
+    wall_time = time.perf_counter() - start
+
+    summary = summarize(timings, frames, wall_time)
+    summary['config'] = {
+        'model': args.model,
+        'num_hands': args.num_hands,
+        **hand_roi.to_config(),
+    }
+    if smoothed:
+        summary['config'].update(window=args.window, min_votes=args.min_votes, hysteresis=args.hysteresis)
+        summary['smoothing'] = compare_smoothing(events, raw_events)
+    print_report(summary, events)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({**summary, 'events': events}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
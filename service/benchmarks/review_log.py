@@ -0,0 +1,90 @@
+"""
+Many students posting reviews at once: ReviewLog, which commits whatever
+is queued as one WAL transaction without fsync, against one transaction
+per review in SQLite's default rollback journal with full sync.
+
+Each client thread posts one review at a time and waits for it to be
+stored, as the /reviews endpoint does.
+
+Run from the service directory:
+    python -m benchmarks.review_log --clients 1 8 64 --reviews 200
+"""
+import argparse
+import os
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+
+from review_log import SCHEMA, UPSERT_STATE, ReviewLog
+
+
+class NaiveLog:
+    # One transaction per review, behind a lock as sqlite3 connections are not shared
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.execute('PRAGMA synchronous=FULL')
+        self.connection.executescript(SCHEMA)
+        self.lock = threading.Lock()
+
+    def append(self, rows):
+        with self.lock, self.connection:
+            self.connection.execute('BEGIN IMMEDIATE')
+            for row in rows:
+                cursor = self.connection.execute(
+                    'INSERT INTO reviews (user, deck, card, rating, reviewed_at, ease, interval, next_review_at, '
+                    'received_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', row + (time.time(),))
+                self.connection.execute(UPSERT_STATE, row + (cursor.lastrowid,))
+
+    def close(self):
+        self.connection.close()
+
+
+def run(log, clients, reviews):
+    latencies = [[] for _ in range(clients)]
+
+    def client(index):
+        now = time.time()
+        for i in range(reviews):
+            row = (f'student-{index}', 'deck', f'card-{i % 50}', i % 4, now + i, 5.0, 1.0, now + i + 86400)
+            start = time.perf_counter()
+            log.append([row])
+            latencies[index].append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=client, args=(index,)) for index in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    latencies = sorted(latency for client_latencies in latencies for latency in client_latencies)
+    return {
+        'reviews_per_s': len(latencies) / elapsed,
+        'p50_ms': statistics.median(latencies) * 1e3,
+        'p99_ms': latencies[int(len(latencies) * 0.99) - 1] * 1e3,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, nargs='+', default=[1, 8, 64])
+    parser.add_argument('--reviews', type=int, default=200, help='per client')
+    parser.add_argument('--dir', help='where to create the databases, a temporary directory by default')
+    args = parser.parse_args()
+
+    print(f"{'clients':>7} {'log':>6} {'reviews/s':>10} {'p50 ms':>8} {'p99 ms':>8}")
+    with tempfile.TemporaryDirectory(dir=args.dir) as directory:
+        for clients in args.clients:
+            for name, make_log in (('naive', NaiveLog), ('batch', ReviewLog)):
+                path = os.path.join(directory, f'{name}-{clients}.db')
+                log = make_log(path)
+                result = run(log, clients, args.reviews)
+                log.close()
+                print(f"{clients:>7} {name:>6} {result['reviews_per_s']:>10.0f} {result['p50_ms']:>8.2f} "
+                      f"{result['p99_ms']:>8.2f}")
+
+
+if __name__ == '__main__':
+    main()
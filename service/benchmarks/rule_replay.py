@@ -0,0 +1,161 @@
+"""
+Replays landmark recordings through the gesture rules, the pointing
+buckets and the swipe and flick tracking without running a model, and
+reports how much faster than real time that is and the events they produce.
+
+Recordings come from sessions enabled with "record": true, or from clips
+with `python -m benchmarks.replay clips/ --record recordings/`. With
+--synthetic SECONDS a scripted recording is generated instead.
+
+As a regression suite, --write-expected PATH saves the events of every
+recording and --expect PATH exits with status 1 when a replay no longer
+produces them, e.g. after changing gesture_rules.json or the trajectory
+thresholds.
+
+Run from the service directory:
+    python -m benchmarks.rule_replay recordings/ --window 3 --expect recordings/expected.json
+"""
+import argparse
+import json
+import math
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from frame_analysis import FrameAnalysis
+from gesture_recognizer import INDEX_MCP, INDEX_TIP, MIDDLE_MCP, NUM_LANDMARKS, WRIST
+from landmark_recording import EXTENSION, LandmarkRecorder, LandmarkRecording, recording_paths, replay
+from rule_engine import RuleEngine
+from smoothing import GestureSmoothing
+from trajectory import TrajectoryTracker
+
+# (gesture, raised fingers, seconds, hand center x from, to, pointing angle from, to)
+SCRIPT = (
+    ('Open_Palm', 4, 1.0, 0.5, 0.5, -90, -90),
+    ('Pointing_Up', 1, 2.0, 0.5, 0.5, -75, -105),
+    ('Pointing_Up', 1, 1.5, 0.35, 0.35, -90, -90),
+    ('Closed_Fist', 0, 1.0, 0.5, 0.5, -90, -90),
+    ('None', 2, 1.0, 0.5, 0.5, -90, -90),
+    ('Thumb_Up', 0, 1.0, 0.5, 0.5, -90, -90),
+    ('None', 4, 1.5, 0.2, 0.8, -90, -90),
+    (None, 0, 0.5, 0.5, 0.5, -90, -90),
+)
+
+
+def synthetic_hand(center_x, fingers, angle):
+    """Landmarks of an upright hand with `fingers` raised, the index at `angle` degrees"""
+    hand = np.zeros((NUM_LANDMARKS, 3), dtype=np.float32)
+    base_y = 0.5
+    for finger in range(4):
+        mcp, pip, tip = 5 + 4 * finger, 6 + 4 * finger, 8 + 4 * finger
+        x = center_x - 0.03 + 0.02 * finger
+        hand[mcp:tip + 1, 0] = x
+        hand[mcp, 1], hand[pip, 1], hand[mcp + 2, 1] = base_y, base_y - 0.04, base_y - 0.07
+        # A folded finger has its tip below its PIP joint
+        hand[tip, 1] = base_y - 0.1 if finger < fingers else base_y - 0.02
+    hand[WRIST, :2] = center_x, base_y + 0.15
+    hand[1:5, 0] = center_x - 0.06
+    hand[1:5, 1] = np.linspace(base_y + 0.1, base_y, 4)
+    radians = math.radians(angle)
+    hand[INDEX_TIP, :2] = hand[INDEX_MCP, 0] + 0.1 * math.cos(radians), base_y + 0.1 * math.sin(radians)
+    hand[MIDDLE_MCP, 0] = center_x - 0.03 + 0.02
+    return hand
+
+
+def write_synthetic(path, seconds, fps=30.0):
+    """Loop SCRIPT for `seconds` at `fps` frames per second into a recording"""
+    with LandmarkRecorder(path, {'source': 'synthetic', 'fps': fps}) as recorder:
+        frame_index = 0
+        while frame_index / fps < seconds:
+            for gesture, fingers, duration, x_from, x_to, angle_from, angle_to in SCRIPT:
+                steps = int(duration * fps)
+                for step in range(steps):
+                    progress = step / max(steps - 1, 1)
+                    if gesture is None:
+                        frame = FrameAnalysis()
+                    else:
+                        hand = synthetic_hand(x_from + (x_to - x_from) * progress, fingers,
+                                              angle_from + (angle_to - angle_from) * progress)
+                        frame = FrameAnalysis(hand, [gesture], ['Right'], [0.9], [0.95])
+                    recorder.write(frame, frame_index / fps)
+                    frame_index += 1
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('recordings', nargs='*', help=f'{EXTENSION} files or directories of them')
+    parser.add_argument('--synthetic', type=float, metavar='SECONDS', help='replay a generated recording')
+    parser.add_argument('--rules', help='gesture rules JSON, gesture_rules.json by default')
+    parser.add_argument('--window', type=int, default=3, help='temporal smoothing window in frames')
+    parser.add_argument('--min-votes', type=int, default=0, help='votes needed within the window, 0 for all of them')
+    parser.add_argument('--hysteresis', type=float, default=5.0, help='pointing angle hysteresis in degrees')
+    parser.add_argument('--swipe-distance', type=float, default=TrajectoryTracker.DEFAULTS['distance'])
+    parser.add_argument('--swipe-window', type=int, default=TrajectoryTracker.DEFAULTS['window'], help='samples')
+    parser.add_argument('--flick-distance', type=float, default=TrajectoryTracker.DEFAULTS['flick_distance'])
+    parser.add_argument('--expect', metavar='PATH', help='fail unless the events match those saved in PATH')
+    parser.add_argument('--write-expected', metavar='PATH', help='save the events to PATH')
+    args = parser.parse_args()
+
+    paths = recording_paths(args.recordings)
+    temporary = None
+    if args.synthetic:
+        temporary = tempfile.TemporaryDirectory()
+        paths.append(write_synthetic(os.path.join(temporary.name, f'synthetic{EXTENSION}'), args.synthetic))
+    if not paths:
+        parser.error('no recordings, give some or --synthetic SECONDS')
+
+    results = {}
+    total_frames = total_duration = total_wall = 0.0
+    print(f"{'recording':<32} {'frames':>7} {'seconds':>8} {'replay ms':>10} {'x real time':>12} {'events':>7}")
+    for path in paths:
+        recording = LandmarkRecording(path)
+        trajectory = TrajectoryTracker.from_config({'distance': args.swipe_distance, 'window': args.swipe_window,
+                                                    'flick_distance': args.flick_distance})
+        start = time.perf_counter()
+        events, motions = replay(recording, RuleEngine.from_file(args.rules),
+                                 GestureSmoothing(args.window, args.min_votes, args.hysteresis), trajectory)
+        wall = time.perf_counter() - start
+        name = os.path.basename(path)
+        results[name] = {'events': events, 'motions': motions}
+        total_frames += len(recording)
+        total_duration += recording.duration
+        total_wall += wall
+        speed = recording.duration / wall if wall > 0 else math.inf
+        print(f'{name:<32} {len(recording):>7} {recording.duration:>8.1f} {wall * 1e3:>10.1f} {speed:>12.0f} '
+              f'{len(events) + len(motions):>7}')
+    if len(paths) > 1:
+        print(f"{'total':<32} {int(total_frames):>7} {total_duration:>8.1f} {total_wall * 1e3:>10.1f} "
+              f'{total_duration / total_wall:>12.0f}')
+    if temporary is not None:
+        temporary.cleanup()
+
+    if args.write_expected:
+        with open(args.write_expected, 'w') as f:
+            json.dump(results, f, indent=1)
+    if args.expect:
+        with open(args.expect) as f:
+            expected = json.load(f)
+        failed = [name for name in results if name in expected and results[name] != expected[name]]
+        missing = [name for name in results if name not in expected]
+        for name in failed:
+            for kind in ('events', 'motions'):
+                got, wanted = results[name][kind], expected[name][kind]
+                if got != wanted:
+                    # The first difference, the rest usually follows from it
+                    index = next((i for i, (a, b) in enumerate(zip(got, wanted)) if a != b),
+                                 min(len(got), len(wanted)))
+                    print(f'FAIL {name}: {len(got)} {kind}, expected {len(wanted)}; {kind} {index} is '
+                          f'{got[index] if index < len(got) else None}, expected '
+                          f'{wanted[index] if index < len(wanted) else None}')
+        for name in missing:
+            print(f'no expected events for {name}')
+        if failed:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+"""
+Flashcard scheduling on a large synthetic deck: FlashcardScheduler's column
+arrays and heaps against a straight port of src/flashcardsScheduler.js,
+which filters and sorts the whole deck for every card it hands out.
+
+    batch      next_interval for one review of every card
+    next card  pick the next due card and review it, one at a time
+
+Run from the service directory:
+    python -m benchmarks.scheduler --cards 100000
+"""
+import argparse
+import functools
+import math
+import random
+import time
+
+import numpy as np
+
+from flashcard_scheduler import DAY, FlashcardScheduler, next_interval
+
+
+# Reference implementation, as in src/flashcardsScheduler.js
+def legacy_next_interval(retrieval_success, current_stability, difficulty, elapsed_days, noise):
+    retrievability = math.exp(math.log(0.9) * (elapsed_days / current_stability)) if current_stability else 0
+    new_difficulty, new_stability = difficulty, current_stability
+    if retrieval_success == 0:
+        new_difficulty = min(10, difficulty + 0.8)
+        new_stability = 0.5
+    elif retrieval_success == 1:
+        new_difficulty = min(10, difficulty + 0.4)
+        new_stability = current_stability * (1 + 1.2 * (10 - difficulty) * (1 - retrievability))
+    elif retrieval_success == 2:
+        new_difficulty = max(1, difficulty - 0.1)
+        new_stability = current_stability * (1 + 1.8 * (10 - difficulty) * (1 - retrievability))
+    elif retrieval_success == 3:
+        new_difficulty = max(1, difficulty - 0.2)
+        new_stability = current_stability * (1 + 2.5 * (10 - difficulty) * (1 - retrievability))
+    new_stability = min(max(new_stability * noise, 0.5), 1825)
+    return math.floor(new_stability + 0.5), new_difficulty
+
+
+def legacy_compare(now):
+    def compare(a, b):
+        a_bad = a['retrievalSuccess'] is not None and a['retrievalSuccess'] <= 1
+        b_bad = b['retrievalSuccess'] is not None and b['retrievalSuccess'] <= 1
+        if a_bad != b_bad:
+            return -1 if a_bad else 1
+        if a_bad:
+            return (now - b['nextReviewAt']) - (now - a['nextReviewAt'])
+        a_reviewed, b_reviewed = a['reviewedAt'] is not None, b['reviewedAt'] is not None
+        if a_reviewed != b_reviewed:
+            return -1 if a_reviewed else 1
+        if a_reviewed:
+            return a['nextReviewAt'] - b['nextReviewAt']
+        # Math.random() - 0.5 in the client, a fixed rank here so both pick the same card
+        return a['rank'] - b['rank']
+    return functools.cmp_to_key(compare)
+
+
+def legacy_schedule(cards, now):
+    due = [card for card in cards if card['nextReviewAt'] <= now]
+    return sorted(due, key=legacy_compare(now))
+
+
+def legacy_review(card, retrieval_success, now, noise):
+    elapsed_days = (now - card['reviewedAt']) / DAY if card['reviewedAt'] is not None else 0
+    interval, ease = legacy_next_interval(retrieval_success, card['interval'], card['ease'], elapsed_days, noise)
+    card.update(interval=interval, ease=ease, reviewedAt=now, retrievalSuccess=retrieval_success,
+                nextReviewAt=now + interval * DAY)
+
+
+def synthetic_deck(count, now, rng):
+    """A deck where 30% of the cards are new and the others were reviewed over the last year"""
+    scheduler = FlashcardScheduler(seed=0)
+    reviewed = rng.random(count) >= 0.3
+    interval = np.where(reviewed, rng.integers(0, 365, count), 0).astype(np.float64)
+    reviewed_at = np.where(reviewed, now - rng.random(count) * 365 * DAY, np.nan)
+    next_review_at = np.where(reviewed, reviewed_at + interval * DAY, now)
+    scheduler.add_cards(count, ease=np.where(reviewed, rng.uniform(1, 10, count), 5.0), interval=interval,
+                        reviewed_at=reviewed_at, next_review_at=next_review_at,
+                        retrieval_success=np.where(reviewed, rng.integers(0, 4, count), -1), now=now)
+    legacy = [{
+        'ease': float(scheduler.ease[i]),
+        'interval': float(scheduler.interval[i]),
+        'reviewedAt': None if math.isnan(scheduler.reviewed_at[i]) else float(scheduler.reviewed_at[i]),
+        'nextReviewAt': float(scheduler.next_review_at[i]),
+        'retrievalSuccess': None if scheduler.retrieval_success[i] < 0 else int(scheduler.retrieval_success[i]),
+        'rank': float(scheduler._rank[i]),
+        'index': i,
+    } for i in range(count)]
+    return scheduler, legacy
+
+
+def bench_batch(scheduler, legacy, now, rng):
+    count = len(legacy)
+    ratings = rng.integers(0, 4, count)
+    noise = rng.random(count) * 0.1 + 0.95
+    elapsed_days = np.where(np.isnan(scheduler.reviewed_at[:count]), 0.0, (now - scheduler.reviewed_at[:count]) / DAY)
+
+    start = time.perf_counter()
+    interval, ease, _ = next_interval(ratings, scheduler.interval[:count], scheduler.ease[:count], elapsed_days, noise)
+    vectorized = time.perf_counter() - start
+
+    start = time.perf_counter()
+    expected = [legacy_next_interval(int(ratings[i]), card['interval'], card['ease'], float(elapsed_days[i]),
+                                     float(noise[i])) for i, card in enumerate(legacy)]
+    scalar = time.perf_counter() - start
+
+    assert np.allclose(interval, [value for value, _ in expected])
+    assert np.allclose(ease, [value for _, value in expected])
+    return scalar, vectorized
+
+
+def bench_next_card(scheduler, legacy, now, rng, reviews, legacy_reviews):
+    ratings = rng.integers(0, 4, reviews).tolist()
+    noise = (rng.random(reviews) * 0.1 + 0.95).tolist()
+    # Both run on the same deck with the same noise, so they hand out the same cards
+    scheduler.rng = _FixedNoise(noise)
+
+    start = time.perf_counter()
+    picked = []
+    for i in range(reviews):
+        card = scheduler.next_due(now + i)
+        picked.append(card)
+        scheduler.review([card], ratings[i], now + i)
+    heap = (time.perf_counter() - start) / reviews
+
+    start = time.perf_counter()
+    for i in range(legacy_reviews):
+        card = legacy_schedule(legacy, now + i)[0]
+        assert card['index'] == picked[i], f'review {i}: legacy picked {card["index"]}, heap {picked[i]}'
+        legacy_review(card, ratings[i], now + i, noise[i])
+    legacy_time = (time.perf_counter() - start) / legacy_reviews
+    return legacy_time, heap
+
+
+class _FixedNoise:
+    # Stands in for the scheduler's generator: hands out the given noise in order
+    def __init__(self, values):
+        self.values = iter(values)
+
+    def random(self, size):
+        return (np.array([next(self.values) for _ in range(size)]) - 0.95) / 0.1
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cards', type=int, nargs='+', default=[10000, 100000, 300000])
+    parser.add_argument('--reviews', type=int, default=2000, help='cards handed out by the heap per deck')
+    parser.add_argument('--legacy-reviews', type=int, default=20, help='cards handed out by the port, it is slow')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    now = time.time()
+    random.seed(args.seed)
+    print(f"{'cards':>7} {'batch legacy ms':>16} {'batch array ms':>15} {'speedup':>8} "
+          f"{'next legacy ms':>15} {'next heap us':>13} {'speedup':>8}")
+    for count in args.cards:
+        rng = np.random.default_rng(args.seed)
+        scheduler, legacy = synthetic_deck(count, now, rng)
+        scalar, vectorized = bench_batch(scheduler, legacy, now, rng)
+        legacy_next, heap_next = bench_next_card(scheduler, legacy, now, rng, args.reviews,
+                                                 min(args.legacy_reviews, args.reviews))
+        print(f"{count:>7} {scalar * 1e3:>16.1f} {vectorized * 1e3:>15.2f} {scalar / vectorized:>7.0f}x "
+              f"{legacy_next * 1e3:>15.1f} {heap_next * 1e6:>13.1f} {legacy_next / heap_next:>7.0f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""
+Cold start of the service: how long importing flask-app.py takes, i.e. how
+long before Flask can bind its port, and how long the background model
+warm-up takes after that. Every run is a fresh interpreter.
+
+Exits with status 1 when the median import time is over --budget, so it can
+guard against a heavy import or an eager model load creeping back in.
+
+Run from the service directory:
+    python -m benchmarks.startup --runs 5 --budget 1.5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Written to stderr once the app is imported, the imports of the warm-up come after it
+IMPORTED_MARKER = '-- flask-app.py imported'
+
+# Executed in the child interpreter. The app file name has a hyphen, so it is
+# loaded by path; registered in sys.modules because the app looks itself up there
+CHILD = '''
+import importlib.util, json, sys, time
+start = time.perf_counter()
+spec = importlib.util.spec_from_file_location('flask_app', 'flask-app.py')
+app = importlib.util.module_from_spec(spec)
+sys.modules['flask_app'] = app
+spec.loader.exec_module(app)
+imported = time.perf_counter()
+sys.stderr.write('{marker}\\n')
+warm_up = None
+if {warm_up}:
+    app.models.warm_up().join()
+    warm_up = time.perf_counter() - imported
+print(json.dumps({{'import_s': imported - start, 'warm_up_s': warm_up, 'models': app.models.status()}}))
+'''
+
+
+def parse_importtime(stderr, top=10):
+    """Slowest top-level imports of the app, as (module, cumulative seconds), from -X importtime output"""
+    imports = []
+    for line in stderr.split(IMPORTED_MARKER)[0].splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # Nested imports are indented under the module that imported them
+        if not name.startswith('  '):
+            imports.append((name.strip(), int(cumulative) / 1e6))
+    return sorted(imports, key=lambda item: item[1], reverse=True)[:top]
+
+
+def run_once(warm_up):
+    child = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', CHILD.format(warm_up=warm_up, marker=IMPORTED_MARKER)],
+        cwd=SERVICE_DIR, capture_output=True, text=True, check=True,
+    )
+    result = json.loads(child.stdout.strip().splitlines()[-1])
+    result['imports'] = parse_importtime(child.stderr)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--budget', type=float, default=1.5, help='seconds allowed to import the app (median)')
+    parser.add_argument('--no-warm-up', action='store_true', help='only measure the import')
+    parser.add_argument('--json', metavar='PATH', help='also write the report as JSON')
+    args = parser.parse_args()
+
+    runs = [run_once(not args.no_warm_up) for _ in range(args.runs)]
+    import_times = [run['import_s'] for run in runs]
+    summary = {
+        'runs': args.runs,
+        'import_s': {'median': round(statistics.median(import_times), 3), 'max': round(max(import_times), 3)},
+        'budget_s': args.budget,
+        'imports': [(name, round(seconds, 3)) for name, seconds in runs[-1]['imports']],
+    }
+    if not args.no_warm_up:
+        summary['warm_up_s'] = round(statistics.median(run['warm_up_s'] for run in runs), 3)
+        summary['models'] = runs[-1]['models']
+
+    print(f"import flask-app.py: median {summary['import_s']['median']} s, "
+          f"max {summary['import_s']['max']} s (budget {args.budget} s)")
+    if 'warm_up_s' in summary:
+        print(f"model warm-up: median {summary['warm_up_s']} s")
+        for name, status in summary['models'].items():
+            print(f"  {name}: {status['state']}" + (f" ({status['error']})" if status['error'] else ''))
+    print('slowest imports:')
+    for name, seconds in summary['imports']:
+        print(f'  {name:<40}{seconds:>8.3f} s')
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(summary, f, indent=2)
+
+    if summary['import_s']['median'] > args.budget:
+        print(f"Import time over budget by {summary['import_s']['median'] - args.budget:.3f} s")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
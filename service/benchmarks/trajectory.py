@@ -0,0 +1,79 @@
+"""
+Cost per frame of the swipe detection: the former GestureRecognizer
+movement check, which copied its window of hand positions into a list and
+rescanned it on every frame, against TrajectoryTracker, which compares the
+ends of the window and keeps running counts of its steps. The former check
+had no flicks, the tracker is timed with flicks off and on.
+
+Both are fed the same random walk of the hand center, sampled on every
+frame, for each window size.
+
+Run from the service directory:
+    python -m benchmarks.trajectory --frames 100000 --windows 5 20 100
+"""
+import argparse
+import time
+from collections import deque
+
+import numpy as np
+
+from trajectory import TrajectoryTracker
+
+
+def rescan(positions, frames, threshold):
+    # The former _analyze_movement_pattern, left to right only
+    if len(positions) < frames:
+        return False
+    recent = list(positions)[-frames:]
+    if recent[-1][0] - recent[0][0] < threshold:
+        return False
+    rightward = sum(1 for i in range(1, len(recent)) if recent[i][0] > recent[i - 1][0])
+    return rightward >= len(recent) * 0.7
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--frames', type=int, default=100000)
+    parser.add_argument('--windows', type=int, nargs='+', default=[5, 20, 100])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=5, help='runs of each, the fastest counts')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    centers = np.clip(0.5 + np.cumsum(rng.normal(0, 0.01, (args.frames, 2)), axis=0), 0, 1).tolist()
+
+    def best(run):
+        # us per frame of the fastest run, and what it returned
+        timings = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            result = run()
+            timings.append(time.perf_counter() - start)
+        return min(timings) / args.frames * 1e6, result
+
+    def legacy(window, threshold):
+        positions = deque(maxlen=window * 2)
+        for center in centers:
+            positions.append(center)
+            rescan(positions, window, threshold)
+
+    def tracked(tracker):
+        motions = 0
+        for index, center in enumerate(centers):
+            motions += tracker.update(center, index / 30) is not None
+        return motions
+
+    print(f"{'window':>6} {'rescan us':>10} {'tracker us':>11} {'speedup':>8} {'+ flicks us':>12} {'motions':>8}")
+    for window in args.windows:
+        threshold = 0.1
+        rescanned, _ = best(lambda: legacy(window, threshold))
+        swipes_only, _ = best(lambda: tracked(TrajectoryTracker(window=window, distance=threshold, sample_interval=0,
+                                                                flick_seconds=0)))
+        with_flicks, motions = best(lambda: tracked(TrajectoryTracker(window=window, distance=threshold,
+                                                                      sample_interval=0)))
+        print(f'{window:>6} {rescanned:>10.2f} {swipes_only:>11.2f} {rescanned / swipes_only:>7.1f}x '
+              f'{with_flicks:>12.2f} {motions:>8}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+import logging
+import threading
+
+import cv2
+import numpy as np
+
+from frame_source import open_frame_source
+
+logger = logging.getLogger(__name__)
+
+
+class CameraCapture:
+    """
+    Reads frames on a dedicated thread so that slow inference never works on
+    stale frames queued by the driver.
+
+    Frames are written into a small ring of preallocated numpy arrays that are
+    reused for the whole capture, so no array is allocated per frame. The
+    consumer always gets the newest frame; the frames it never got to see are
+    counted in `frames_dropped`.
+    """
+
+    def __init__(self, source=0, slots=3):
+        """`source` is anything open_frame_source accepts: webcam index, video file or image directory"""
+        # One slot for the newest frame, one held by the consumer and at least
+        # one the capture thread can write into
+        if slots < 3:
+            raise ValueError('CameraCapture needs at least 3 slots')
+        self.source = source
+        self.slots = slots
+
+        self.frames_captured = 0
+        self.frames_dropped = 0
+
+        self._cap = None
+        self._thread = None
+        self._frames = []
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._latest = None     # slot of the newest frame
+        self._latest_seq = 0    # sequence number of the newest frame
+        self._held = None       # slot currently handed out by read()
+        self._read_seq = 0      # sequence number of the last frame handed out
+        self._running = False
+
+    def start(self):
+        self._cap = open_frame_source(self.source)
+        # Keep the driver queue as short as possible, we only want the newest frame
+        self._cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        success, first = self._cap.read()
+        if not success:
+            self._cap.release()
+            return False
+        self._frames = [first] + [np.empty_like(first) for _ in range(self.slots - 1)]
+        self._publish(0)
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return True
+
+    def read(self, timeout=2.0):
+        """
+        Wait for a frame newer than the last one returned and return
+        `(success, frame)` like cv2.VideoCapture.read. The frame stays valid
+        until the next call to read(). `success` is False once the capture
+        stopped or no new frame arrived within `timeout` seconds.
+        """
+        with self._cond:
+            self._cond.wait_for(
+                lambda: self._latest_seq > self._read_seq or not self._running,
+                timeout=timeout,
+            )
+            if self._latest_seq <= self._read_seq:
+                return False, None
+            self.frames_dropped += self._latest_seq - self._read_seq - 1
+            self._read_seq = self._latest_seq
+            self._held = self._latest
+            return True, self._frames[self._held]
+
+    def release(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+        if self._cap is not None:
+            self._cap.release()
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+
+    def _free_slot(self):
+        with self._cond:
+            for slot in range(self.slots):
+                if slot != self._latest and slot != self._held:
+                    return slot
+
+    def _publish(self, slot):
+        with self._cond:
+            self._latest = slot
+            self._latest_seq += 1
+            self.frames_captured += 1
+            self._cond.notify_all()
+
+    def _run(self):
+        try:
+            while not self._stop.is_set():
+                slot = self._free_slot()
+                frame = self._frames[slot]
+                success, image = self._cap.read(frame)
+                if not success:
+                    logger.warning('Unable to read video')
+                    break
+                if image is not frame:
+                    # The source changed resolution, reallocate this slot
+                    self._frames[slot] = image
+                self._publish(slot)
+        finally:
+            with self._cond:
+                self._running = False
+                self._cond.notify_all()
@@ -0,0 +1,229 @@
+import heapq
+import time
+
+import numpy as np
+
+DAY = 24 * 60 * 60
+DEFAULT_DIFFICULTY = 5.0
+MAXIMUM_INTERVAL = 1825  # Days
+
+# Ratings, as retrievalSuccess in src/flashcardsScheduler.js
+AGAIN, HARD, GOOD, EASY = 0, 1, 2, 3
+NOT_REVIEWED = -1
+
+MINIMUM_STABILITY = 0.5  # Days
+
+# Weights of FlashcardsScheduler.nextInterval, as fsrs_optimizer exports them.
+# Lists are indexed by rating; again restarts learning at againStability,
+# so stabilityFactor[AGAIN] is unused.
+DEFAULT_PARAMETERS = {
+    'initialDifficulty': DEFAULT_DIFFICULTY,
+    'difficultyDelta': [0.8, 0.4, -0.1, -0.2],
+    'stabilityFactor': [0.0, 1.2, 1.8, 2.5],
+    'againStability': 0.5,
+    'initialStability': [0.5, 0.5, 0.5, 0.5],
+}
+
+# Classes of the due queue, in the order of prioritizeFlashcards
+_BAD_RECALL, _REVIEWED, _NEW = 0, 1, 2
+
+
+def interval_noise(rng, size):
+    """Random factors between 0.95 and 1.05"""
+    return rng.random(size) * 0.1 + 0.95
+
+
+def next_interval(retrieval_success, stability, difficulty, elapsed_days, noise, parameters=DEFAULT_PARAMETERS):
+    """
+    FlashcardsScheduler.nextInterval on arrays of reviews. `elapsed_days` is
+    0 and `stability` 0 for cards never reviewed. Returns (interval,
+    difficulty, stability) arrays; ratings other than 0 to 3 keep the
+    stability and difficulty.
+    """
+    retrieval_success = np.asarray(retrieval_success)
+    stability = np.asarray(stability, dtype=np.float64)
+    difficulty = np.asarray(difficulty, dtype=np.float64)
+    rated = (retrieval_success >= AGAIN) & (retrieval_success <= EASY)
+    rating = np.where(rated, retrieval_success, GOOD)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        retrievability = np.where(stability != 0, np.exp(np.log(0.9) * (elapsed_days / stability)), 0.0)
+
+    difficulty_delta = np.asarray(parameters['difficultyDelta'])
+    stability_factor = np.asarray(parameters['stabilityFactor'])
+    new_difficulty = np.clip(difficulty + difficulty_delta[rating], 1, 10)
+    new_stability = stability * (1 + stability_factor[rating] * (10 - difficulty) * (1 - retrievability))
+    # Again restarts learning, a first review starts at the initial stability of its rating
+    new_stability = np.where(rating == AGAIN, parameters['againStability'], new_stability)
+    new_stability = np.where(stability == 0, np.asarray(parameters['initialStability'])[rating], new_stability)
+    new_difficulty = np.where(rated, new_difficulty, difficulty)
+    new_stability = np.where(rated, new_stability, stability)
+
+    new_stability = np.clip(new_stability * noise, MINIMUM_STABILITY, MAXIMUM_INTERVAL)
+    # Math.round: halves round up
+    interval = np.floor(new_stability + 0.5)
+    return interval, new_difficulty, new_stability
+
+
+class FlashcardScheduler:
+    """
+    Card state in column arrays and a due queue kept as heaps, the server
+    side of src/flashcardsScheduler.js for large decks.
+
+    Times are Unix seconds, NaN where the client has null. review() updates
+    a batch of cards with one vectorized next_interval call.
+
+    next_due() gives the card prioritizeFlashcards would put first among
+    the due ones, in O(log n) amortized instead of a filter and a sort of
+    the whole deck: cards wait in a heap by due time and move to the due
+    heap, ordered by (bad recall, reviewed, new) then due time, as they
+    come due. New cards get a random rank once instead of a random
+    comparator. A reviewed card's old heap entries are skipped when they
+    surface, through a per-card generation.
+
+    `parameters` are the weights of next_interval, DEFAULT_PARAMETERS or
+    those fsrs_optimizer fitted to the student.
+    """
+
+    def __init__(self, capacity=1024, seed=None, parameters=DEFAULT_PARAMETERS):
+        self.size = 0
+        self.parameters = parameters
+        self.rng = np.random.default_rng(seed)
+        self.ease = np.empty(capacity)
+        self.interval = np.empty(capacity)
+        self.reviewed_at = np.empty(capacity)
+        self.next_review_at = np.empty(capacity)
+        self.retrieval_success = np.empty(capacity, dtype=np.int8)
+        self.review_count = np.empty(capacity, dtype=np.int32)
+        self._generation = np.empty(capacity, dtype=np.int64)
+        self._rank = np.empty(capacity)
+        self._waiting = []      # (next review at, card, generation)
+        self._due = []          # (class, due time or rank, card, generation)
+
+    def __len__(self):
+        return self.size
+
+    def _grow(self, size):
+        capacity = len(self.ease)
+        if size <= capacity:
+            return
+        capacity = max(size, capacity * 2)
+        for name in ('ease', 'interval', 'reviewed_at', 'next_review_at', 'retrieval_success',
+                     'review_count', '_generation', '_rank'):
+            column = getattr(self, name)
+            grown = np.empty(capacity, dtype=column.dtype)
+            grown[:self.size] = column[:self.size]
+            setattr(self, name, grown)
+
+    def add_cards(self, count, ease=None, interval=0.0, reviewed_at=np.nan,
+                  next_review_at=None, retrieval_success=NOT_REVIEWED, review_count=0, now=None):
+        """
+        Add `count` cards, each column a scalar or an array of `count` values.
+        Cards are due at `now` unless given a next review time and start at
+        the initial difficulty, like addFlashcard's defaults. Returns the
+        indices of the new cards.
+        """
+        now = time.time() if now is None else now
+        ease = self.parameters['initialDifficulty'] if ease is None else ease
+        start, end = self.size, self.size + count
+        self._grow(end)
+        self.size = end
+        self.ease[start:end] = ease
+        self.interval[start:end] = interval
+        self.reviewed_at[start:end] = reviewed_at
+        self.next_review_at[start:end] = now if next_review_at is None else next_review_at
+        # No next review time is due, and first among the reviewed cards as with `|| 0`
+        added = self.next_review_at[start:end]
+        added[np.isnan(added)] = 0.0
+        self.retrieval_success[start:end] = retrieval_success
+        self.review_count[start:end] = review_count
+        self._generation[start:end] = 0
+        self._rank[start:end] = self.rng.random(count)
+        indices = np.arange(start, end)
+        entries = zip(self.next_review_at[start:end].tolist(), indices.tolist(), [0] * count)
+        if count > len(self._waiting):
+            # Heapify beats pushing one by one when a whole deck is loaded
+            self._waiting.extend(entries)
+            heapq.heapify(self._waiting)
+        else:
+            for entry in entries:
+                heapq.heappush(self._waiting, entry)
+        return indices
+
+    def review(self, cards, retrieval_success, now=None):
+        """Record a batch of reviews, each card at most once, and reschedule them"""
+        now = time.time() if now is None else now
+        cards = np.asarray(cards, dtype=np.int64)
+        retrieval_success = np.broadcast_to(np.asarray(retrieval_success, dtype=np.int8), cards.shape)
+        last_review = self.reviewed_at[cards]
+        elapsed_days = np.where(np.isnan(last_review), 0.0, (now - last_review) / DAY)
+        interval, ease, _ = next_interval(retrieval_success, self.interval[cards], self.ease[cards],
+                                          elapsed_days, interval_noise(self.rng, len(cards)), self.parameters)
+        self.interval[cards] = interval
+        self.ease[cards] = ease
+        self.reviewed_at[cards] = now
+        self.retrieval_success[cards] = retrieval_success
+        self.review_count[cards] += 1
+        self.next_review_at[cards] = now + interval * DAY
+        self._generation[cards] += 1
+        for card, due, generation in zip(cards.tolist(), self.next_review_at[cards].tolist(),
+                                         self._generation[cards].tolist()):
+            heapq.heappush(self._waiting, (due, card, generation))
+
+    def _priority(self, card):
+        success = self.retrieval_success[card]
+        if 0 <= success <= HARD:
+            return _BAD_RECALL, float(self.next_review_at[card])
+        if not np.isnan(self.reviewed_at[card]):
+            return _REVIEWED, float(self.next_review_at[card])
+        return _NEW, float(self._rank[card])
+
+    def _release(self, now):
+        # Move the cards that came due to the due heap
+        waiting, due, generations = self._waiting, self._due, self._generation
+        while waiting and waiting[0][0] <= now:
+            _, card, generation = heapq.heappop(waiting)
+            if generation == generations[card]:
+                heapq.heappush(due, (*self._priority(card), card, generation))
+
+    def next_due(self, now=None):
+        """The due card to study first, None when nothing is due"""
+        self._release(time.time() if now is None else now)
+        due, generations = self._due, self._generation
+        while due:
+            _, _, card, generation = due[0]
+            if generation == generations[card]:
+                return card
+            heapq.heappop(due)
+        return None
+
+    def due_count(self, now=None):
+        now = time.time() if now is None else now
+        next_review_at = self.next_review_at[:self.size]
+        return int(np.count_nonzero(next_review_at <= now))
+
+    def card(self, index):
+        return {
+            'ease': float(self.ease[index]),
+            'interval': float(self.interval[index]),
+            'reviewedAt': None if np.isnan(self.reviewed_at[index]) else float(self.reviewed_at[index]),
+            'nextReviewAt': float(self.next_review_at[index]),
+            'retrievalSuccess': None if self.retrieval_success[index] < 0 else int(self.retrieval_success[index]),
+            'reviewCount': int(self.review_count[index]),
+        }
+
+    def stats(self, now=None):
+        """FlashcardsScheduler.getCardStats"""
+        now = time.time() if now is None else now
+        size = self.size
+        new = np.isnan(self.reviewed_at[:size])
+        learning = ~new & (self.interval[:size] < 1)
+        success = self.retrieval_success[:size]
+        return {
+            'total': size,
+            'new': int(np.count_nonzero(new)),
+            'learning': int(np.count_nonzero(learning)),
+            'review': int(size - np.count_nonzero(new) - np.count_nonzero(learning)),
+            'overdue': int(np.count_nonzero(self.next_review_at[:size] < now)),
+            'badRecall': int(np.count_nonzero((success >= 0) & (success <= HARD))),
+        }
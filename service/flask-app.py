@@ -1,18 +1,78 @@
-from flask import Flask, jsonify
-from flask_socketio import SocketIO, emit
+from flask import Flask, Response, jsonify, request
+from flask_socketio import SocketIO, emit, join_room, leave_room, rooms
 from flask_cors import CORS
-import threading
-import cv2
-from gesture_recognizer import GestureRecognizer
+import atexit
+import functools
+import logging
+import os
+from frame_source import UPLOAD_SOURCE
+from frame_upload import MAX_UPLOAD_BYTES, FrameBatcher
+from fsrs_optimizer import ParameterStore
+from gesture_pipeline import POINTING_BUCKETS
+from gesture_session import DEFAULT_SESSION, SessionManager, session_id_from
+from inference import create_recognizer, warm_up_recognizer
+from inference_pool import InferencePool
+from loop_bridge import EventLoopBridge
+from model_config import ModelConfig
+from model_registry import ModelRegistry
+from page_render import (
+    DEFAULT_FORMAT,
+    DEFAULT_SCALE,
+    IMAGE_FORMATS,
+    MAX_SCALE,
+    PageNotFound,
+    PageRenderer,
+    PdfStore,
+    PdfTooLarge,
+    RenderUnavailable,
+    pdf_rendering_available,
+)
+from metrics import (
+    REGISTRY,
+    STAGE_SECONDS,
+    COMMANDS,
+    POINTING_TRANSITIONS,
+    NOTIFICATION_MESSAGES,
+    NOTIFICATION_BYTES,
+    STUDYSET_REQUESTS,
+    STUDYSET_COMPILE_SECONDS,
+)
+from notifications import (
+    ENCODINGS,
+    PROTOCOL_VERSION,
+    BinaryCodec,
+    NotificationCoalescer,
+    json_size,
+    legacy_events,
+    protocol_room,
+)
+from review_log import MAX_REVIEWS_PER_REQUEST, ReviewLog, parse_review, user_from
+from rule_engine import RuleEngine
+from studyset import MAX_STUDYSET_BYTES, StudysetCache, StudysetError, compile_stream
+import gzip
+import re
+import tempfile
 import time
 
-GESTURE_RECOGNIZER = GestureRecognizer()
-gesture_command = None
+# Per-frame diagnostics are logged at DEBUG, set GESTURE_LOG_LEVEL=DEBUG to see them
+logging.basicConfig(
+    level=os.environ.get('GESTURE_LOG_LEVEL', 'INFO').upper(),
+    format="[%(levelname)s] %(asctime)s - %(message)s",
+)
+logger = logging.getLogger(__name__)
 
-# Camera control variables
-camera_enabled = False
-camera_thread = None
-camera_stop_event = threading.Event()
+# The model, its options and the inference resolution `python -m benchmarks.model_tuning`
+# picked for this machine, GESTURE_MODEL_CONFIG is the file it writes
+model_config = ModelConfig.load(os.environ.get(
+    'GESTURE_MODEL_CONFIG', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'model_config.json')))
+recognizer_options = model_config.recognizer_options()
+create_configured_recognizer = functools.partial(create_recognizer, **recognizer_options)
+
+# Models are loaded in the background, on startup or on the first
+# /enable-camera depending on GESTURE_WARMUP ('startup' or 'enable')
+models = ModelRegistry()
+models.register('gesture_recognizer', create_configured_recognizer, warm=warm_up_recognizer)
+warm_up = os.environ.get('GESTURE_WARMUP', 'startup')
 
 # instantiate the app
 app = Flask(__name__)
@@ -21,18 +81,153 @@ app.config.from_object(__name__)
 # enable CORS
 CORS(app, origins=['*'])
 
-socketio = SocketIO(app, cors_allowed_origins="*")
+# GESTURE_SERVER=production serves on gevent, many clients on one thread,
+# instead of the Werkzeug development server
+production = os.environ.get('GESTURE_SERVER', 'development') == 'production'
+async_mode = 'gevent' if production else 'threading'
+
+# Uploaded frames come as binary Socket.IO messages, allow them their maximum size
+socketio = SocketIO(app, cors_allowed_origins="*", async_mode=async_mode,
+                    max_http_buffer_size=MAX_UPLOAD_BYTES + 1024)
+# Camera loops, inference and the notifier run on native threads, their
+# emits are handed over to the server's event loop
+bridge = EventLoopBridge(async_mode)
+
+# Session each Socket.IO client joined, by sid
+client_sessions = {}
 
 @socketio.on('connect')
 def handle_connect():
-    print('Client connected')
+    logger.info('Client connected')
 
-def send_notification(isPointing: bool, command: str):
-    # Call this function when your event occurs
-    socketio.emit('notification', {
-        'isPointing': isPointing,
-        'command': command
-    })
+@socketio.on('disconnect')
+def handle_disconnect():
+    client_sessions.pop(request.sid, None)
+
+@socketio.on('join')
+def handle_join(data):
+    # A client follows one session: {"session": "station-1", "protocol": 2, "encoding": "binary"}.
+    # Without a protocol it gets the version 1 'notification' events
+    data = data or {}
+    try:
+        session_id = session_id_from(data.get('session'))
+        protocol = data.get('protocol', 1)
+        encoding = data.get('encoding', 'json')
+        if protocol not in (1, PROTOCOL_VERSION) or encoding not in ENCODINGS:
+            raise ValueError(f'Unsupported protocol {protocol!r} with encoding {encoding!r}')
+    except ValueError as e:
+        emit('error', {'message': str(e)})
+        return
+    for room in rooms():
+        if room != request.sid:
+            leave_room(room)
+    join_room(protocol_room(session_id, protocol, encoding))
+    client_sessions[request.sid] = session_id
+    if protocol == PROTOCOL_VERSION:
+        # The code table of the binary encoding
+        emit('protocol', {'v': PROTOCOL_VERSION, 'encoding': encoding, 'codes': codec.names})
+    emit('joined', {'session': session_id})
+
+@socketio.on('frame')
+def handle_frame(upload):
+    # A frame of the browser's camera, for the session the client joined when
+    # it was enabled with "source": "upload". The client waits for the ack
+    # before sending the next one
+    try:
+        accepted = sessions.upload(client_sessions.get(request.sid, DEFAULT_SESSION), upload)
+    except ValueError as e:
+        return {'accepted': False, 'error': str(e)}
+    return {'accepted': accepted}
+
+def emit_to_clients(room, event, payload, encoding, size):
+    recipients = sum(1 for _ in socketio.server.manager.get_participants('/', room))
+    if not recipients:
+        return
+    socketio.emit(event, payload, to=room)
+    NOTIFICATION_MESSAGES.inc(recipients, encoding=encoding)
+    NOTIFICATION_BYTES.inc(size * recipients, encoding=encoding)
+
+def emit_notifications(session_id, message):
+    # One coalesced message of a session, to its clients of every protocol and encoding
+    start = time.perf_counter()
+    for event in legacy_events(message):
+        emit_to_clients(protocol_room(session_id), 'notification', event, 'v1', json_size(event))
+    emit_to_clients(protocol_room(session_id, PROTOCOL_VERSION, 'json'), 'notifications', message,
+                    'json', json_size(message))
+    encoded = codec.encode(message)
+    emit_to_clients(protocol_room(session_id, PROTOCOL_VERSION, 'binary'), 'notifications', encoded,
+                    'binary', len(encoded))
+    STAGE_SECONDS.observe(time.perf_counter() - start, stage='emit')
+
+# Command names get one byte codes in the binary encoding
+codec = BinaryCodec(RuleEngine.from_file().commands + [command for command, _, _ in POINTING_BUCKETS])
+# Events of a session within GESTURE_NOTIFY_WINDOW_MS of each other go out as one message
+notifier = NotificationCoalescer(lambda session_id, message: bridge.call(emit_notifications, session_id, message),
+                                 window=float(os.environ.get('GESTURE_NOTIFY_WINDOW_MS', 50)) / 1000)
+
+def send_notification(session_id: str, isPointing: bool, command: str):
+    # Called by the sessions, only the clients of that session receive it
+    notifier.send(session_id, isPointing, command)
+    if isPointing:
+        POINTING_TRANSITIONS.inc(pointing=command)
+    else:
+        COMMANDS.inc(command=command)
+
+def emit_camera_state(session_id, state, message):
+    # {"session", "state", "message"} to the clients of the session, in every protocol
+    payload = {'session': session_id, 'state': state, 'message': message}
+    socketio.emit('camera', payload, to=[protocol_room(session_id, protocol, encoding)
+                                         for protocol, encoding in ((1, 'json'),
+                                                                    (PROTOCOL_VERSION, 'json'),
+                                                                    (PROTOCOL_VERSION, 'binary'))])
+
+def send_camera_state(session_id, state, message):
+    # Called by the sessions on every state change: /enable-camera and
+    # /disable-camera only start the change, clients learn here when it is done
+    bridge.call(emit_camera_state, session_id, state, message)
+
+# Frames uploaded by every client share GESTURE_UPLOAD_WORKERS inference workers
+batcher = FrameBatcher(create_configured_recognizer, workers=int(os.environ.get('GESTURE_UPLOAD_WORKERS', 1)))
+# 'process_pool' sessions run inference in GESTURE_INFERENCE_PROCESSES worker
+# processes, spawned when the first of them is enabled
+inference_pool = InferencePool(processes=int(os.environ.get('GESTURE_INFERENCE_PROCESSES', 2)),
+                               **recognizer_options)
+# Stops the workers and frees their shared memory
+atexit.register(inference_pool.close)
+# Sessions enabled with "record": true write their landmarks under GESTURE_RECORDINGS_DIR
+recordings = os.environ.get('GESTURE_RECORDINGS_DIR',
+                            os.path.join(os.path.dirname(os.path.abspath(__file__)), 'recordings'))
+# /enable-camera only plays clips found under GESTURE_CLIPS_DIR, besides webcams and uploads
+clips = os.environ.get('GESTURE_CLIPS_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'clips'))
+# Camera loops of at most GESTURE_MAX_SESSIONS sessions run at once, the others wait
+sessions = SessionManager(send_notification, models, max_workers=int(os.environ.get('GESTURE_MAX_SESSIONS', 4)),
+                          batcher=batcher, inference_pool=inference_pool, on_state=send_camera_state,
+                          recordings=recordings, recognizer_options=recognizer_options,
+                          inference_defaults=model_config.inference_config(), clips=clips)
+
+# Compiled study sets by content hash, GESTURE_STUDYSET_CACHE is the disk cache directory
+studysets = StudysetCache(os.environ.get('GESTURE_STUDYSET_CACHE'))
+# Uploaded PDFs and their rendered pages, by content hash, under
+# GESTURE_PDF_CACHE; GESTURE_RENDER_WORKERS processes render them
+pdf_cache = os.environ.get('GESTURE_PDF_CACHE', os.path.join(tempfile.gettempdir(), 'pdf-cache'))
+pdfs = PdfStore(os.path.join(pdf_cache, 'documents'))
+pages = PageRenderer(pdfs, os.path.join(pdf_cache, 'pages'), workers=int(os.environ.get('GESTURE_RENDER_WORKERS', 2)),
+                     bridge=bridge)
+atexit.register(pages.close)
+# Reviews of every student, GESTURE_REVIEW_DB is the SQLite database
+reviews = ReviewLog(os.environ.get('GESTURE_REVIEW_DB', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'reviews.db')),
+                    bridge=bridge)
+atexit.register(reviews.close)
+# Scheduler weights fitted to each student by `python -m fsrs_optimizer`,
+# GESTURE_SCHEDULER_PARAMS is the file it writes
+scheduler_parameters = ParameterStore(os.environ.get(
+    'GESTURE_SCHEDULER_PARAMS', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scheduler_parameters.json')))
+
+def requested_session_id():
+    """Session of a request: the `session` field of the JSON body or query string, else the default one"""
+    body = request.get_json(silent=True)
+    body = body if isinstance(body, dict) else {}
+    return session_id_from(body.get('session', request.args.get('session')))
 
 
 # sanity check route
@@ -42,231 +237,269 @@ def ping_pong():
 
 @app.route('/whatispointing', methods=['GET'])
 def what_is_pointing():
-    return jsonify(pointing_with_finger)
+    session = sessions.get(requested_session_id())
+    return jsonify(session.pipeline.pointing_with_finger if session else None)
 
 @app.route('/enable-camera', methods=['POST'])
 def enable_camera():
-    global camera_enabled, camera_thread, camera_stop_event
-    
-    if not camera_enabled:
-        camera_enabled = True
-        camera_stop_event.clear()
-        camera_thread = threading.Thread(target=send_commands_via_gestures, daemon=True)
-        camera_thread.start()
+    # Optional body: {"session": "station-1", ...}, see GestureSession.configure
+    # for the settings. Sessions are created on their first /enable-camera
+    session = None
+    try:
+        session = sessions.get_or_create(requested_session_id())
+        session.configure(request.get_json(silent=True) or {})
+    except (TypeError, ValueError) as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e),
+            'camera_enabled': session.enabled if session else False
+        }), 400
+
+    if session.running_mode == 'image' and session.frame_source != UPLOAD_SOURCE:
+        # The camera loop waits for the model if it is still loading
+        models.warm_up()
+    elif session.running_mode == 'process_pool':
+        inference_pool.start()
+    if sessions.start(session.session_id):
+        # Accepted: the camera opens in the background, the 'camera' event
+        # tells when it is running
         return jsonify({
             'status': 'success',
             'message': 'Camera recognition enabled',
-            'camera_enabled': True
-        })
+            'camera_enabled': True,
+            'session': session.session_id,
+            'state': session.state,
+            **session.to_config(),
+            'models_ready': models.ready
+        }), 202
     else:
         return jsonify({
             'status': 'info',
             'message': 'Camera recognition is already enabled',
-            'camera_enabled': True
+            'camera_enabled': True,
+            'session': session.session_id,
+            'state': session.state,
+            **session.to_config(),
+            'models_ready': models.ready
         })
 
 @app.route('/disable-camera', methods=['POST'])
 def disable_camera():
-    global camera_enabled, camera_thread, camera_stop_event
-    
-    if camera_enabled:
-        camera_enabled = False
-        camera_stop_event.set()
-        if camera_thread and camera_thread.is_alive():
-            camera_thread.join(timeout=2)  # Wait up to 2 seconds for thread to finish
+    try:
+        session_id = requested_session_id()
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+
+    if sessions.stop(session_id):
+        # Accepted: the camera is released in the background, the 'camera'
+        # event tells when it is stopped
         return jsonify({
             'status': 'success',
             'message': 'Camera recognition disabled',
-            'camera_enabled': False
-        })
+            'camera_enabled': False,
+            'session': session_id,
+            'state': sessions.get(session_id).state
+        }), 202
     else:
         return jsonify({
             'status': 'info',
             'message': 'Camera recognition is already disabled',
-            'camera_enabled': False
+            'camera_enabled': False,
+            'session': session_id
         })
 
+def sha256_digest(value):
+    value = (value or '').lower()
+    return value if re.fullmatch(r'[0-9a-f]{64}', value) else None
+
+def studyset_response(digest, data):
+    # Cached entries are gzipped JSON, sent as they are to clients that take gzip
+    if request.accept_encodings.best_match(['gzip']):
+        response = Response(data, mimetype='application/json')
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = Response(gzip.decompress(data), mimetype='application/json')
+    response.headers['ETag'] = digest
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+@app.route('/studyset/<digest>', methods=['GET'])
+def get_studyset(digest):
+    # The compiled study set of SHA-256 `digest` (hex) if it was uploaded before
+    digest = sha256_digest(digest)
+    data, cache = studysets.get(digest) if digest else (None, 'miss')
+    STUDYSET_REQUESTS.inc(cache=cache)
+    if data is None:
+        return jsonify({'status': 'error', 'message': 'Unknown study set'}), 404
+    return studyset_response(digest, data)
+
+@app.route('/studyset', methods=['POST'])
+def post_studyset():
+    # Body: the UTF-8 text of a study set, compiled while it streams in.
+    # ?hash=<sha256> skips reading it when that study set is already cached
+    digest = sha256_digest(request.args.get('hash'))
+    if digest:
+        data, cache = studysets.get(digest)
+        if data is not None:
+            STUDYSET_REQUESTS.inc(cache=cache)
+            return studyset_response(digest, data)
+    if (request.content_length or 0) > MAX_STUDYSET_BYTES:
+        return jsonify({'status': 'error', 'message': f'Study set is over {MAX_STUDYSET_BYTES} bytes'}), 413
+    start = time.perf_counter()
+    try:
+        digest, data = compile_stream(request.stream)
+    except StudysetError as e:
+        return jsonify({'status': 'error', 'message': str(e), 'line': e.line}), 400
+    except ValueError as e:
+        # Not UTF-8, or too large
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    STUDYSET_COMPILE_SECONDS.observe(time.perf_counter() - start)
+    STUDYSET_REQUESTS.inc(cache='miss')
+    return studyset_response(digest, studysets.put(digest, data))
+
+def render_options(options):
+    """(scale, format) of a page request, ValueError if invalid"""
+    scale = float(options.get('scale', DEFAULT_SCALE))
+    image_format = options.get('format', DEFAULT_FORMAT)
+    if not 0 < scale <= MAX_SCALE:
+        raise ValueError(f'scale must be between 0 and {MAX_SCALE}')
+    if image_format not in IMAGE_FORMATS:
+        raise ValueError(f"Unknown format '{image_format}', expected one of {', '.join(IMAGE_FORMATS)}")
+    return scale, image_format
+
+@app.route('/pdf', methods=['POST'])
+def post_pdf():
+    # Body: a PDF resource of a study set. ?hash=<sha256> skips the upload
+    # when the service already has it
+    digest = sha256_digest(request.args.get('hash'))
+    if digest is None or pdfs.path(digest) is None:
+        try:
+            digest = pdfs.put_stream(request.stream)
+        except PdfTooLarge as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 413
+        except ValueError as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 400
+    return jsonify({'status': 'success', 'hash': digest, 'rendering': pdf_rendering_available()})
+
+@app.route('/pdf/<digest>/page/<int:page>', methods=['GET'])
+def get_pdf_page(digest, page):
+    # ?scale=2&format=jpeg, pages count from 1
+    if not pdf_rendering_available():
+        return jsonify({'status': 'error', 'message': 'Rendering PDFs needs pypdfium2'}), 503
+    try:
+        scale, image_format = render_options(request.args)
+        data = pages.render(sha256_digest(digest) or '', page, scale, image_format)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    except (FileNotFoundError, PageNotFound) as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 404
+    except TimeoutError:
+        return jsonify({'status': 'error', 'message': f'Page {page} is still rendering, try again'}), 504
+    except RenderUnavailable as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 503
+    response = Response(data, mimetype=IMAGE_FORMATS[image_format])
+    # Addressed by content, a page never changes
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
+@app.route('/pdf/<digest>/prefetch', methods=['POST'])
+def prefetch_pdf_pages(digest):
+    # Body: {"pages": [12, 13, 40], "scale": 2, "format": "jpeg"}, the pages
+    # of the next due cards, most urgent first
+    if not pdf_rendering_available():
+        return jsonify({'status': 'error', 'message': 'Rendering PDFs needs pypdfium2'}), 503
+    body = request.get_json(silent=True)
+    body = body if isinstance(body, dict) else {}
+    try:
+        scale, image_format = render_options(body)
+        wanted = [page for page in body.get('pages', []) if isinstance(page, int) and page > 0]
+        queued = pages.prefetch(sha256_digest(digest) or '', wanted, scale, image_format)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    except FileNotFoundError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 404
+    except RenderUnavailable as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 503
+    return jsonify({'status': 'success', 'queued': queued}), 202
+
+@app.route('/reviews', methods=['POST'])
+def post_reviews():
+    # Body: {"user": "ada", "reviews": [{"deck", "card", "rating", "reviewedAt",
+    # "ease", "interval", "nextReviewAt"}, ...]}, answered once they are committed
+    body = request.get_json(silent=True)
+    body = body if isinstance(body, dict) else {}
+    try:
+        user = user_from(body.get('user'))
+        posted = body.get('reviews')
+        if not isinstance(posted, list) or len(posted) > MAX_REVIEWS_PER_REQUEST:
+            raise ValueError(f'reviews must be a list of at most {MAX_REVIEWS_PER_REQUEST} reviews')
+        rows = [parse_review(user, review) for review in posted]
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    try:
+        reviews.append(rows)
+    except TimeoutError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 503
+    return jsonify({'status': 'success', 'stored': len(rows)})
+
+@app.route('/reviews/sync', methods=['GET'])
+def sync_reviews():
+    # ?user=ada&cursor=1234&deck=<study set hash>: the card states that
+    # changed since `cursor`, pass the returned cursor next time
+    try:
+        user = user_from(request.args.get('user'))
+        cursor = int(request.args.get('cursor', 0))
+        limit = min(int(request.args.get('limit', 1000)), 5000)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    return jsonify({'status': 'success', **reviews.changes(user, cursor, request.args.get('deck'), limit)})
+
+@app.route('/scheduler/parameters', methods=['GET'])
+def get_scheduler_parameters():
+    # ?user=ada: the weights of FlashcardsScheduler.nextInterval for the
+    # student, the defaults until they have enough reviews to fit
+    try:
+        user = user_from(request.args.get('user'))
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    parameters, fitted = scheduler_parameters.get(user)
+    return jsonify({'status': 'success', 'user': user, 'fitted': fitted, 'parameters': parameters})
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(REGISTRY.render(), mimetype=REGISTRY.CONTENT_TYPE)
+
 @app.route('/camera-status', methods=['GET'])
 def camera_status():
+    try:
+        session_id = requested_session_id()
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    session = sessions.get(session_id)
+    status = session.status() if session else {'session': session_id, 'state': 'stopped', 'camera_enabled': False}
     return jsonify({
-        'camera_enabled': camera_enabled,
-        'thread_alive': camera_thread.is_alive() if camera_thread else False
+        **status,
+        'models_ready': models.ready,
+        'models': models.status(),
+        'model_config': model_config.to_config(),
+        'inference_pool': inference_pool.status()
     })
 
-#---
-def count_fingers(tgt, image_rgb, detection_result, recognition_result) -> bool:
-    count = GESTURE_RECOGNIZER.count_open_fingers(image_rgb)
-    return count == tgt
+@app.route('/sessions', methods=['GET'])
+def list_sessions():
+    return jsonify(sessions.status())
 
-def hand_LFT(image_rgb, detection_result, recognition_result) -> bool:
-    return GESTURE_RECOGNIZER.detect_left_to_right_movement(image_rgb)
 
-def gesture(tgt, image_rgb, detection_result, recognition_result) -> bool:
-    try:
-        top_gesture = recognition_result.gestures[0][0]
-        gst = top_gesture.category_name
-        return gst == tgt
-    except IndexError:
-        return False
-
-def index_pos(image_rgb, detection_result, recognition_result):
-    for hand in detection_result.hand_landmarks:
-        index_finger_base = hand[5]
-        print(index_finger_base)
-        return {
-            'x': index_finger_base.x, 
-            'y': index_finger_base.y,
-            'z': index_finger_base.z
-        }
-    return {}
-
-gesture_commands = {
-    #'show': lambda image: GESTURE_RECOGNIZER.has_any_thumbs_up(cv2.cvtColor(image, cv2.COLOR_BGR2RGB)),
-    'show': {
-        "condition": lambda x, y, z: gesture('Open_Palm', x, y, z),
-        "delay": None,
-        "allow more": False,
-        "allow during pointing": True,
-    },
-    'hide': {
-        "condition": lambda x, y, z: gesture('Closed_Fist', x, y, z),
-        "delay": None,
-        "allow more": False,
-        "allow during pointing": True,
-    },
-    'forgot': {
-        "condition": lambda x, y, z: gesture('Thumb_Down', x, y, z),
-        "delay": None,
-        "allow more": False,
-        "allow during pointing": False,
-    },
-    'bad': {
-        "condition": lambda x, y, z: count_fingers(2, x, y, z),
-        "delay": None,
-        "allow more": False,
-        "allow during pointing": False,
-    },
-    'not bad': {
-        "condition": lambda x, y, z: count_fingers(3, x, y, z),
-        "delay": None,
-        "allow more": False,
-        "allow during pointing": False,
-    },
-    'ok': {
-        "condition": lambda x, y, z: gesture('Thumb_Up', x, y, z),
-        "delay": None,
-        "allow more": False,
-        "allow during pointing": False,
-    },
-    'next page': {
-        "condition": lambda x, y, z: gesture('Pointing_Up', x, y, z) and index_pos(x,y,z).get('x', 1) < 0.45,
-        "delay": 1,
-        "allow more": True,
-        "allow during pointing": False,
-    },
-    'previous page': {
-        "condition": lambda x, y, z: gesture('Pointing_Up', x, y, z) and index_pos(x,y,z).get('x', 0) > 0.55,
-        "delay": 1,
-        "allow more": True,
-        "allow during pointing": False,
-    },
-}
-#---
-
-import mediapipe
-from mediapipe.tasks import python
-from mediapipe.tasks.python import vision
-import math
-base_options = python.BaseOptions(model_asset_path='hand_landmarker.task')
-options = vision.HandLandmarkerOptions(base_options=base_options,
-                                       num_hands=2)
-detector = vision.HandLandmarker.create_from_options(options)
-
-base_options_gst = python.BaseOptions(model_asset_path='gesture_recognizer.task')
-options_gst = vision.GestureRecognizerOptions(base_options=base_options_gst)
-recognizer = vision.GestureRecognizer.create_from_options(options_gst)
-
-last_sent_command = None
-last_sent_command_ts = None
-pointing_with_finger = None
-last_pointing_with_finger = None
-
-def send_commands_via_gestures():
-    global last_sent_command, last_sent_command_ts, pointing_with_finger, last_pointing_with_finger
-    cap = cv2.VideoCapture(0)
-    
-    try:
-        while camera_enabled and not camera_stop_event.is_set():
-            success, image = cap.read()
-            if not success:
-                print('Unable to read video')
-                break
-            
-            # Convert the image to RGB as mediapipe expects RGB input
-            image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-            # Create a mediapipe Image object
-            mp_image = mediapipe.Image(image_format=mediapipe.ImageFormat.SRGB, data=image_rgb)
-            
-            detection_result = detector.detect(mp_image)
-            recognition_result = recognizer.recognize(mp_image)
-            
-            for command, options in gesture_commands.items():
-                condition = options['condition']
-                allow_more = options.get('allow more', False)
-                allow_during_pointing = options.get('allow during pointing', False)
-                if not allow_during_pointing and pointing_with_finger:
-                    continue
-                if not allow_more and command == last_sent_command:
-                    continue
-                if last_sent_command_ts is not None and options['delay'] is not None:
-                    time_elapsed = time.time() - last_sent_command_ts
-                    if time_elapsed < options['delay']:
-                        continue
-                if condition(image_rgb, detection_result, recognition_result):
-                    last_sent_command = command
-                    last_sent_command_ts = time.time()
-                    send_notification(False, command)
-                    break
-            
-            if gesture('Pointing_Up',image_rgb, detection_result, recognition_result):
-                for hand in detection_result.hand_landmarks:
-                    index_finger_tip = hand[8]
-                    index_finger_base = hand[5]
-                    # Calculate the angle between the tip and base of the index finger
-                    dx = index_finger_tip.x - index_finger_base.x
-                    dy = index_finger_tip.y - index_finger_base.y
-                    angle = math.degrees(math.atan2(dy, dx))
-                    print(f"Angle between index finger tip and base: {angle:.2f} degrees")
-                    print('Pointing', end=' ')
-                    if angle >= -70:
-                        pointing_with_finger = 'hide'
-                    elif angle >= -80:
-                        pointing_with_finger = 'forgot'
-                    elif angle >= -90:
-                        pointing_with_finger = 'bad'
-                    elif angle >= -100:
-                        pointing_with_finger = 'not bad'
-                    elif angle >= -110:
-                        pointing_with_finger = 'ok'
-                    print(pointing_with_finger)
-                    break
-            else:
-                pointing_with_finger = None
-                
-            if pointing_with_finger != last_pointing_with_finger:
-                print('Sending pointing notification')
-                last_pointing_with_finger = pointing_with_finger
-                send_notification(True, pointing_with_finger)
-
-            if cv2.waitKey(5) & 0xFF == 27:
-                break
-            time.sleep(0.1) # No need to exhaust cpu
-    
-    finally:
-        cap.release()
-        cv2.destroyAllWindows()
-        print("Camera released and OpenCV windows closed")
-
-
-if __name__ == '__main__':
-    app.run(host='0.0.0.0', debug=True, port=5001)
\ No newline at end of file
+if __name__ == '__main__' and production:
+    if warm_up == 'startup':
+        models.warm_up()
+    # Releases the cameras on Ctrl+C
+    atexit.register(sessions.shutdown)
+    bridge.start()
+    socketio.run(app, host='0.0.0.0', port=int(os.environ.get('GESTURE_PORT', 5001)))
+elif __name__ == '__main__':
+    # With debug=True the reloader re-runs this file in a child process, only
+    # that one serves requests and needs the models
+    if warm_up == 'startup' and os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        models.warm_up()
+    app.run(host='0.0.0.0', debug=True, port=5001)
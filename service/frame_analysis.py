@@ -0,0 +1,116 @@
+import copy
+
+from gesture_recognizer import (
+    hand_center_array,
+    hand_features,
+    landmarks_to_array,
+    INDEX_MCP,
+)
+from hand_roi import HandRoi
+
+
+def compact_recognition(recognition_result):
+    """
+    The parts of a GestureRecognizer result the rules use, as plain values:
+    (landmarks array, top gesture category per hand, handedness per hand,
+    gesture score per hand, handedness score per hand). Small enough to
+    send between processes.
+    """
+    return (
+        landmarks_to_array(recognition_result.hand_landmarks),
+        [categories[0].category_name if categories else None for categories in recognition_result.gestures],
+        [categories[0].category_name if categories else None for categories in recognition_result.handedness],
+        [categories[0].score if categories else None for categories in recognition_result.gestures],
+        [categories[0].score if categories else None for categories in recognition_result.handedness],
+    )
+
+
+class FrameAnalysis:
+    """
+    Everything the gesture rules need to know about one camera frame.
+
+    It is built from a single GestureRecognizer task inference, which already
+    returns both the hand landmarks and the gesture categories, so the rules
+    never have to run a model themselves. Landmarks are kept as a
+    (hands, 21, 3) float32 array and the per-hand values are computed on it
+    in one vectorized pass, see hand_features. The scores of the categories are kept for
+    recordings, the rules do not use them.
+    """
+
+    def __init__(self, landmarks=None, gesture_categories=None, handedness=None, gesture_scores=None,
+                 handedness_scores=None):
+        self.landmarks = landmarks_to_array(landmarks)
+        self.gesture_categories = gesture_categories or []
+        self.handedness = handedness or []
+        self.gesture_scores = gesture_scores or []
+        self.handedness_scores = handedness_scores or []
+
+        self.hand_count = len(self.landmarks)
+        self.hands = hand_features(self.landmarks)
+        self.fingers_per_hand = self.hands.fingers.tolist()
+        # Same total as GestureRecognizer.count_open_fingers
+        self.finger_count = sum(self.fingers_per_hand)
+        self.index_pos = self._index_pos()
+
+    @classmethod
+    def from_recognition(cls, recognition_result, region=HandRoi.FULL_FRAME):
+        """
+        `region` is the part of the camera frame inference ran on, landmarks
+        are mapped back to full-frame coordinates.
+        """
+        return cls.from_compact(compact_recognition(recognition_result), region)
+
+    @classmethod
+    def from_compact(cls, compact, region=HandRoi.FULL_FRAME):
+        """From the output of compact_recognition, see from_recognition"""
+        landmarks, gesture_categories, handedness, gesture_scores, handedness_scores = compact
+        return cls(
+            landmarks=HandRoi.to_frame(landmarks, region),
+            gesture_categories=gesture_categories,
+            handedness=handedness,
+            gesture_scores=gesture_scores,
+            handedness_scores=handedness_scores,
+        )
+
+    def relabeled(self, gesture, finger_count):
+        """
+        Copy of this frame with the first hand's gesture and the finger count
+        replaced, e.g. by their temporally smoothed values
+        """
+        frame = copy.copy(self)
+        frame.gesture_categories = [gesture] + self.gesture_categories[1:]
+        frame.finger_count = finger_count
+        return frame
+
+    @property
+    def has_hand(self):
+        return self.hand_count > 0
+
+    @property
+    def gesture(self):
+        """Top gesture category of the first hand, or None."""
+        if self.gesture_categories:
+            return self.gesture_categories[0]
+        return None
+
+    @property
+    def hand_center(self):
+        """Palm center of the first hand, or None."""
+        if not self.has_hand:
+            return None
+        x, y = hand_center_array(self.landmarks[:1])[0]
+        return float(x), float(y)
+
+    @property
+    def pointing_angle(self):
+        """Index finger angle in degrees of the first hand, or None."""
+        if not self.has_hand:
+            return None
+        return float(self.hands.pointing_angle[0])
+
+    def _index_pos(self):
+        # Base of the index finger of the first hand
+        if not self.has_hand:
+            return {}
+        x, y, z = self.landmarks[0, INDEX_MCP].tolist()
+        return {'x': x, 'y': y, 'z': z}
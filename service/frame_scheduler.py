@@ -0,0 +1,86 @@
+import time
+
+
+class FrameRateScheduler:
+    """
+    Decides how long the camera loop sleeps between two frames.
+
+    Modes:
+        adaptive: run at `idle_fps` when no hand has been seen for
+            `idle_after` seconds, and at `active_fps` while a hand is visible
+            or the user is pointing.
+        target: run at a constant `target_fps`.
+
+    In both modes the time spent processing the frame is subtracted from the
+    sleep, so the loop keeps the requested rate whatever the inference cost.
+    """
+
+    MODES = ('adaptive', 'target')
+    DEFAULTS = {
+        'mode': 'adaptive',
+        'idle_fps': 2.0,
+        'active_fps': 15.0,
+        'idle_after': 3.0,
+        'target_fps': 10.0,
+    }
+
+    def __init__(self, mode='adaptive', idle_fps=2.0, active_fps=15.0, idle_after=3.0, target_fps=10.0):
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown frame rate mode '{mode}', expected one of {', '.join(self.MODES)}")
+        idle_fps, active_fps, target_fps = float(idle_fps), float(active_fps), float(target_fps)
+        idle_after = float(idle_after)
+        for name, fps in (('idle_fps', idle_fps), ('active_fps', active_fps), ('target_fps', target_fps)):
+            if fps <= 0:
+                raise ValueError(f'{name} must be positive')
+        if idle_after < 0:
+            raise ValueError('idle_after must not be negative')
+
+        self.mode = mode
+        self.idle_fps = idle_fps
+        self.active_fps = active_fps
+        self.idle_after = idle_after
+        self.target_fps = target_fps
+        self.last_activity = None
+
+    @classmethod
+    def from_config(cls, config):
+        """Build a scheduler from a dict such as the `frame_rate` field of /enable-camera"""
+        config = config or {}
+        unknown = set(config) - set(cls.DEFAULTS)
+        if unknown:
+            raise ValueError(f"Unknown frame rate settings: {', '.join(sorted(unknown))}")
+        return cls(**{**cls.DEFAULTS, **config})
+
+    def to_config(self):
+        return {name: getattr(self, name) for name in self.DEFAULTS}
+
+    def update(self, hand_present, pointing=False):
+        """Record what the last frame contained"""
+        if hand_present or pointing:
+            self.last_activity = time.monotonic()
+
+    @property
+    def active(self):
+        if self.last_activity is None:
+            return False
+        return time.monotonic() - self.last_activity < self.idle_after
+
+    @property
+    def fps(self):
+        if self.mode == 'target':
+            return self.target_fps
+        return self.active_fps if self.active else self.idle_fps
+
+    def next_delay(self, processing_time=0.0):
+        return max(0.0, 1 / self.fps - processing_time)
+
+    def wait(self, processing_time=0.0, stop_event=None):
+        """
+        Sleep until the next frame is due. Returns True if `stop_event` was
+        set while waiting, so the loop can exit without finishing the sleep.
+        """
+        delay = self.next_delay(processing_time)
+        if stop_event is not None:
+            return stop_event.wait(delay)
+        time.sleep(delay)
+        return False
@@ -0,0 +1,116 @@
+import os
+
+import cv2
+import numpy as np
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+# Frames sent by the browser over Socket.IO, see frame_upload.py
+UPLOAD_SOURCE = 'upload'
+
+
+class ImageDirectorySource:
+    """
+    Plays the images of a directory, in file name order, through the same
+    interface as cv2.VideoCapture.
+    """
+
+    def __init__(self, path, fps=30.0):
+        self.path = path
+        self.fps = fps
+        self.files = sorted(
+            os.path.join(path, name) for name in os.listdir(path)
+            if name.lower().endswith(IMAGE_EXTENSIONS)
+        )
+        self._next = 0
+
+    def isOpened(self):
+        return self._next < len(self.files)
+
+    def read(self, image=None):
+        while self._next < len(self.files):
+            frame = cv2.imread(self.files[self._next])
+            self._next += 1
+            if frame is None:
+                continue
+            if image is not None and image.shape == frame.shape:
+                np.copyto(image, frame)
+                return True, image
+            return True, frame
+        return False, None
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FPS:
+            return self.fps
+        if prop == cv2.CAP_PROP_FRAME_COUNT:
+            return len(self.files)
+        return 0.0
+
+    def set(self, prop, value):
+        return False
+
+    def release(self):
+        self._next = len(self.files)
+
+
+def frame_source_kind(source):
+    """'webcam', 'directory', 'video' or 'upload' for a source spec, ValueError if it is none of them"""
+    if isinstance(source, int) and not isinstance(source, bool):
+        return 'webcam'
+    if isinstance(source, str):
+        if source == UPLOAD_SOURCE:
+            return 'upload'
+        if source.isdigit():
+            return 'webcam'
+        if os.path.isdir(source):
+            return 'directory'
+        if os.path.isfile(source):
+            return 'video'
+    raise ValueError(f"Frame source '{source}' is neither a camera index, a video file nor a directory")
+
+
+def resolve_clip_source(source, clips):
+    """
+    The frame source spec to open for a `source` sent by a client, such as
+    the "source" of /enable-camera: a webcam index or 'upload' as is, a
+    video file or image directory only under the `clips` directory,
+    relative to it. ValueError for any other source and for paths that
+    leave `clips`; with `clips` None only webcams and uploads are accepted.
+    """
+    if isinstance(source, int) and not isinstance(source, bool):
+        return source
+    if not isinstance(source, str):
+        raise ValueError('Frame source must be a camera index, "upload" or a clip')
+    if source == UPLOAD_SOURCE or source.isdigit():
+        return source
+    if clips is None:
+        raise ValueError('Only camera indices and "upload" are accepted, no clips directory is configured')
+    root = os.path.realpath(clips)
+    # realpath follows symbolic links, a link in the clips directory cannot lead out of it either
+    path = os.path.realpath(os.path.join(root, source))
+    if os.path.commonpath([root, path]) != root:
+        raise ValueError(f"Frame source '{source}' is not in the clips directory")
+    if not os.path.isdir(path) and not os.path.isfile(path):
+        raise ValueError(f"Frame source '{source}' is not a video file or directory of the clips directory")
+    return path
+
+
+def open_frame_source(source=0):
+    """
+    Open a frame source from a spec: a webcam index (int or digit string), a
+    video file, or a directory of images. The result has the
+    cv2.VideoCapture read/get/set/release interface.
+    """
+    kind = frame_source_kind(source)
+    if kind == 'upload':
+        raise ValueError('Uploaded frames are pushed by the client, they cannot be read from a capture')
+    if kind == 'webcam':
+        return cv2.VideoCapture(int(source))
+    if kind == 'directory':
+        return ImageDirectorySource(source)
+    return cv2.VideoCapture(source)
+
+
+def source_fps(capture, default=30.0):
+    """Nominal frame rate of an opened source, `default` when it does not report one"""
+    fps = capture.get(cv2.CAP_PROP_FPS)
+    return fps if fps and fps > 0 else default
@@ -0,0 +1,201 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+from frame_analysis import FrameAnalysis
+from inference import to_mp_image
+from metrics import STAGE_SECONDS, FRAMES, FRAMES_DROPPED, UPLOAD_BATCH_SIZE
+
+logger = logging.getLogger(__name__)
+
+# JPEG (what canvas.toBlob gives) or raw pixels (what getImageData gives)
+UPLOAD_FORMATS = ('jpeg', 'rgba', 'rgb')
+MAX_UPLOAD_BYTES = 4 * 1024 * 1024
+MAX_UPLOAD_SIDE = 1920
+
+
+def check_upload(upload):
+    """
+    Validate the metadata of an uploaded frame without decoding it:
+        {"format": "jpeg" | "rgba" | "rgb", "data": <bytes>,
+         "width": ..., "height": ...}   (width and height for raw formats only)
+    Raises ValueError.
+    """
+    if not isinstance(upload, dict):
+        raise ValueError('A frame must be an object')
+    if upload.get('format') not in UPLOAD_FORMATS:
+        raise ValueError(f"Unknown frame format '{upload.get('format')}', expected one of {', '.join(UPLOAD_FORMATS)}")
+    data = upload.get('data')
+    if not isinstance(data, (bytes, bytearray)):
+        raise ValueError('Frame data must be binary')
+    if len(data) > MAX_UPLOAD_BYTES:
+        raise ValueError(f'Frame is over {MAX_UPLOAD_BYTES} bytes')
+    if upload['format'] != 'jpeg':
+        width, height = upload.get('width'), upload.get('height')
+        if not all(isinstance(side, int) and 0 < side <= MAX_UPLOAD_SIDE for side in (width, height)):
+            raise ValueError(f'Raw frames need a width and height between 1 and {MAX_UPLOAD_SIDE}')
+        channels = 4 if upload['format'] == 'rgba' else 3
+        if len(data) != width * height * channels:
+            raise ValueError(f'Expected {width * height * channels} bytes for a {width}x{height} '
+                             f"{upload['format']} frame, got {len(data)}")
+
+
+class FrameDecoder:
+    """
+    Decodes the uploaded frames of one client to RGB.
+
+    Raw frames are read in place from the received bytes; RGBA is converted
+    into a buffer reused from frame to frame. JPEG is decoded to BGR, then
+converted to RGB in place.
+    The returned image is only valid until the next decode().
+    """
+
+    def __init__(self):
+        self._buffer = None
+
+    def decode(self, upload):
+        data = np.frombuffer(upload['data'], dtype=np.uint8)
+        if upload['format'] == 'jpeg':
+            # IMREAD_COLOR_RGB needs OpenCV 4.10, requirements.txt pins 4.8
+            image = cv2.imdecode(data, cv2.IMREAD_COLOR)
+            if image is None:
+                raise ValueError('Could not decode the JPEG frame')
+            return cv2.cvtColor(image, cv2.COLOR_BGR2RGB, dst=image)
+        height, width = upload['height'], upload['width']
+        if upload['format'] == 'rgb':
+            return data.reshape(height, width, 3)
+        if self._buffer is None or self._buffer.shape[:2] != (height, width):
+            self._buffer = np.empty((height, width, 3), dtype=np.uint8)
+        return cv2.cvtColor(data.reshape(height, width, 4), cv2.COLOR_RGBA2RGB, dst=self._buffer)
+
+
+class FrameBatcher:
+    """
+    Runs inference on frames uploaded by many clients, on a few worker
+    threads with a recognizer each.
+
+    Each session has at most one frame waiting and one in flight: a newer
+    upload replaces the waiting one (counted as dropped), so slow inference
+    never works through a backlog. On each tick a worker takes the waiting
+    frames of up to `max_batch` sessions, oldest first, and runs them
+    back to back. Frames are only decoded once a worker takes them, so
+    dropped frames cost nothing.
+
+    Results go to `session.process_frame`, which sends the session's
+    notifications to its own room. Sessions only need `session_id`,
+    `hand_roi` and `process_frame`.
+    """
+
+    def __init__(self, recognizer_factory, workers=1, max_batch=8):
+        if workers < 1 or max_batch < 1:
+            raise ValueError('workers and max_batch must be at least 1')
+        self.recognizer_factory = recognizer_factory
+        self.workers = workers
+        self.max_batch = max_batch
+        self._cond = threading.Condition()
+        self._pending = OrderedDict()   # session id -> (session, upload)
+        self._in_flight = set()         # session ids a worker is processing
+        self._decoders = {}             # session id -> FrameDecoder
+        self._threads = []
+        self._closed = False
+
+    def submit(self, session, upload):
+        """Queue the newest frame of `session`, ValueError if it is malformed"""
+        check_upload(upload)
+        with self._cond:
+            if self._closed:
+                return
+            if not self._threads:
+                self._start()
+            if session.session_id in self._pending:
+                FRAMES_DROPPED.inc()
+            # Replacing keeps the session's place in the queue
+            self._pending[session.session_id] = (session, upload)
+            self._cond.notify()
+
+    def discard(self, session_id):
+        """Forget the waiting frame and the buffers of a session that stopped"""
+        with self._cond:
+            self._pending.pop(session_id, None)
+            self._decoders.pop(session_id, None)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._pending.clear()
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join(timeout=2)
+
+    def _start(self):
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f'frame-batcher-{index}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _take(self):
+        # Caller holds the lock
+        batch = []
+        for session_id in list(self._pending):
+            if session_id in self._in_flight:
+                continue
+            session, upload = self._pending.pop(session_id)
+            decoder = self._decoders.setdefault(session_id, FrameDecoder())
+            batch.append((session, upload, decoder))
+            self._in_flight.add(session_id)
+            if len(batch) == self.max_batch:
+                break
+        return batch
+
+    def _work(self):
+        recognizer = None
+        while True:
+            with self._cond:
+                batch = self._take()
+                while not batch and not self._closed:
+                    self._cond.wait()
+                    batch = self._take()
+                if self._closed:
+                    break
+            UPLOAD_BATCH_SIZE.observe(len(batch))
+            try:
+                if recognizer is None:
+                    recognizer = self.recognizer_factory()
+                for session, upload, decoder in batch:
+                    try:
+                        self._process(recognizer, session, upload, decoder)
+                    except Exception:
+                        logger.exception('Could not process a frame of session %s', session.session_id)
+            except Exception:
+                logger.exception('Could not create a recognizer for uploaded frames')
+            finally:
+                with self._cond:
+                    for session, _, _ in batch:
+                        self._in_flight.discard(session.session_id)
+                    # Sessions that got a new frame meanwhile can go again
+                    self._cond.notify_all()
+        if recognizer is not None:
+            recognizer.close()
+
+    def _process(self, recognizer, session, upload, decoder):
+        start = time.perf_counter()
+        image_rgb = decoder.decode(upload)
+        prepare_start = time.perf_counter()
+        STAGE_SECONDS.observe(prepare_start - start, stage='decode')
+        FRAMES.inc()
+        # Crop around the hand of the previous frame and downscale to the inference resolution
+        image_rgb, region = session.hand_roi.prepare(image_rgb)
+        # MediaPipe needs contiguous pixels, a crop that was not resized is a view
+        image_rgb = np.ascontiguousarray(image_rgb)
+        inference_start = time.perf_counter()
+        STAGE_SECONDS.observe(inference_start - prepare_start, stage='prepare')
+        recognition_result = recognizer.recognize(to_mp_image(image_rgb))
+        analysis_start = time.perf_counter()
+        STAGE_SECONDS.observe(analysis_start - inference_start, stage='inference')
+        frame = FrameAnalysis.from_recognition(recognition_result, region)
+        STAGE_SECONDS.observe(time.perf_counter() - analysis_start, stage='analysis')
+        session.process_frame(frame)
@@ -0,0 +1,392 @@
+"""
+Fits the weights of FlashcardsScheduler.nextInterval to each student's
+review history.
+
+The model is next_interval without noise or rounding: after a review, a
+card's stability S is the number of days at which the student recalls it
+with probability 0.9, and the recall probability after t days is
+R = 0.9 ** (t / S). Every review but the first of a card is a prediction,
+recalled when rated hard or better, and the weights minimise the log loss
+of those predictions, with a small pull towards DEFAULT_PARAMETERS so that
+short histories stay close to them.
+
+Students are split between the processes of a pool, and each process
+fits its students together, every student with its own weights. Their
+reviews are laid out position by position: first reviews of every card,
+then second reviews, and so on, cards ordered by number of reviews,
+longest first. Cards still reviewed at a position are then a prefix of
+those at the previous one, so a forward pass is one vectorized step per
+position over contiguous slices, with no padding, and the gradient comes
+from the matching backward pass.
+
+Run from the service directory, it writes what GET /scheduler/parameters serves:
+    python -m fsrs_optimizer --db reviews.db --out scheduler_parameters.json
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from flashcard_scheduler import AGAIN, DAY, DEFAULT_PARAMETERS, MAXIMUM_INTERVAL, MINIMUM_STABILITY
+from review_log import format_time
+
+logger = logging.getLogger(__name__)
+
+# ln 0.9: R = exp(DECAY * days / stability)
+DECAY = np.log(0.9)
+# Students with fewer predictions keep DEFAULT_PARAMETERS
+MIN_REVIEWS = 100
+_EPSILON = 1e-6
+
+# The weights as one vector: initial difficulty, difficulty delta per
+# rating, stability factor of hard, good and easy, again stability and
+# initial stability per rating
+_LOWER = np.array([1.0] + [-3.0] * 4 + [0.01] * 3 + [MINIMUM_STABILITY] * 5)
+_UPPER = np.array([10.0] + [3.0] * 4 + [20.0] * 3 + [30.0] + [100.0] * 4)
+_SCALE = (_UPPER - _LOWER) / 10
+
+
+def to_vector(parameters):
+    return np.array([parameters['initialDifficulty'], *parameters['difficultyDelta'],
+                     *parameters['stabilityFactor'][1:], parameters['againStability'],
+                     *parameters['initialStability']], dtype=np.float64)
+
+
+def from_vector(vector):
+    values = [round(float(value), 4) for value in vector]
+    return {
+        'initialDifficulty': values[0],
+        'difficultyDelta': values[1:5],
+        'stabilityFactor': [0.0] + values[5:8],
+        'againStability': values[8],
+        'initialStability': values[9:13],
+    }
+
+
+_DEFAULT_VECTOR = to_vector(DEFAULT_PARAMETERS)
+
+
+class ReviewSequences:
+    """
+    The reviews of a group of students, laid out for the forward pass: the
+    reviews at position p (the p-th review of their card) are
+    rating[offsets[p]:offsets[p + 1]], one per card still reviewed, in the
+    same card order at every position. `student` is the index in the group
+    of each review's student.
+    """
+
+    def __init__(self, histories):
+        # Cards numbered across the group, each history a non-empty (card, rating, reviewed_at)
+        card, student, card_count = [], [], 0
+        for index, history in enumerate(histories):
+            cards, numbered = np.unique(history[0], return_inverse=True)
+            card.append(numbered.reshape(-1) + card_count)
+            student.append(np.full(len(numbered), index))
+            card_count += len(cards)
+        self.students = len(histories)
+        card, student = np.concatenate(card), np.concatenate(student)
+        rating = np.concatenate([np.asarray(history[1], dtype=np.int64) for history in histories])
+        reviewed_at = np.concatenate([np.asarray(history[2], dtype=np.float64) for history in histories])
+
+        order = np.lexsort((reviewed_at, card))
+        card, student, rating, reviewed_at = card[order], student[order], rating[order], reviewed_at[order]
+        count = len(card)
+        starts = np.flatnonzero(np.r_[True, card[1:] != card[:-1]])
+        lengths = np.diff(np.r_[starts, count])
+        position = np.arange(count) - np.repeat(starts, lengths)
+        elapsed = np.diff(reviewed_at, prepend=0.0) / DAY
+        elapsed[starts] = 0.0
+        # Cards by number of reviews, longest first
+        rank = np.empty(len(lengths), dtype=np.int64)
+        rank[np.argsort(-lengths, kind='stable')] = np.arange(len(lengths))
+        layout = np.lexsort((np.repeat(rank, lengths), position))
+        self.rating = rating[layout]
+        self.student = student[layout]
+        # Into a (student, rating) table flattened
+        self.key = self.student * 4 + self.rating
+        self.elapsed = np.maximum(elapsed[layout], 0.0)
+        # log R * S, and 1.0 for reviews that do not restart learning
+        self.decay = DECAY * self.elapsed
+        self.continued = (self.rating != AGAIN).astype(np.float64)
+        self.offsets = np.r_[0, np.cumsum(np.bincount(position, minlength=1))]
+        self.reviews = np.bincount(student, minlength=self.students)
+        self.predictions = self.reviews - np.bincount(student[starts], minlength=self.students)
+
+    def per_student(self, weights, step=slice(None)):
+        # Per student
+        return np.bincount(self.student[step], weights=weights, minlength=self.students)
+
+    def per_student_rating(self, weights, step=slice(None)):
+        return np.bincount(self.key[step], weights=weights, minlength=self.students * 4).reshape(self.students, 4)
+
+
+def loss_and_gradient(vectors, sequences, prior=1.0):
+    """
+    Log loss per prediction of each student's weights, a row of `vectors`,
+    on `sequences`, and its gradient. `prior` is the weight of the pull
+    towards the defaults.
+    """
+    # Per-rating weights flattened, indexed by sequences.key
+    initial_difficulty = vectors[:, 0]
+    difficulty_delta = vectors[:, 1:5].ravel()
+    stability_factor = np.c_[np.zeros(len(vectors)), vectors[:, 5:8]].ravel()
+    again_stability = vectors[:, 8]
+    initial_stability = vectors[:, 9:13].ravel()
+    rating, student, key = sequences.rating, sequences.student, sequences.key
+    decay, continued, offsets = sequences.decay, sequences.continued, sequences.offsets
+    positions = len(offsets) - 1
+    count = len(rating)
+
+    # Forward, keeping what the backward pass needs: the stability before
+    # each review, 10 - difficulty before it, R and 1 - R
+    before_stability = np.empty(count)
+    headroom = np.empty(count)
+    recall = np.ones(count)
+    forgotten = np.empty(count)
+    stability_kept = np.ones(count, dtype=bool)     # not clipped
+    difficulty_kept = np.empty(count, dtype=bool)
+
+    first = slice(offsets[0], offsets[1])
+    k = key[first]
+    difficulty = initial_difficulty[student[first]] + difficulty_delta[k]
+    difficulty_kept[first] = (difficulty > 1) & (difficulty < 10)
+    difficulty = np.clip(difficulty, 1, 10)
+    stability = initial_stability[k]
+    for position in range(1, positions):
+        step = slice(offsets[position], offsets[position + 1])
+        active = step.stop - step.start
+        k = key[step]
+        previous_stability = before_stability[step] = stability[:active]
+        previous_headroom = headroom[step] = 10 - difficulty[:active]
+        retrievability = recall[step] = np.exp(decay[step] / previous_stability)
+        previous_forgotten = forgotten[step] = 1 - retrievability
+        grown = previous_stability * (1 + stability_factor[k] * previous_headroom * previous_forgotten)
+        stability = np.where(continued[step], grown, again_stability[student[step]])
+        stability_kept[step] = stability <= MAXIMUM_INTERVAL
+        stability = np.minimum(stability, MAXIMUM_INTERVAL)
+        difficulty = difficulty[:active] + difficulty_delta[k]
+        difficulty_kept[step] = (difficulty > 1) & (difficulty < 10)
+        difficulty = np.clip(difficulty, 1, 10)
+
+    predicted = slice(offsets[1] if positions > 1 else count, count)
+    recalled = rating[predicted] != AGAIN
+    probability = np.clip(recall[predicted], _EPSILON, 1 - _EPSILON)
+    log_loss = sequences.per_student(-np.where(recalled, np.log(probability), np.log1p(-probability)), predicted)
+    # d loss / d recall probability
+    recall_gradient = np.zeros(count)
+    recall_gradient[predicted] = np.where(recalled, -1 / probability, 1 / (1 - probability))
+
+    # Backward: adjoints of each card's stability and difficulty after the
+    # current position, contributions to the weights by review
+    stability_adjoint = np.zeros(offsets[1])
+    difficulty_adjoint = np.zeros(offsets[1])
+    delta_contribution = np.zeros(count)
+    factor_contribution = np.zeros(count)
+    again_contribution = np.zeros(count)
+    for position in range(positions - 1, 0, -1):
+        step = slice(offsets[position], offsets[position + 1])
+        active = step.stop - step.start
+        kept = continued[step]
+        previous_stability, previous_headroom = before_stability[step], headroom[step]
+        retrievability, previous_forgotten = recall[step], forgotten[step]
+        factor = stability_factor[key[step]]
+        stability_after = stability_adjoint[:active] * stability_kept[step]
+        difficulty_after = difficulty_adjoint[:active] * difficulty_kept[step]
+        delta_contribution[step] = difficulty_after
+        again_contribution[step] = stability_after - stability_after * kept
+        # Through the growth term g = factor * headroom * forgotten, S' = S * (1 + g)
+        continued_after = stability_after * kept
+        growth_adjoint = continued_after * previous_stability
+        factor_contribution[step] = growth_adjoint * previous_headroom * previous_forgotten
+        factor_adjoint = growth_adjoint * factor
+        recall_adjoint = recall_gradient[step] - factor_adjoint * previous_headroom
+        stability_adjoint[:active] = (continued_after * (1 + factor * previous_headroom * previous_forgotten)
+                                      - recall_adjoint * retrievability * decay[step] / previous_stability ** 2)
+        difficulty_adjoint[:active] = difficulty_after - factor_adjoint * previous_forgotten
+
+    difficulty_after = difficulty_adjoint * difficulty_kept[first]
+    delta_contribution[first] = difficulty_after
+    gradient = np.empty_like(vectors)
+    gradient[:, 0] = sequences.per_student(difficulty_after, first)
+    gradient[:, 1:5] = sequences.per_student_rating(delta_contribution)
+    gradient[:, 5:8] = sequences.per_student_rating(factor_contribution)[:, 1:]
+    gradient[:, 8] = sequences.per_student(again_contribution)
+    gradient[:, 9:13] = sequences.per_student_rating(stability_adjoint, first)
+
+    pull = (vectors - _DEFAULT_VECTOR) / _SCALE
+    normalizer = np.maximum(sequences.predictions, 1)
+    loss = (log_loss + prior * np.sum(pull ** 2, axis=1)) / normalizer
+    gradient = (gradient + 2 * prior * pull / _SCALE) / normalizer[:, None]
+    return loss, gradient
+
+
+def fit(sequences, iterations=150, learning_rate=0.02, prior=1.0, tolerance=1e-6):
+    """
+    Weights of each student of `sequences` by Adam, from the defaults and
+    within bounds. A student's weights stop changing once their loss
+    improves by less than `tolerance`. Returns (weights, loss, default
+    loss), a row or a value per student.
+    """
+    vectors = np.tile(_DEFAULT_VECTOR, (sequences.students, 1))
+    moment, second_moment = np.zeros_like(vectors), np.zeros_like(vectors)
+    step_size = learning_rate * (_UPPER - _LOWER)
+    best, best_loss = vectors.copy(), np.full(sequences.students, np.inf)
+    default_loss = None
+    training = np.ones(sequences.students, dtype=bool)
+    for iteration in range(1, iterations + 1):
+        loss, gradient = loss_and_gradient(vectors, sequences, prior)
+        if default_loss is None:
+            default_loss = loss
+        improved = loss < best_loss
+        training &= ~improved | (best_loss - loss >= tolerance)
+        best[improved] = vectors[improved]
+        best_loss = np.minimum(loss, best_loss)
+        if not training.any():
+            break
+        moment = 0.9 * moment + 0.1 * gradient
+        second_moment = 0.999 * second_moment + 0.001 * gradient ** 2
+        corrected = moment / (1 - 0.9 ** iteration)
+        corrected_second = second_moment / (1 - 0.999 ** iteration)
+        # Step size decays to a tenth over the iterations
+        decay = 1 - 0.9 * iteration / iterations
+        step = decay * step_size * corrected / (np.sqrt(corrected_second) + 1e-8)
+        vectors = np.where(training[:, None], np.clip(vectors - step, _LOWER, _UPPER), vectors)
+    return best, best_loss, default_loss
+
+
+def fit_group(histories, **options):
+    """Worker: fit a group of students together, [fit or None] in order"""
+    start = time.perf_counter()
+    sequences = ReviewSequences(histories)
+    vectors, loss, default_loss = fit(sequences, **options)
+    seconds = round(time.perf_counter() - start, 3)
+    return [{
+        'parameters': from_vector(vectors[index]),
+        'reviews': int(sequences.reviews[index]),
+        'loss': round(float(loss[index]), 6),
+        'defaultLoss': round(float(default_loss[index]), 6),
+        'fitSeconds': seconds,
+    } if sequences.predictions[index] >= MIN_REVIEWS else None for index in range(len(histories))]
+
+
+def fit_users(histories, workers=None, **options):
+    """
+    Fit every student of `histories`, {user: (card, rating, reviewed_at)},
+    on `workers` processes, each fitting its share of the students in one
+    batch. Returns {user: fit} for those with enough reviews.
+    """
+    if not histories:
+        return {}
+    workers = workers or os.cpu_count()
+    # Students dealt out largest first to the group with the fewest reviews so far
+    groups = [[] for _ in range(min(workers, len(histories)))]
+    sizes = [0] * len(groups)
+    for user in sorted(histories, key=lambda user: -len(histories[user][0])):
+        smallest = sizes.index(min(sizes))
+        groups[smallest].append(user)
+        sizes[smallest] += len(histories[user][0])
+    if len(groups) == 1:
+        results = [fit_group([histories[user] for user in groups[0]], **options)]
+    else:
+        with ProcessPoolExecutor(len(groups), mp_context=multiprocessing.get_context('spawn')) as executor:
+            futures = [executor.submit(fit_group, [histories[user] for user in group], **options)
+                       for group in groups]
+            results = [future.result() for future in futures]
+    return {user: result for group, group_results in zip(groups, results)
+            for user, result in zip(group, group_results) if result is not None}
+
+
+def load_histories(path):
+    """{user: (card, rating, reviewed_at)} of every review in a ReviewLog database"""
+    connection = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    try:
+        rows = connection.execute('SELECT user, deck, card, rating, reviewed_at FROM reviews ORDER BY user').fetchall()
+    finally:
+        connection.close()
+    histories = {}
+    cards = {}
+    for user, deck, card, rating, reviewed_at in rows:
+        columns = histories.get(user)
+        if columns is None:
+            columns = histories[user] = ([], [], [])
+            cards.clear()
+        columns[0].append(cards.setdefault((deck, card), len(cards)))
+        columns[1].append(rating)
+        columns[2].append(reviewed_at)
+    return {user: (np.array(card, dtype=np.int64), np.array(rating, dtype=np.int8), np.array(reviewed_at))
+            for user, (card, rating, reviewed_at) in histories.items()}
+
+
+def write_parameters(path, fitted):
+    """Write fits as ParameterStore reads them, atomically"""
+    document = {
+        'version': 1,
+        'fittedAt': format_time(time.time()),
+        'users': fitted,
+    }
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temporary = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'w') as file:
+        json.dump(document, file, indent=1)
+    os.replace(temporary, path)
+
+
+class ParameterStore:
+    """The fits written by write_parameters, read again when the file changes"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._modified = None
+        self._users = {}
+
+    def get(self, user):
+        """(parameters, fitted) of `user`, DEFAULT_PARAMETERS when they were not fitted"""
+        try:
+            modified = os.stat(self.path).st_mtime_ns
+        except OSError:
+            modified = None
+        with self._lock:
+            if modified != self._modified:
+                self._users = self._load() if modified is not None else {}
+                self._modified = modified
+            fit = self._users.get(user)
+        return (fit['parameters'], True) if fit is not None else (DEFAULT_PARAMETERS, False)
+
+    def _load(self):
+        try:
+            with open(self.path) as file:
+                return json.load(file).get('users', {})
+        except (OSError, ValueError) as e:
+            logger.warning('Could not read the scheduler parameters %s: %s', self.path, e)
+            return {}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default='reviews.db', help='ReviewLog database')
+    parser.add_argument('--out', default='scheduler_parameters.json')
+    parser.add_argument('--workers', type=int, help='processes, one per core by default')
+    parser.add_argument('--iterations', type=int, default=150)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    start = time.perf_counter()
+    histories = load_histories(args.db)
+    loaded = time.perf_counter()
+    fitted = fit_users(histories, args.workers, iterations=args.iterations)
+    write_parameters(args.out, fitted)
+    logger.info('Fitted %d of %d students, %d reviews, in %.1f s (%.1f s loading)', len(fitted), len(histories),
+                sum(len(columns[0]) for columns in histories.values()), time.perf_counter() - start, loaded - start)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+import logging
+import time
+
+from frame_analysis import FrameAnalysis
+from rule_engine import RuleEngine
+from smoothing import BucketHysteresis, GestureSmoothing
+from trajectory import TrajectoryTracker
+
+logger = logging.getLogger(__name__)
+
+
+def gesture(tgt, frame: FrameAnalysis) -> bool:
+    return frame.gesture == tgt
+
+
+# Command pointed at, by index finger angle in degrees (-90 is straight up)
+POINTING_BUCKETS = (
+    ('hide', -70, float('inf')),
+    ('forgot', -80, -70),
+    ('bad', -90, -80),
+    ('not bad', -100, -90),
+    ('ok', -110, -100),
+)
+
+def classify_pointing(angle):
+    """
+    Command the index finger points to, from its angle in degrees (-90 is
+    straight up). None when the angle is outside every bucket.
+    """
+    for command, low, high in POINTING_BUCKETS:
+        if low <= angle < high:
+            return command
+    return None
+
+
+class GesturePipeline:
+    """
+    Turns analysed frames into commands: evaluates the gesture rules and the
+    pointing direction and calls `notify(is_pointing, command)` for each
+    event to send.
+
+    `rules` is a RuleEngine, by default compiled from gesture_rules.json.
+    Every pipeline needs its own, since it holds the cooldown state.
+    `smoothing` is a GestureSmoothing; by default every frame is taken as is.
+    `trajectory` is the TrajectoryTracker of the hand motions, only fed
+    when a rule needs a motion.
+    """
+
+    def __init__(self, notify, rules=None, smoothing=None, trajectory=None):
+        self.notify = notify
+        self.rules = rules if rules is not None else RuleEngine.from_file()
+        self.smoothing = smoothing if smoothing is not None else GestureSmoothing(window=1, hysteresis=0)
+        self.trajectory = trajectory if trajectory is not None else TrajectoryTracker()
+        self.last_sent_command = None
+        self.pointing_with_finger = None
+        self.last_pointing_with_finger = None
+
+    @property
+    def smoothing(self):
+        return self._smoothing
+
+    @smoothing.setter
+    def smoothing(self, smoothing):
+        self._smoothing = smoothing
+        self._pointing_buckets = BucketHysteresis(POINTING_BUCKETS, smoothing.hysteresis)
+
+    def process(self, frame: FrameAnalysis, now=None):
+        """
+        Evaluate the rules on one frame. `now` is the frame time in seconds,
+        the wall clock by default; replays pass the clip time instead.
+        """
+        now = time.time() if now is None else now
+
+        # The rules only see classifications that held for the smoothing window
+        stable_gesture = self._smoothing.gesture(frame.gesture)
+        stable_fingers = self._smoothing.fingers(frame.finger_count)
+        if stable_gesture != frame.gesture or stable_fingers != frame.finger_count:
+            frame = frame.relabeled(stable_gesture, stable_fingers)
+
+        motion = self.trajectory.update(frame.hand_center, now) if self.rules.by_motion else None
+        command = self.rules.evaluate(frame, now, pointing=bool(self.pointing_with_finger), motion=motion)
+        if command is not None:
+            self.last_sent_command = command
+            self.notify(False, command)
+
+        pointing = self.pointing_with_finger
+        if gesture('Pointing_Up', frame):
+            # Angle between the tip and base of the index finger of the first hand
+            angle = frame.pointing_angle
+            if angle is not None:
+                # Outside every bucket, or within the hysteresis margin, the previous direction is kept
+                pointing = self._pointing_buckets.update(angle)
+                logger.debug('Angle between index finger tip and base: %.2f degrees, pointing %s',
+                             angle, pointing)
+        else:
+            pointing = None
+            self._pointing_buckets.reset()
+        self.pointing_with_finger = self._smoothing.pointing(pointing)
+
+        if self.pointing_with_finger != self.last_pointing_with_finger:
+            logger.debug('Sending pointing notification')
+            self.last_pointing_with_finger = self.pointing_with_finger
+            self.notify(True, self.pointing_with_finger)
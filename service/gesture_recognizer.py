@@ -1,62 +1,168 @@
+import logging
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from trajectory import TrajectoryTracker
+
+# Landmark indices of the hand model, see
+# https://ai.google.dev/edge/mediapipe/solutions/vision/hand_landmarker
+WRIST = 0
+THUMB_CMC, THUMB_MCP, THUMB_IP, THUMB_TIP = 1, 2, 3, 4
+INDEX_MCP, INDEX_PIP, INDEX_TIP = 5, 6, 8
+MIDDLE_MCP = 9
+NUM_LANDMARKS = 21
+# Landmarks compared by hand_features, each of _ABOVE above its _BELOW:
+# the four fingers raised, the thumb above its base, thumb tip above IP above MCP
+_ABOVE = [INDEX_TIP, 12, 16, 20, THUMB_TIP, THUMB_TIP, THUMB_IP]
+_BELOW = [INDEX_PIP, 10, 14, 18, THUMB_CMC, THUMB_IP, THUMB_MCP]
+
+
+def _difference_weights():
+    # Flattened (hands, 63) landmarks times these weights give, per hand, the
+    # y of each _BELOW minus that of its _ABOVE (positive when above), then the
+    # x and y of the index finger from its base to its tip. The weights are
+    # 0 or +-1, so each difference is rounded once, as if subtracted directly.
+    weights = np.zeros((NUM_LANDMARKS, 3, len(_ABOVE) + 2), dtype=np.float32)
+    for column, (above, below) in enumerate(zip(_ABOVE, _BELOW)):
+        weights[below, 1, column] += 1
+        weights[above, 1, column] -= 1
+    for axis in (0, 1):
+        weights[INDEX_TIP, axis, len(_ABOVE) + axis] = 1
+        weights[INDEX_MCP, axis, len(_ABOVE) + axis] = -1
+    return weights.reshape(NUM_LANDMARKS * 3, -1)
+
+
+_DIFFERENCE_WEIGHTS = _difference_weights()
+
+# Per-hand predicates, arrays of shape (hands,) or (hands, 2) for index_pos:
+# number of raised fingers (thumb excluded), 1 where the thumb tip is above its
+# base, thumbs up (thumb extended upwards and every other finger folded), (x, y)
+# of the index finger tip and the angle in degrees of the index finger from its
+# base to its tip (pointing straight up is -90)
+HandFeatures = namedtuple('HandFeatures', 'fingers thumb thumbs_up index_pos pointing_angle')
+
+logger = logging.getLogger(__name__)
+
+
+def _landmark_list(hand_landmarks):
+    # Legacy solutions return a NormalizedLandmarkList proto, the tasks API a plain list
+    return getattr(hand_landmarks, 'landmark', hand_landmarks)
+
+
+def landmarks_to_array(multi_hand_landmarks):
+    """
+    Convert the landmarks of every detected hand into a single
+    (hands, 21, 3) float32 array of normalized x, y, z coordinates.
+
+    Accepts the `hand_landmarks` of a tasks result, the `multi_hand_landmarks`
+    of a legacy result, None, or an array (returned unchanged).
+    """
+    if isinstance(multi_hand_landmarks, np.ndarray):
+        if multi_hand_landmarks.ndim == 2:
+            return multi_hand_landmarks[np.newaxis]
+        return multi_hand_landmarks
+    if not multi_hand_landmarks:
+        return np.empty((0, NUM_LANDMARKS, 3), dtype=np.float32)
+    hands = [_landmark_list(hand) for hand in multi_hand_landmarks]
+    if isinstance(hands[0], np.ndarray):
+        return np.asarray(hands, dtype=np.float32)
+    values = np.fromiter(
+        (v for hand in hands for lm in hand for v in (lm.x, lm.y, lm.z)),
+        dtype=np.float32,
+        count=len(hands) * NUM_LANDMARKS * 3,
+    )
+    return values.reshape(len(hands), NUM_LANDMARKS, 3)
+
+
+def hand_center_array(landmarks):
+    """Palm center (between wrist and middle finger base), shape (hands, 2)"""
+    return (landmarks[:, WRIST, :2] + landmarks[:, MIDDLE_MCP, :2]) * 0.5
+
+
+def hand_features(multi_hand_landmarks):
+    """
+    Every per-hand predicate, see HandFeatures, in one vectorized pass over
+    the (hands, 21, 3) landmark array. Accepts what landmarks_to_array does.
+
+    The coordinate differences the predicates compare all come from a single
+    matrix product, so the number of numpy calls is the same for any number
+    of hands.
+    """
+    landmarks = landmarks_to_array(multi_hand_landmarks)
+    differences = landmarks.reshape(len(landmarks), NUM_LANDMARKS * 3) @ _DIFFERENCE_WEIGHTS
+    raised = differences[:, :5] > 0
+    return HandFeatures(
+        raised[:, :4].sum(axis=1),
+        raised[:, 4].astype(np.int8),
+        (differences[:, 5] > 0) & (differences[:, 6] > 0) & (differences[:, :4] < 0).all(axis=1),
+        landmarks[:, INDEX_TIP, :2],
+        np.degrees(np.arctan2(differences[:, 8], differences[:, 7])),
+    )
+
+
 class GestureRecognizer:
     def __init__(self) -> None:
-        from mediapipe import solutions as mp_solutions
         from queue import Queue
-        from collections import deque
-        import time
 
         self.cmd_queue = Queue()
-        self.mp_hands = mp_solutions.hands #type:ignore
-        self.mp_drawing = mp_solutions.drawing_utils #type:ignore
-        self.hands = self.mp_hands.Hands(min_detection_confidence=0.7)
-        self.hands_for_thumb = self.mp_hands.Hands(
-            static_image_mode=False,
-            max_num_hands=2,
-            min_detection_confidence=0.7,
-            min_tracking_confidence=0.5
-        )
+        # Legacy mp_solutions models, only built by the methods that take an image
+        self._mp_hands = None
+        self._mp_drawing = None
+        self._hands = None
+        self._hands_for_thumb = None
         
         # For movement tracking
-        self.hand_positions = deque(maxlen=10)  # Store last 10 positions
         self.movement_threshold = 0.1  # Minimum movement distance
         self.consecutive_frames = 5    # Frames needed for consistent movement
+        self.trajectory = TrajectoryTracker(window=self.consecutive_frames, distance=self.movement_threshold)
 
-        self.frames = 0
-        self.last_frame_reset = time.time()
-        self.store_threshold = 1/10
-    
+    @property
+    def mp_hands(self):
+        if self._mp_hands is None:
+            from mediapipe import solutions as mp_solutions
+            self._mp_hands = mp_solutions.hands #type:ignore
+        return self._mp_hands
 
-    def _store_hand_position(self, pos):
-        self.hand_positions.append(pos)
-    
-    def _get_hand_position(self, multi_hand_landmarks):
+    @property
+    def mp_drawing(self):
+        if self._mp_drawing is None:
+            from mediapipe import solutions as mp_solutions
+            self._mp_drawing = mp_solutions.drawing_utils #type:ignore
+        return self._mp_drawing
+
+    @property
+    def hands(self):
+        if self._hands is None:
+            self._hands = self.mp_hands.Hands(min_detection_confidence=0.7)
+        return self._hands
+
+    @property
+    def hands_for_thumb(self):
+        if self._hands_for_thumb is None:
+            self._hands_for_thumb = self.mp_hands.Hands(
+                static_image_mode=False,
+                max_num_hands=2,
+                min_detection_confidence=0.7,
+                min_tracking_confidence=0.5
+            )
+        return self._hands_for_thumb
+
+    @staticmethod
+    def _get_hand_position(multi_hand_landmarks):
         # Get the first hand's center position (palm center)
-        hand_landmarks = multi_hand_landmarks[0]
-        landmarks = hand_landmarks.landmark
-        
-        # Calculate hand center using wrist and middle finger base
-        wrist = landmarks[0]
-        middle_mcp = landmarks[9]
-        hand_center_x = (wrist.x + middle_mcp.x) / 2
-        hand_center_y = (wrist.y + middle_mcp.y) / 2
-        return hand_center_x, hand_center_y
+        x, y = hand_center_array(landmarks_to_array(multi_hand_landmarks[:1]))[0]
+        return float(x), float(y)
     
 
     def has_any_thumbs_up(self, image_rgb):
         result = self.process_hands(image_rgb)
-        if result.multi_hand_landmarks:
-            for hand_landmarks in result.multi_hand_landmarks:
-                if self.is_thumbs_up(hand_landmarks):
-                    return True
-        return False
+        return bool(hand_features(result.multi_hand_landmarks).thumbs_up.any())
     
     def count_open_fingers(self, image_rgb):
-        count = 0
         result = self.process_hands(image_rgb)
-        if result.multi_hand_landmarks:
-            for hand_landmarks in result.multi_hand_landmarks:
-                count += self.count_fingers(hand_landmarks)
-        return count
+        return int(hand_features(result.multi_hand_landmarks).fingers.sum())
 
     def detect_left_to_right_movement(self, image_rgb):
         """
@@ -66,57 +172,21 @@ class GestureRecognizer:
         result = self.process_hands(image_rgb)
         
         if result.multi_hand_landmarks:
-            hand_center_x, hand_center_y = self._get_hand_position(result.multi_hand_landmarks)
-            print(hand_center_x, hand_center_y)
-            
-            # Store current position with timestamp
-            import time
-            current_time = time.time()
-            elapsed_time = current_time - self.last_frame_reset
-            if elapsed_time > self.store_threshold:
-                self._store_hand_position((hand_center_x, hand_center_y))
-                self.last_frame_reset = current_time
-            
-            # Check if we have enough positions to detect movement
-            if len(self.hand_positions) >= self.consecutive_frames:
-                return self._analyze_movement_pattern()
-        else:
-            # No hand detected, clear positions
-            self.hand_positions.clear()
-        
-        return False
+            return self.update_hand_position(self._get_hand_position(result.multi_hand_landmarks))
+        return self.update_hand_position(None)
 
-    def _analyze_movement_pattern(self):
+    def update_hand_position(self, hand_center, now=None):
         """
-        Analyze stored hand positions to detect left-to-right movement
+        Feed the hand center of the current frame (None if no hand is visible)
+        and its time in seconds, the wall clock by default; replays pass the
+        recording time instead.
+        Returns True if left-to-right movement is detected, a swipe or a
+        flick, see TrajectoryTracker; once per movement.
         """
-        if len(self.hand_positions) < self.consecutive_frames:
-            return False
-        
-        # Get recent positions
-        recent_positions = list(self.hand_positions)[-self.consecutive_frames:]
-        
-        # Calculate total horizontal movement
-        start_x = recent_positions[0][0]
-        end_x = recent_positions[-1][0]
-        total_movement = end_x - start_x
-        
-        # Check if movement is significant and rightward
-        if total_movement < self.movement_threshold:
-            return False
-        
-        # Verify consistent rightward movement
-        rightward_movements = 0
-        for i in range(1, len(recent_positions)):
-            prev_x = recent_positions[i-1][0]
-            curr_x = recent_positions[i][0]
-            
-            if curr_x > prev_x:  # Moving right
-                rightward_movements += 1
-        
-        # Require at least 70% of movements to be rightward
-        consistency_threshold = len(recent_positions) * 0.7
-        return rightward_movements >= consistency_threshold
+        if hand_center is not None:
+            logger.debug('Hand center: %.3f, %.3f', *hand_center)
+        motion = self.trajectory.update(hand_center, time.time() if now is None else now)
+        return motion in ('swipe_right', 'flick_right')
 
     def set_movement_sensitivity(self, threshold=0.1, frames=5):
         """
@@ -128,69 +198,32 @@ class GestureRecognizer:
         """
         self.movement_threshold = threshold
         self.consecutive_frames = frames
-        self.hand_positions = deque(maxlen=max(frames * 2, 10))
-
+        self.trajectory = TrajectoryTracker.from_config({**self.trajectory.to_config(),
+                                                         'window': frames, 'distance': threshold})
 
-    
-    
     def process_hands(self, image_rgb):
         return self.hands.process(image_rgb)
         
 
-    def count_fingers(self, hand_landmarks):
-        finger_tips = [8, 12, 16, 20]  
-        fingers_up = 0
-        landmarks = hand_landmarks.landmark
-        
-        for tip in finger_tips:
-            if landmarks[tip].y < landmarks[tip - 2].y: 
-                fingers_up += 1
-
-        return fingers_up
-
+    # Single hand helpers, kept for callers that work one hand at a time.
+    # They accept a legacy landmark list, a tasks landmark list or a (21, 3) array.
+    @staticmethod
+    def count_fingers(hand_landmarks):
+        return int(hand_features([hand_landmarks]).fingers[0])
 
-    def detect_thumb(self, hand_landmarks):
-        landmarks = hand_landmarks.landmark
-        if landmarks[4].y < landmarks[1].y:  
-            return 1
-        return 0
+    @staticmethod
+    def detect_thumb(hand_landmarks):
+        return int(hand_features([hand_landmarks]).thumb[0])
     
-    def get_index_pos(self, hand_landmarks):
-        landmarks = hand_landmarks.landmark
-        return (landmarks[8].x, landmarks[8].y)
+    @staticmethod
+    def get_index_pos(hand_landmarks):
+        x, y = hand_features([hand_landmarks]).index_pos[0].tolist()
+        return x, y
 
-    def is_thumbs_up(self, hand_landmarks):
+    @staticmethod
+    def is_thumbs_up(hand_landmarks):
         """
         Detect thumbs up gesture based on hand landmarks
         Returns True if thumbs up is detected
         """
-        landmarks = hand_landmarks.landmark
-        # Get landmark positions
-        thumb_tip = landmarks[4]      # Thumb tip
-        thumb_ip = landmarks[3]       # Thumb IP joint
-        thumb_mcp = landmarks[2]      # Thumb MCP joint
-        
-        index_tip = landmarks[8]      # Index finger tip
-        index_pip = landmarks[6]      # Index finger PIP joint
-        
-        middle_tip = landmarks[12]    # Middle finger tip
-        middle_pip = landmarks[10]    # Middle finger PIP joint
-        
-        ring_tip = landmarks[16]      # Ring finger tip
-        ring_pip = landmarks[14]      # Ring finger PIP joint
-        
-        pinky_tip = landmarks[20]     # Pinky tip
-        pinky_pip = landmarks[18]     # Pinky PIP joint
-        
-        # Check if thumb is extended (pointing up)
-        thumb_extended = thumb_tip.y < thumb_ip.y < thumb_mcp.y
-        
-        # Check if other fingers are folded (tips below PIP joints)
-        index_folded = index_tip.y > index_pip.y
-        middle_folded = middle_tip.y > middle_pip.y
-        ring_folded = ring_tip.y > ring_pip.y
-        pinky_folded = pinky_tip.y > pinky_pip.y
-        
-        # Thumbs up: thumb extended and other fingers folded
-        return (thumb_extended and index_folded and 
-                middle_folded and ring_folded and pinky_folded)
+        return bool(hand_features([hand_landmarks]).thumbs_up[0])
@@ -0,0 +1,470 @@
+import logging
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import cv2
+
+from camera_capture import CameraCapture
+from frame_analysis import FrameAnalysis
+from frame_scheduler import FrameRateScheduler
+from frame_source import UPLOAD_SOURCE, resolve_clip_source
+from gesture_pipeline import GesturePipeline
+from hand_roi import HandRoi
+from inference import RUNNING_MODES, create_inference
+from landmark_recording import EXTENSION, LandmarkRecorder
+from metrics import STAGE_SECONDS, FRAMES, FRAMES_DROPPED, MOTION_GATE_FRAMES
+from motion_gate import MotionGate
+from smoothing import GestureSmoothing
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SESSION = 'default'
+# queued: waiting for a free worker, starting: loading the model and opening
+# the camera, error: the camera loop could not start or stopped on its own
+SESSION_STATES = ('stopped', 'queued', 'starting', 'running', 'stopping', 'error')
+MAX_SESSION_ID_LENGTH = 64
+
+
+def session_id_from(value):
+    """Session id from a request field, DEFAULT_SESSION when it is missing"""
+    if value is None or value == '':
+        return DEFAULT_SESSION
+    if not isinstance(value, (str, int)) or isinstance(value, bool):
+        raise ValueError('session must be a string')
+    value = str(value)
+    if len(value) > MAX_SESSION_ID_LENGTH:
+        raise ValueError(f'session must be at most {MAX_SESSION_ID_LENGTH} characters')
+    return value
+
+
+class GestureSession:
+    """
+    One gesture station: its frame source and camera loop, its rule,
+    smoothing and pointing state, and the Socket.IO room its notifications
+    are sent to (named after the session).
+
+    `notify(room, is_pointing, command)` sends one event and
+    `on_state(session_id, state, message)`, if given, is called on every
+    state change, from whichever thread made it. start() and stop() only
+    begin the transition and return straight away. IMAGE mode
+    sessions use the recognizer of `models`, one frame at a time through
+    `inference_lock` since it is shared; LIVE_STREAM sessions create their own.
+    'process_pool' sessions run inference on `inference_pool`, shared by all.
+
+    With the 'upload' source there is no camera loop: the client sends the
+    frames and the SessionManager's FrameBatcher runs them.
+
+    With "record" on, each run writes what the recognizer saw to a
+    LandmarkRecorder file under `recordings`, named after the session and
+    the start time.
+
+    Sources other than webcams and 'upload' are clips under `clips`, see
+    resolve_clip_source.
+
+    `recognizer_options` are those of the recognizers it creates itself,
+    see create_recognizer, and `inference_defaults` the HandRoi settings
+    that an "inference" setting does not override, see ModelConfig.
+    """
+
+    def __init__(self, session_id, notify, models, inference_lock=None, inference_pool=None, on_state=None,
+                 recordings=None, recognizer_options=None, inference_defaults=None, clips=None):
+        self.session_id = session_id
+        self.on_state = on_state
+        self.room = session_id
+        self.models = models
+        self.inference_lock = inference_lock
+        self.inference_pool = inference_pool
+        self.frame_scheduler = FrameRateScheduler()
+        self.recognizer_options = recognizer_options or {}
+        self.inference_defaults = inference_defaults or {}
+        self.hand_roi = HandRoi.from_config(self.inference_defaults)
+        self.motion_gate = MotionGate()
+        self.last_analysis = None
+        # Skipped frames are processed on the camera thread, results may come from another one
+        self._process_lock = threading.Lock()
+        self.running_mode = 'image'  # or 'live_stream', see inference.py
+        self.frame_source = 0  # webcam index, 'upload', or video file or image directory under `clips`
+        self.clips = clips
+        self.recordings = recordings
+        self.record = False
+        self.recorder = None
+        self._record_start = 0.0
+        # Commands and pointing changes are only sent once stable for a few frames
+        self.pipeline = GesturePipeline(
+            lambda is_pointing, command: notify(self.room, is_pointing, command),
+            smoothing=GestureSmoothing(),
+        )
+        self.enabled = False
+        self.error = None
+        self._state = 'stopped'
+        self._state_lock = threading.Lock()
+        self.uploading = False
+        self.frames_uploaded = 0
+        self.capture = None
+        self.stop_event = threading.Event()
+        self.future = None
+
+    def configure(self, config):
+        """
+        Apply the optional /enable-camera body:
+            {"frame_rate": {"mode": "adaptive", "idle_fps": 2, "active_fps": 15, ...},
+             "inference": {"roi": true, "resolution": 320, "margin": 0.3, ...},
+             "motion_gate": {"enabled": true, "pixel_threshold": 12, "force_every": 10, ...},
+             "smoothing": {"window": 3, "min_votes": 0, "hysteresis": 5},
+             "running_mode": "image" | "live_stream" | "process_pool",
+             "source": 0 | "clip.mp4" | "images/" | "upload",
+             "record": false}
+        Raises ValueError or TypeError on a bad value, without applying anything.
+        The running mode and source take effect on the next start.
+        """
+        if not isinstance(config, dict):
+            raise ValueError('Camera settings must be an object')
+        running_mode = config.get('running_mode', self.running_mode)
+        if running_mode not in RUNNING_MODES:
+            raise ValueError(f"Unknown running mode '{running_mode}', expected one of {', '.join(RUNNING_MODES)}")
+        if running_mode == 'process_pool' and self.inference_pool is None:
+            raise ValueError("The 'process_pool' running mode is not available")
+        frame_scheduler = (FrameRateScheduler.from_config(config['frame_rate'])
+                           if 'frame_rate' in config else self.frame_scheduler)
+        if 'inference' in config and not isinstance(config['inference'], dict):
+            raise ValueError('inference settings must be an object')
+        hand_roi = (HandRoi.from_config({**self.inference_defaults, **config['inference']})
+                    if 'inference' in config else self.hand_roi)
+        smoothing = (GestureSmoothing.from_config(config['smoothing'])
+                     if 'smoothing' in config else self.pipeline.smoothing)
+        motion_gate = MotionGate.from_config(config['motion_gate']) if 'motion_gate' in config else self.motion_gate
+        if 'source' in config:
+            resolve_clip_source(config['source'], self.clips)
+        record = config.get('record', self.record)
+        if not isinstance(record, bool):
+            raise ValueError('record must be true or false')
+        if record and self.recordings is None:
+            raise ValueError('Recording is not available')
+
+        self.running_mode = running_mode
+        self.frame_scheduler = frame_scheduler
+        self.hand_roi = hand_roi
+        self.pipeline.smoothing = smoothing
+        self.motion_gate = motion_gate
+        self.frame_source = config.get('source', self.frame_source)
+        self.record = record
+
+    def to_config(self):
+        return {
+            'frame_rate': self.frame_scheduler.to_config(),
+            'inference': self.hand_roi.to_config(),
+            'smoothing': self.pipeline.smoothing.to_config(),
+            'motion_gate': self.motion_gate.to_config(),
+            'running_mode': self.running_mode,
+            'source': self.frame_source,
+            'record': self.record,
+        }
+
+    @property
+    def state(self):
+        """One of SESSION_STATES"""
+        return self._state
+
+    def _set_state(self, state, message=None, run=None):
+        """
+        `run` is the stop event of the camera loop reporting the change:
+        changes from a loop that has been replaced by a newer one are
+        ignored, and a loop being stopped can only report its end.
+        """
+        with self._state_lock:
+            if run is not None:
+                if run is not self.stop_event:
+                    return
+                if run.is_set() and state in ('starting', 'running'):
+                    return
+            self._state = state
+            self.error = message
+        if self.on_state is not None:
+            self.on_state(self.session_id, state, message)
+
+    def status(self):
+        return {
+            'session': self.session_id,
+            'state': self.state,
+            'camera_enabled': self.enabled,
+            'error': self.error,
+            'thread_alive': self.future is not None and self.future.running(),
+            'frames_captured': self._frames_captured(),
+            'frames_dropped': self.capture.frames_dropped if self.capture else 0,
+            'fps': self.frame_scheduler.fps,
+            'hand_tracked': self.hand_roi.tracking,
+            'pointing': self.pipeline.pointing_with_finger,
+            'motion_gate_hit_rate': round(self.motion_gate.hit_rate, 3),
+            'recording': self.recorder.path if self.recorder is not None else None,
+            **self.to_config(),
+        }
+
+    def _frames_captured(self):
+        if self.uploading:
+            return self.frames_uploaded
+        return self.capture.frames_captured if self.capture else 0
+
+    def start(self, executor):
+        """Schedule the camera loop on `executor`, False if it is already enabled"""
+        if self.enabled:
+            return False
+        self.enabled = True
+        self.uploading = self.frame_source == UPLOAD_SOURCE
+        if self.uploading:
+            self.capture = None
+            self.frames_uploaded = 0
+            self.hand_roi.reset()
+            self.pipeline.smoothing.reset()
+            self.pipeline.trajectory.reset()
+            self._start_recording()
+            self._set_state('running')
+            return True
+        # A new event per run, so a loop still winding down is not restarted
+        # and cannot report over the new one
+        self.stop_event = threading.Event()
+        self._set_state('queued')
+        self.future = executor.submit(self.run, self.stop_event)
+        return True
+
+    def stop(self):
+        """
+        Ask the camera loop to stop, False if it was not enabled. The state is
+        'stopping' until the loop has released the camera.
+        """
+        if not self.enabled:
+            return False
+        self.enabled = False
+        if self.uploading:
+            self._stop_recording()
+            self._set_state('stopped')
+            return True
+        self.stop_event.set()
+        if self.future.cancel():
+            # Still queued, it never started
+            self._set_state('stopped')
+        else:
+            self._set_state('stopping')
+        return True
+
+    def process_frame(self, frame: FrameAnalysis):
+        """
+        Evaluate the gesture rules and the pointing direction on one analysed
+        frame. Called by the inference pipeline, either on the camera thread
+        ('image' running mode) or from MediaPipe's result callback ('live_stream'),
+        and on the camera thread for the frames the motion gate skips.
+        """
+        with self._process_lock:
+            start = time.perf_counter()
+            self.last_analysis = frame
+            recorder = self.recorder
+            if recorder is not None:
+                recorder.write(frame, time.monotonic() - self._record_start)
+            self.hand_roi.update(frame.landmarks)
+            self.pipeline.process(frame)
+            STAGE_SECONDS.observe(time.perf_counter() - start, stage='rules')
+            # Slow down while nobody is in front of the camera, speed up while a hand is
+            self.frame_scheduler.update(frame.has_hand, self.pipeline.pointing_with_finger is not None)
+
+    def run(self, stop_event):
+        error = 'Camera loop failed'
+        try:
+            error = self._run(stop_event)
+        finally:
+            if self.stop_event is stop_event:
+                self.enabled = False
+            self._set_state('error' if error else 'stopped', error, run=stop_event)
+
+    def _run(self, stop_event):
+        """The camera loop, returns why it stopped on its own or None"""
+        self._set_state('starting', run=stop_event)
+        # live_stream mode creates its own recognizer, bound to its result callback
+        recognizer = None
+        if self.running_mode == 'image':
+            try:
+                recognizer = self.models.get('gesture_recognizer')
+            except Exception as e:
+                logger.warning('[%s] Unable to load the gesture recognizer: %s', self.session_id, e)
+                return f'Unable to load the gesture recognizer: {e}'
+        # Resolved again, the clip may have been removed or replaced since configure()
+        try:
+            source = resolve_clip_source(self.frame_source, self.clips)
+        except ValueError as e:
+            logger.warning('[%s] %s', self.session_id, e)
+            return str(e)
+        capture = self.capture = CameraCapture(source)
+        if not capture.start():
+            logger.warning('[%s] Unable to read video', self.session_id)
+            return 'Unable to read video'
+        self._set_state('running', run=stop_event)
+        self.hand_roi.reset()
+        self.pipeline.smoothing.reset()
+        self.pipeline.trajectory.reset()
+        self.motion_gate.reset()
+        self.last_analysis = None
+        self._start_recording()
+        inference = create_inference(self.running_mode, self.process_frame, recognizer=recognizer,
+                                     lock=self.inference_lock, pool=self.inference_pool, **self.recognizer_options)
+        frames_dropped = 0
+
+        try:
+            while not stop_event.is_set():
+                # Always the newest frame, the ones inference had no time for are dropped
+                capture_start = time.perf_counter()
+                success, image = capture.read()
+                frame_start = time.monotonic()
+                if not success:
+                    logger.warning('[%s] Unable to read video', self.session_id)
+                    break
+                read_end = time.perf_counter()
+                STAGE_SECONDS.observe(read_end - capture_start, stage='capture')
+                FRAMES.inc()
+                FRAMES_DROPPED.inc(capture.frames_dropped - frames_dropped)
+                frames_dropped = capture.frames_dropped
+
+                if self._gated(image):
+                    # Nothing moved since the last inference, its result still holds
+                    self.process_frame(self.last_analysis)
+                else:
+                    # Crop around the hand of the previous frame and downscale to the inference resolution
+                    prepare_start = time.perf_counter()
+                    image, region = self.hand_roi.prepare(image)
+                    color_start = time.perf_counter()
+                    STAGE_SECONDS.observe(color_start - prepare_start, stage='prepare')
+                    # Convert the image to RGB as mediapipe expects RGB input
+                    image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+                    STAGE_SECONDS.observe(time.perf_counter() - color_start, stage='color')
+                    # In 'image' mode this runs the rules before returning, in
+                    # 'live_stream' mode they run once the result comes back
+                    if inference.submit(image_rgb, region):
+                        self.motion_gate.commit()
+
+                if self.frame_scheduler.wait(time.monotonic() - frame_start, stop_event):
+                    break
+
+        finally:
+            inference.close()
+            self._stop_recording()
+            capture.release()
+            logger.info('[%s] Camera released (%d stale frames dropped)', self.session_id, capture.frames_dropped)
+
+
+    def _gated(self, image):
+        """True when `image` is close enough to the last inferred frame to reuse its analysis"""
+        if not self.motion_gate.enabled:
+            return False
+        start = time.perf_counter()
+        result = self.motion_gate.check(image, reusable=self.last_analysis is not None)
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage='gate')
+        MOTION_GATE_FRAMES.inc(result='skipped' if result == MotionGate.STATIC else result)
+        return result == MotionGate.STATIC
+
+    def _start_recording(self):
+        if not self.record:
+            return
+        name = re.sub(r'[^A-Za-z0-9_.-]', '_', self.session_id)
+        path = os.path.join(self.recordings, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}{EXTENSION}")
+        self._record_start = time.monotonic()
+        try:
+            self.recorder = LandmarkRecorder(path, {'session': self.session_id, **self.to_config()})
+        except OSError as e:
+            logger.warning('[%s] Unable to record to %s: %s', self.session_id, path, e)
+
+    def _stop_recording(self):
+        recorder, self.recorder = self.recorder, None
+        if recorder is not None:
+            recorder.close()
+            logger.info('[%s] Recorded %d frames to %s', self.session_id, recorder.frames, recorder.path)
+
+
+class SessionManager:
+    """
+    Gesture sessions by id, their camera loops scheduled on a bounded pool
+    of worker threads. A session started while every worker is busy is
+    queued until another one stops. Frames uploaded to 'upload' sessions
+    go to `batcher`, a FrameBatcher; 'process_pool' sessions share
+    `inference_pool`, an InferencePool. `on_state`, `recordings`,
+    `recognizer_options`, `inference_defaults` and `clips` are passed to
+    every session.
+    """
+
+    def __init__(self, notify, models, max_workers=4, max_sessions=64, batcher=None, inference_pool=None,
+                 on_state=None, recordings=None, recognizer_options=None, inference_defaults=None, clips=None):
+        self.notify = notify
+        self.on_state = on_state
+        self.recordings = recordings
+        self.clips = clips
+        self.recognizer_options = recognizer_options
+        self.inference_defaults = inference_defaults
+        self.models = models
+        self.batcher = batcher
+        self.inference_pool = inference_pool
+        self.max_workers = max_workers
+        self.max_sessions = max_sessions
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='gesture-session')
+        self._sessions = {}
+        self._lock = threading.Lock()
+        # IMAGE mode sessions share one recognizer, one frame at a time
+        self.inference_lock = threading.Lock()
+
+    def get(self, session_id):
+        return self._sessions.get(session_id)
+
+    def get_or_create(self, session_id):
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                if len(self._sessions) >= self.max_sessions:
+                    raise ValueError(f'Too many sessions, at most {self.max_sessions}')
+                session = self._sessions[session_id] = GestureSession(
+                    session_id, self.notify, self.models, self.inference_lock, self.inference_pool,
+                    self.on_state, self.recordings, self.recognizer_options, self.inference_defaults, self.clips)
+            return session
+
+    def start(self, session_id):
+        with self._lock:
+            return self._sessions[session_id].start(self._executor)
+
+    def stop(self, session_id):
+        session = self._sessions.get(session_id)
+        if session is None:
+            return False
+        if session.uploading and self.batcher is not None:
+            self.batcher.discard(session_id)
+        return session.stop()
+
+    def upload(self, session_id, upload):
+        """
+        Queue a frame uploaded to `session_id`. False when that session is
+        not running with the 'upload' source, ValueError if the frame is malformed.
+        """
+        session = self._sessions.get(session_id)
+        if session is None or not (session.enabled and session.uploading) or self.batcher is None:
+            return False
+        self.batcher.submit(session, upload)
+        session.frames_uploaded += 1
+        return True
+
+    @property
+    def running(self):
+        return sum(session.state == 'running' for session in self._sessions.values())
+
+    def status(self):
+        return {
+            'max_workers': self.max_workers,
+            'running': self.running,
+            'sessions': {session_id: session.status() for session_id, session in list(self._sessions.items())},
+        }
+
+    def shutdown(self, timeout=2):
+        """Stop every session and wait up to `timeout` seconds for the camera loops to release their cameras"""
+        futures = [session.future for session in list(self._sessions.values())
+                   if session.stop() and session.future is not None]
+        wait(futures, timeout=timeout)
+        self._executor.shutdown(wait=False)
+        if self.batcher is not None:
+            self.batcher.close()
+        if self.inference_pool is not None:
+            self.inference_pool.close()
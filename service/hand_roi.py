@@ -0,0 +1,134 @@
+import cv2
+
+
+class HandRoi:
+    """
+    Chooses the part of the camera frame that is sent to inference.
+
+    While a hand is tracked only a square crop around the previous frame's
+    landmarks (plus a margin) is used; when tracking is lost, and every
+    `refresh_every` frames to catch hands entering the scene, the full frame
+    is used instead. Either way the image is downscaled so that its longest
+    side is at most `resolution` pixels.
+
+    Regions are (x0, y0, x1, y1) in normalized full-frame coordinates, and
+    `to_frame` maps landmarks found in a region back to the full frame, so the
+    rules keep working with the same thresholds.
+    """
+
+    FULL_FRAME = (0.0, 0.0, 1.0, 1.0)
+    DEFAULTS = {
+        'roi': True,
+        'resolution': 320,
+        'margin': 0.3,
+        'refresh_every': 15,
+    }
+
+    def __init__(self, roi=True, resolution=320, margin=0.3, refresh_every=15):
+        resolution = int(resolution or 0)
+        margin = float(margin)
+        refresh_every = int(refresh_every)
+        if resolution < 0:
+            raise ValueError('resolution must not be negative (0 keeps the camera resolution)')
+        if margin < 0:
+            raise ValueError('margin must not be negative')
+        if refresh_every < 1:
+            raise ValueError('refresh_every must be at least 1')
+
+        self.roi = bool(roi)
+        self.resolution = resolution
+        self.margin = margin
+        self.refresh_every = refresh_every
+        self._tracked = None    # bounding box of the hands in the last frame
+        self._since_full_frame = 0
+
+    @classmethod
+    def from_config(cls, config):
+        """Build from a dict such as the `inference` field of /enable-camera"""
+        config = config or {}
+        unknown = set(config) - set(cls.DEFAULTS)
+        if unknown:
+            raise ValueError(f"Unknown inference settings: {', '.join(sorted(unknown))}")
+        return cls(**{**cls.DEFAULTS, **config})
+
+    def to_config(self):
+        return {name: getattr(self, name) for name in self.DEFAULTS}
+
+    @property
+    def tracking(self):
+        return self._tracked is not None
+
+    def prepare(self, image):
+        """
+        Crop and downscale a camera frame. Returns the image to run inference
+        on and the region of the frame it covers.
+        """
+        height, width = image.shape[:2]
+        region = self._next_region(width, height)
+        if region != self.FULL_FRAME:
+            x0, y0, x1, y1 = (round(region[0] * width), round(region[1] * height),
+                              round(region[2] * width), round(region[3] * height))
+            image = image[y0:y1, x0:x1]
+            # The region of the pixels actually kept
+            region = (x0 / width, y0 / height, x1 / width, y1 / height)
+        return self._downscale(image), region
+
+    @classmethod
+    def to_frame(cls, landmarks, region):
+        """Map (hands, 21, 3) landmarks normalized to `region` into full-frame coordinates"""
+        if region == cls.FULL_FRAME or len(landmarks) == 0:
+            return landmarks
+        x0, y0, x1, y1 = region
+        mapped = landmarks.copy()
+        mapped[:, :, 0] = x0 + landmarks[:, :, 0] * (x1 - x0)
+        mapped[:, :, 1] = y0 + landmarks[:, :, 1] * (y1 - y0)
+        # z shares the scale of x
+        mapped[:, :, 2] = landmarks[:, :, 2] * (x1 - x0)
+        return mapped
+
+    def update(self, landmarks):
+        """Track the hands found in the current frame, given in full-frame coordinates"""
+        if len(landmarks) == 0:
+            self._tracked = None
+            return
+        xy = landmarks[:, :, :2].reshape(-1, 2)
+        x0, y0 = xy.min(axis=0).tolist()
+        x1, y1 = xy.max(axis=0).tolist()
+        self._tracked = (x0, y0, x1, y1)
+
+    def reset(self):
+        self._tracked = None
+        self._since_full_frame = 0
+
+    def _next_region(self, width, height):
+        self._since_full_frame += 1
+        if not self.roi or self._tracked is None or self._since_full_frame >= self.refresh_every:
+            self._since_full_frame = 0
+            return self.FULL_FRAME
+
+        # Square crop in pixels, centered on the hands and grown by the margin
+        x0, y0, x1, y1 = self._tracked
+        size = max((x1 - x0) * width, (y1 - y0) * height) * (1 + 2 * self.margin)
+        # Never so small that a barely visible hand leaves no pixels to look at
+        size = max(size, min(width, height) * 0.2)
+        cx, cy = (x0 + x1) / 2 * width, (y0 + y1) / 2 * height
+        half_w = min(size, width) / 2
+        half_h = min(size, height) / 2
+        cx = min(max(cx, half_w), width - half_w)
+        cy = min(max(cy, half_h), height - half_h)
+        region = (
+            (cx - half_w) / width, (cy - half_h) / height,
+            (cx + half_w) / width, (cy + half_h) / height,
+        )
+        if region[2] - region[0] >= 1 and region[3] - region[1] >= 1:
+            return self.FULL_FRAME
+        return region
+
+    def _downscale(self, image):
+        height, width = image.shape[:2]
+        longest = max(width, height)
+        if not self.resolution or longest <= self.resolution:
+            return image
+        scale = self.resolution / longest
+        size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        return cv2.resize(image, size, interpolation=cv2.INTER_AREA)
@@ -0,0 +1,193 @@
+import threading
+import time
+
+import numpy as np
+
+from frame_analysis import FrameAnalysis
+from hand_roi import HandRoi
+from metrics import STAGE_SECONDS, FRAMES_DROPPED
+
+RUNNING_MODES = ('image', 'live_stream', 'process_pool')
+
+
+def create_recognizer(running_mode='image', result_callback=None,
+                      model_asset_path='gesture_recognizer.task', num_hands=2,
+                      min_hand_detection_confidence=0.5, min_hand_presence_confidence=0.5,
+                      min_tracking_confidence=0.5):
+    # MediaPipe takes about a second to import, only pay for it once a model is needed
+    from mediapipe.tasks import python
+    from mediapipe.tasks.python import vision
+
+    # The gesture recognizer also returns the hand landmarks, so a single
+    # inference per frame feeds every rule
+    base_options = python.BaseOptions(model_asset_path=model_asset_path)
+    modes = {'image': vision.RunningMode.IMAGE, 'live_stream': vision.RunningMode.LIVE_STREAM}
+    options = vision.GestureRecognizerOptions(base_options=base_options,
+                                              running_mode=modes[running_mode],
+                                              num_hands=num_hands,
+                                              min_hand_detection_confidence=min_hand_detection_confidence,
+                                              min_hand_presence_confidence=min_hand_presence_confidence,
+                                              min_tracking_confidence=min_tracking_confidence,
+                                              result_callback=result_callback)
+    return vision.GestureRecognizer.create_from_options(options)
+
+
+def to_mp_image(image_rgb):
+    import mediapipe
+    return mediapipe.Image(image_format=mediapipe.ImageFormat.SRGB, data=image_rgb)
+
+
+def warm_up_recognizer(recognizer, size=64):
+    """Run one IMAGE mode inference on a blank frame, so the first real frame is not slowed by setup"""
+    recognizer.recognize(to_mp_image(np.zeros((size, size, 3), dtype=np.uint8)))
+
+
+class SyncInference:
+    """
+    Runs the recognizer in IMAGE mode: submit() blocks until the frame is
+    analysed and calls `on_result` on the caller's thread. It always returns
+    True, no frame is dropped.
+
+    `lock` serializes the calls when several threads share the recognizer.
+    """
+
+    def __init__(self, recognizer, on_result, owns_recognizer=False, lock=None):
+        self.recognizer = recognizer
+        self.on_result = on_result
+        self.owns_recognizer = owns_recognizer
+        self.lock = lock
+
+    def submit(self, image_rgb, region=HandRoi.FULL_FRAME):
+        start = time.perf_counter()
+        if self.lock is not None:
+            with self.lock:
+                recognition_result = self.recognizer.recognize(to_mp_image(image_rgb))
+        else:
+            recognition_result = self.recognizer.recognize(to_mp_image(image_rgb))
+        analysis_start = time.perf_counter()
+        STAGE_SECONDS.observe(analysis_start - start, stage='inference')
+        frame = FrameAnalysis.from_recognition(recognition_result, region)
+        STAGE_SECONDS.observe(time.perf_counter() - analysis_start, stage='analysis')
+        self.on_result(frame)
+        return True
+
+    def close(self):
+        if self.owns_recognizer:
+            self.recognizer.close()
+
+
+class LiveStreamInference:
+    """
+    Runs the recognizer in LIVE_STREAM mode: submit() returns straight away
+    and `on_result` is called from MediaPipe's thread once the frame has been
+    analysed, so the camera loop can capture the next frame meanwhile.
+
+    Frames submitted while the recognizer is still busy are skipped by
+    MediaPipe and never produce a result. submit() returns False for a frame
+    submitted while an earlier one has no result yet, as it is likely to
+    be skipped.
+    """
+
+    def __init__(self, on_result, **recognizer_options):
+        self.on_result = on_result
+        self._lock = threading.Lock()
+        self._regions = {}      # timestamp -> (region, submit time) of the frames in flight
+        self._last_timestamp = -1
+        self.recognizer = create_recognizer('live_stream',
+                                            result_callback=self._handle_result,
+                                            **recognizer_options)
+
+    def submit(self, image_rgb, region=HandRoi.FULL_FRAME):
+        with self._lock:
+            # Timestamps have to be monotonically increasing milliseconds
+            timestamp = max(int(time.monotonic() * 1000), self._last_timestamp + 1)
+            self._last_timestamp = timestamp
+            idle = not self._regions
+            self._regions[timestamp] = (region, time.perf_counter())
+        self.recognizer.recognize_async(to_mp_image(image_rgb), timestamp)
+        return idle
+
+    def close(self):
+        self.recognizer.close()
+
+    def _handle_result(self, recognition_result, output_image, timestamp_ms):
+        analysis_start = time.perf_counter()
+        with self._lock:
+            region, submitted = self._regions.pop(timestamp_ms, (HandRoi.FULL_FRAME, None))
+            # Frames skipped by MediaPipe never come back, forget them
+            for timestamp in [t for t in self._regions if t < timestamp_ms]:
+                del self._regions[timestamp]
+        if submitted is not None:
+            # Includes the time the frame waited for the recognizer
+            STAGE_SECONDS.observe(analysis_start - submitted, stage='inference')
+        frame = FrameAnalysis.from_recognition(recognition_result, region)
+        STAGE_SECONDS.observe(time.perf_counter() - analysis_start, stage='analysis')
+        self.on_result(frame)
+
+
+class ProcessPoolInference:
+    """
+    Runs the frames of one camera loop on a shared InferencePool: submit()
+    returns straight away and `on_result` is called from a thread of the pool.
+
+    One frame is in flight at a time, so results come back in order; frames
+    submitted meanwhile, or while the pool is full, are dropped and submit()
+    returns False for them.
+    """
+
+    def __init__(self, pool, on_result):
+        self.pool = pool
+        self.on_result = on_result
+        self._lock = threading.Lock()
+        self._busy = False
+
+    def submit(self, image_rgb, region=HandRoi.FULL_FRAME):
+        with self._lock:
+            if self._busy:
+                FRAMES_DROPPED.inc()
+                return False
+            self._busy = True
+        submitted = time.perf_counter()
+        if not self.pool.submit(image_rgb, lambda compact: self._handle_result(compact, region, submitted)):
+            FRAMES_DROPPED.inc()
+            with self._lock:
+                self._busy = False
+            return False
+        return True
+
+    def close(self):
+        # The pool is shared by every session
+        pass
+
+    def _handle_result(self, compact, region, submitted):
+        try:
+            if compact is None:
+                return
+            analysis_start = time.perf_counter()
+            # Includes the time the frame waited for a worker
+            STAGE_SECONDS.observe(analysis_start - submitted, stage='inference')
+            frame = FrameAnalysis.from_compact(compact, region)
+            STAGE_SECONDS.observe(time.perf_counter() - analysis_start, stage='analysis')
+            self.on_result(frame)
+        finally:
+            with self._lock:
+                self._busy = False
+
+
+def create_inference(running_mode, on_result, recognizer=None, lock=None, pool=None, **recognizer_options):
+    """
+    Build the inference pipeline for `running_mode`. The synchronous one
+    reuses `recognizer` when given, behind `lock` if it is shared; the
+    process pool one runs on `pool`, an InferencePool.
+    """
+    if running_mode == 'image':
+        if recognizer is not None:
+            return SyncInference(recognizer, on_result, lock=lock)
+        return SyncInference(create_recognizer(**recognizer_options), on_result, owns_recognizer=True)
+    if running_mode == 'live_stream':
+        return LiveStreamInference(on_result, **recognizer_options)
+    if running_mode == 'process_pool':
+        if pool is None:
+            raise ValueError("The 'process_pool' running mode needs an InferencePool")
+        return ProcessPoolInference(pool, on_result)
+    raise ValueError(f"Unknown running mode '{running_mode}', expected one of {', '.join(RUNNING_MODES)}")
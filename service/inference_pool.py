@@ -0,0 +1,273 @@
+import itertools
+import logging
+import multiprocessing
+import threading
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from metrics import INFERENCE_WORKER_RESTARTS
+
+logger = logging.getLogger(__name__)
+
+# A 1080p RGB frame, what the camera gives when the inference resolution is 0
+DEFAULT_SLOT_BYTES = 1920 * 1080 * 3
+
+
+def _worker_main(conn, shm_name, slot_bytes, recognizer_options):
+    """
+    Worker process: runs the recognizer on the frames the pool writes into
+    its shared memory slots and answers with compact results.
+        request:  (job id, slot, shape), or None to exit
+        answer:   (job id, compact result or None, error or None)
+    """
+    # Imported here so that the pool does not pull MediaPipe into the server
+    from frame_analysis import compact_recognition
+    from inference import create_recognizer, to_mp_image, warm_up_recognizer
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        recognizer = create_recognizer(**recognizer_options)
+        warm_up_recognizer(recognizer)
+    except Exception as e:
+        conn.send(('failed', f'{type(e).__name__}: {e}', None))
+        shm.close()
+        return
+    conn.send(('ready', None, None))
+    try:
+        while True:
+            request = conn.recv()
+            if request is None:
+                break
+            job_id, slot, shape = request
+            image = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf, offset=slot * slot_bytes)
+            try:
+                recognition_result = recognizer.recognize(to_mp_image(image))
+                conn.send((job_id, compact_recognition(recognition_result), None))
+            except Exception as e:
+                conn.send((job_id, None, f'{type(e).__name__}: {e}'))
+            finally:
+                del image
+    except (EOFError, KeyboardInterrupt):
+        pass
+    finally:
+        recognizer.close()
+        shm.close()
+
+
+class _Worker:
+    """Parent side of one worker process and its shared memory slots"""
+
+    def __init__(self, index, slots, slot_bytes):
+        self.index = index
+        self.slot_bytes = slot_bytes
+        self.shm = shared_memory.SharedMemory(create=True, size=slots * slot_bytes)
+        self.free_slots = list(range(slots))
+        self.jobs = {}      # job id -> (slot, callback, submit time)
+        self.process = None
+        self.conn = None
+        self.ready = False
+        self.ready_at = None
+        self.error = None
+        self.restarts = 0
+        self.thread = None
+
+    def slot_view(self, slot, shape):
+        return np.ndarray(shape, dtype=np.uint8, buffer=self.shm.buf, offset=slot * self.slot_bytes)
+
+
+class InferencePool:
+    """
+    Gesture recognition in worker processes with a recognizer each, so
+    inference neither holds the server's GIL nor is limited to one core.
+
+    Frames travel through shared memory: each worker has `slots` slots of
+    `slot_bytes` in one SharedMemory block. submit() copies the frame into a
+    free slot and only sends (job, slot, shape) down a pipe; the worker
+    answers with compact_recognition's output, a few hundred bytes. The
+    callback gets it, or None if the frame failed, on a thread of the pool.
+
+    Backpressure: when every slot of every worker is taken submit() returns
+    False straight away and the caller drops the frame.
+
+    Crash recovery: a worker that dies, or takes over `job_timeout` seconds on
+    a frame, is (killed and) restarted on the same shared memory; its frames
+    fail. Restarts back off exponentially up to 30 s, so a worker that cannot
+    load its model does not spin.
+
+    Processes are spawned on the first submit() or start().
+    """
+
+    def __init__(self, processes=2, slots=2, slot_bytes=DEFAULT_SLOT_BYTES, job_timeout=5.0,
+                 **recognizer_options):
+        if processes < 1 or slots < 1:
+            raise ValueError('processes and slots must be at least 1')
+        self.processes = processes
+        self.slots = slots
+        self.slot_bytes = slot_bytes
+        self.job_timeout = job_timeout
+        self.recognizer_options = recognizer_options
+        # Forking a process that runs threads and MediaPipe is not safe
+        self._context = multiprocessing.get_context('spawn')
+        self._lock = threading.Lock()
+        self._job_ids = itertools.count()
+        self._workers = []
+        self._closed = False
+
+    def start(self):
+        with self._lock:
+            if self._workers or self._closed:
+                return
+            for index in range(self.processes):
+                worker = _Worker(index, self.slots, self.slot_bytes)
+                worker.thread = threading.Thread(target=self._supervise, args=(worker,),
+                                                 name=f'inference-pool-{index}', daemon=True)
+                self._workers.append(worker)
+                worker.thread.start()
+
+    def submit(self, image_rgb, callback):
+        """Run inference on `image_rgb` and call `callback(compact or None)`, False if the pool is full"""
+        if image_rgb.nbytes > self.slot_bytes:
+            raise ValueError(f'Frame of {image_rgb.nbytes} bytes does not fit the {self.slot_bytes} byte slots')
+        if not self._workers:
+            self.start()
+        with self._lock:
+            available = [worker for worker in self._workers if worker.conn is not None and worker.free_slots]
+            if self._closed or not available:
+                return False
+            # The least busy worker
+            worker = max(available, key=lambda worker: len(worker.free_slots))
+            slot = worker.free_slots.pop()
+            job_id = next(self._job_ids)
+            np.copyto(worker.slot_view(slot, image_rgb.shape), image_rgb)
+            worker.jobs[job_id] = (slot, callback, time.monotonic())
+            try:
+                worker.conn.send((job_id, slot, image_rgb.shape))
+            except (OSError, ValueError):
+                # The supervisor fails the job once it notices the worker is gone
+                pass
+            return True
+
+    def status(self):
+        with self._lock:
+            return {
+                'processes': self.processes,
+                'slots': self.slots,
+                'workers': [{
+                    'pid': worker.process.pid if worker.process else None,
+                    'ready': worker.ready,
+                    'in_flight': len(worker.jobs),
+                    'restarts': worker.restarts,
+                    'error': worker.error,
+                } for worker in self._workers],
+            }
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            workers = list(self._workers)
+        for worker in workers:
+            try:
+                worker.conn.send(None)
+            except (AttributeError, OSError, ValueError):
+                pass
+        for worker in workers:
+            worker.thread.join(timeout=5)
+            worker.shm.close()
+            worker.shm.unlink()
+
+    def _spawn(self, worker):
+        conn, child_conn = self._context.Pipe()
+        process = self._context.Process(
+            target=_worker_main,
+            args=(child_conn, worker.shm.name, self.slot_bytes, self.recognizer_options),
+            name=f'inference-worker-{worker.index}', daemon=True,
+        )
+        process.start()
+        # Only the child keeps its end, so the parent sees EOF when it dies
+        child_conn.close()
+        with self._lock:
+            worker.process = process
+            worker.conn = conn
+            worker.ready = False
+
+    def _supervise(self, worker):
+        """Runs a worker process, dispatches its results and restarts it when it dies"""
+        backoff = 0.5
+        while not self._closed:
+            self._spawn(worker)
+            started = time.monotonic()
+            self._serve(worker)
+            worker.process.join(timeout=1)
+            if worker.process.is_alive():
+                worker.process.kill()
+                worker.process.join()
+            self._fail_jobs(worker)
+            if self._closed:
+                break
+            worker.restarts += 1
+            INFERENCE_WORKER_RESTARTS.inc()
+            logger.warning('Inference worker %d exited with code %s, restarting',
+                           worker.index, worker.process.exitcode)
+            # Back off when workers keep dying quickly
+            backoff = 0.5 if time.monotonic() - started > 60 else min(backoff * 2, 30)
+            time.sleep(backoff)
+
+    def _serve(self, worker):
+        while True:
+            try:
+                if not worker.conn.poll(0.5):
+                    if self._overdue(worker):
+                        logger.warning('Inference worker %d is stuck, killing it', worker.index)
+                        worker.process.kill()
+                        return
+                    if self._closed and not worker.jobs:
+                        return
+                    continue
+                job_id, result, error = worker.conn.recv()
+            except (EOFError, OSError):
+                return
+            if job_id == 'ready':
+                worker.ready_at = time.monotonic()
+                worker.ready = True
+                worker.error = None
+                continue
+            if job_id == 'failed':
+                worker.error = result
+                logger.error('Inference worker %d could not start: %s', worker.index, result)
+                return
+            with self._lock:
+                slot, callback, _ = worker.jobs.pop(job_id)
+                worker.free_slots.append(slot)
+            if error is not None:
+                logger.warning('Inference failed in worker %d: %s', worker.index, error)
+            self._call(callback, result)
+
+    def _overdue(self, worker):
+        if not worker.ready:
+            return False
+        now = time.monotonic()
+        with self._lock:
+            # Frames sent while the worker was loading its model waited for it
+            return any(now - max(submitted, worker.ready_at) > self.job_timeout
+                       for _, _, submitted in worker.jobs.values())
+
+    def _fail_jobs(self, worker):
+        with self._lock:
+            jobs = list(worker.jobs.values())
+            worker.jobs.clear()
+            worker.free_slots = list(range(self.slots))
+            worker.conn.close()
+            worker.conn = None
+            worker.ready = False
+        for _, callback, _ in jobs:
+            self._call(callback, None)
+
+    def _call(self, callback, result):
+        try:
+            callback(result)
+        except Exception:
+            logger.exception('Inference result callback failed')
@@ -0,0 +1,227 @@
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+from frame_analysis import FrameAnalysis
+from gesture_pipeline import GesturePipeline
+from gesture_recognizer import NUM_LANDMARKS
+from trajectory import TrajectoryTracker
+
+MAGIC = b'LANDMARKS'
+FORMAT_VERSION = 1
+HEADER_BYTES = 4096
+EXTENSION = '.landmarks'
+# Hands kept per frame, as many as the recognizer looks for by default
+MAX_HANDS = 2
+# Categories of the canned gesture model; a recording lists the ones it uses
+# in its header and stores their index + 1, 0 for a hand without category
+GESTURES = ('None', 'Closed_Fist', 'Open_Palm', 'Pointing_Up', 'Thumb_Down', 'Thumb_Up', 'Victory', 'ILoveYou')
+HANDEDNESS = ('Left', 'Right')
+
+# One frame, 533 bytes. Landmarks are in full-frame coordinates, as the rules see them.
+RECORD = np.dtype([
+    ('time', '<f8'),
+    ('hands', 'u1'),
+    ('gesture', 'u1', (MAX_HANDS,)),
+    ('handedness', 'u1', (MAX_HANDS,)),
+    ('gesture_score', '<f4', (MAX_HANDS,)),
+    ('handedness_score', '<f4', (MAX_HANDS,)),
+    ('landmarks', '<f4', (MAX_HANDS, NUM_LANDMARKS, 3)),
+])
+
+
+class LandmarkRecorder:
+    """
+    Writes what the recognizer saw in every frame to a recording: a header of
+    HEADER_BYTES with JSON metadata, then one RECORD per frame, so that
+    LandmarkRecording can memory-map the frames as a record array.
+
+    Records are written `buffer_frames` at a time; a recording cut short by a
+    crash loses at most that many. write() and close() may be called from
+    different threads, frames written after close() are ignored.
+    """
+
+    def __init__(self, path, metadata=None, buffer_frames=64):
+        self.path = path
+        self.metadata = {
+            'version': FORMAT_VERSION,
+            'created': time.time(),
+            **(metadata or {}),
+            'gestures': list(GESTURES),
+            'handedness': list(HANDEDNESS),
+        }
+        self._codes = {kind: {label: code for code, label in enumerate(self.metadata[kind], 1)}
+                       for kind in ('gestures', 'handedness')}
+        self._buffer = np.zeros(buffer_frames, RECORD)
+        self._buffered = 0
+        self._lock = threading.Lock()
+        self.frames = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._file = open(path, 'wb')
+        self._write_header()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def write(self, frame: FrameAnalysis, timestamp):
+        """Append a frame seen at `timestamp` seconds"""
+        with self._lock:
+            if self._file is None:
+                return
+            buffer, index = self._buffer, self._buffered
+            hands = min(frame.hand_count, MAX_HANDS)
+            buffer['time'][index] = timestamp
+            buffer['hands'][index] = hands
+            buffer['landmarks'][index, :hands] = frame.landmarks[:hands]
+            for hand in range(hands):
+                buffer['gesture'][index, hand] = self._code('gestures', frame.gesture_categories, hand)
+                buffer['handedness'][index, hand] = self._code('handedness', frame.handedness, hand)
+                buffer['gesture_score'][index, hand] = _score(frame.gesture_scores, hand)
+                buffer['handedness_score'][index, hand] = _score(frame.handedness_scores, hand)
+            self._buffered += 1
+            self.frames += 1
+            if self._buffered == len(buffer):
+                self._flush()
+
+    def close(self):
+        with self._lock:
+            if self._file is None:
+                return
+            self._flush()
+            self._file.close()
+            self._file = None
+
+    def _code(self, kind, labels, hand):
+        label = labels[hand] if hand < len(labels) else None
+        if label is None:
+            return 0
+        codes = self._codes[kind]
+        code = codes.get(label)
+        if code is None:
+            if len(codes) == 255:
+                raise ValueError(f'A recording holds at most 255 {kind}')
+            # A category the header does not list yet, e.g. of a custom model
+            code = codes[label] = len(codes) + 1
+            self.metadata[kind].append(label)
+            self._write_header()
+        return code
+
+    def _write_header(self):
+        header = MAGIC + b' ' + json.dumps(self.metadata).encode()
+        if len(header) >= HEADER_BYTES:
+            raise ValueError(f'Recording metadata is over {HEADER_BYTES} bytes')
+        position = self._file.tell()
+        self._file.seek(0)
+        self._file.write(header.ljust(HEADER_BYTES - 1) + b'\n')
+        self._file.seek(max(position, HEADER_BYTES))
+
+    def _flush(self):
+        self._file.write(self._buffer[:self._buffered].tobytes())
+        self._file.flush()
+        self._buffer[:self._buffered] = 0
+        self._buffered = 0
+
+
+def _score(scores, hand):
+    # NaN for a hand the model gave no score
+    score = scores[hand] if hand < len(scores) else None
+    return np.nan if score is None else score
+
+
+class LandmarkRecording:
+    """
+    A recording memory-mapped: `records` is the RECORD array of its frames,
+    `metadata` what its recorder was given.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as file:
+            header = file.read(HEADER_BYTES)
+        if len(header) < HEADER_BYTES or not header.startswith(MAGIC + b' '):
+            raise ValueError(f'{path} is not a landmark recording')
+        self.metadata = json.loads(header[len(MAGIC) + 1:])
+        if self.metadata.get('version') != FORMAT_VERSION:
+            raise ValueError(f"{path}: unsupported recording version {self.metadata.get('version')}")
+        # A recording cut short can end with part of a record
+        count = (os.path.getsize(path) - HEADER_BYTES) // RECORD.itemsize
+        self.records = (np.memmap(path, RECORD, mode='r', offset=HEADER_BYTES, shape=(count,)) if count
+                        else np.zeros(0, RECORD))
+
+    def __len__(self):
+        return len(self.records)
+
+    @property
+    def duration(self):
+        if not len(self.records):
+            return 0.0
+        return float(self.records['time'][-1] - self.records['time'][0])
+
+    def frames(self):
+        """(time, FrameAnalysis) of every frame, in order"""
+        records = self.records
+        gestures = [None, *self.metadata['gestures']]
+        handedness = [None, *self.metadata['handedness']]
+        # Converted once for the whole recording, plain lists are faster to index per frame
+        times = records['time'].tolist()
+        hand_counts = records['hands'].tolist()
+        gesture_codes = records['gesture'].tolist()
+        handedness_codes = records['handedness'].tolist()
+        gesture_scores = records['gesture_score'].tolist()
+        handedness_scores = records['handedness_score'].tolist()
+        landmarks = np.asarray(records['landmarks'])
+        for index, hands in enumerate(hand_counts):
+            yield times[index], FrameAnalysis(
+                landmarks=landmarks[index, :hands],
+                gesture_categories=[gestures[code] for code in gesture_codes[index][:hands]],
+                handedness=[handedness[code] for code in handedness_codes[index][:hands]],
+                gesture_scores=gesture_scores[index][:hands],
+                handedness_scores=handedness_scores[index][:hands],
+            )
+
+
+def recording_paths(paths):
+    """The recordings among `paths`, those in directories included, sorted"""
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            found.extend(os.path.join(path, name) for name in sorted(os.listdir(path)) if name.endswith(EXTENSION))
+        else:
+            found.append(path)
+    return found
+
+
+def replay(recording, rules=None, smoothing=None, trajectory=None):
+    """
+    Feed a recording to a GesturePipeline and to a TrajectoryTracker, as the
+    camera loop would but without running a model, at the recorded times.
+    `rules` is a RuleEngine and `smoothing` a GestureSmoothing, see
+    GesturePipeline; `trajectory` a TrajectoryTracker, to tune its
+    sensitivity.
+
+    Returns the events, {"frame", "time", "pointing", "command"} as
+    benchmarks.replay reports them, and the hand motions, {"frame", "time",
+    "motion"} of every swipe and flick, whether a rule uses it or not.
+    """
+    events = []
+    motions = []
+    index = 0
+    timestamp = 0.0
+
+    def record(is_pointing, command):
+        events.append({'frame': index, 'time': round(timestamp, 3), 'pointing': is_pointing, 'command': command})
+
+    pipeline = GesturePipeline(record, rules=rules, smoothing=smoothing)
+    trajectory = trajectory if trajectory is not None else TrajectoryTracker()
+    for index, (timestamp, frame) in enumerate(recording.frames()):
+        pipeline.process(frame, now=timestamp)
+        motion = trajectory.update(frame.hand_center, timestamp)
+        if motion is not None:
+            motions.append({'frame': index, 'time': round(timestamp, 3), 'motion': motion})
+    return events, motions
@@ -0,0 +1,86 @@
+import collections
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+ASYNC_MODES = ('threading', 'gevent')
+
+
+def _outcome(function, args):
+    # gevent's thread pool prints the exceptions raised in it, the caller handles them
+    try:
+        return function(*args), None
+    except Exception as e:
+        return None, e
+
+
+class EventLoopBridge:
+    """
+    Hands calls from the camera, inference and notifier threads over to the
+    server's event loop.
+
+    In 'threading' mode call() runs the function straight away on the
+    calling thread. In 'gevent' mode Socket.IO objects belong to the hub of
+    the thread serving requests and must only be used from it: call() queues
+    the function and wakes the hub through an async watcher, the one gevent
+    primitive that is safe to signal from another thread, and a greenlet
+    runs the queued calls. The workers never block on the server and the
+    server never blocks on the workers.
+
+    The other way round, blocking() waits for a worker from a request
+    handler: on the hub thread it waits on gevent's thread pool, so the
+    other greenlets keep running.
+    """
+
+    def __init__(self, async_mode='threading'):
+        if async_mode not in ASYNC_MODES:
+            raise ValueError(f"Unknown async mode '{async_mode}', expected one of {', '.join(ASYNC_MODES)}")
+        self.async_mode = async_mode
+        self._calls = collections.deque()
+        self._watcher = None
+        self._wake = None
+        self._hub_thread = None
+
+    def start(self):
+        """Attach to the event loop of the calling thread, the one that will serve requests"""
+        if self.async_mode != 'gevent' or self._watcher is not None:
+            return
+        import gevent
+        import gevent.event
+
+        self._hub_thread = threading.get_ident()
+        self._wake = gevent.event.Event()
+        self._watcher = gevent.get_hub().loop.async_()
+        # Runs in the hub, where it may not switch greenlets: only flag the drain greenlet
+        self._watcher.start(self._wake.set)
+        gevent.spawn(self._drain)
+
+    def call(self, function, *args, **kwargs):
+        if self._watcher is None or threading.get_ident() == self._hub_thread:
+            function(*args, **kwargs)
+            return
+        self._calls.append((function, args, kwargs))
+        self._watcher.send()
+
+    def blocking(self, function, *args):
+        """Result of `function(*args)`, a call that blocks the calling thread"""
+        if self._watcher is None or threading.get_ident() != self._hub_thread:
+            return function(*args)
+        import gevent
+
+        result, error = gevent.get_hub().threadpool.apply(_outcome, (function, args))
+        if error is not None:
+            raise error
+        return result
+
+    def _drain(self):
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            while self._calls:
+                function, args, kwargs = self._calls.popleft()
+                try:
+                    function(*args, **kwargs)
+                except Exception:
+                    logger.exception('Call handed to the event loop failed')
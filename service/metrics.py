@@ -0,0 +1,193 @@
+import bisect
+import threading
+
+# Upper bounds in seconds, from sub-millisecond rule evaluation to slow inference
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labelnames, labelvalues, extra=()):
+    pairs = list(zip(labelnames, labelvalues)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(labels.get(name, '') for name in self.labelnames), 0)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self._lock:
+            values = sorted(self._values.items())
+        if not values and not self.labelnames:
+            values = [((), 0)]
+        for key, value in values:
+            lines.append(f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [count per bucket (last one is +Inf), sum]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = sorted((key, (list(counts), total)) for key, (counts, total) in self._series.items())
+        for key, (counts, total) in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, [('le', _format_value(bound))])
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f'{self.name}_sum{labels} {_format_value(total)}')
+            lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+class MetricsRegistry:
+    """Collects metrics and renders them in the Prometheus text exposition format"""
+
+    CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, documentation, labelnames=()):
+        metric = Counter(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+# Camera loop
+STAGE_SECONDS = REGISTRY.histogram(
+    'gesture_stage_seconds',
+    'Time spent per frame in each stage of the camera loop',
+    ['stage'],
+)
+FRAMES = REGISTRY.counter('gesture_frames_total', 'Frames processed by the camera loop')
+FRAMES_DROPPED = REGISTRY.counter('gesture_frames_dropped_total', 'Captured frames skipped because inference was busy')
+COMMANDS = REGISTRY.counter('gesture_commands_total', 'Commands emitted, per command', ['command'])
+UPLOAD_BATCH_SIZE = REGISTRY.histogram(
+    'gesture_upload_batch_size',
+    'Uploaded frames, from as many sessions, processed per worker tick',
+    buckets=(1, 2, 4, 8, 16, 32),
+)
+INFERENCE_WORKER_RESTARTS = REGISTRY.counter(
+    'gesture_inference_worker_restarts_total',
+    'Inference worker processes restarted after dying or getting stuck',
+)
+MOTION_GATE_FRAMES = REGISTRY.counter(
+    'gesture_motion_gate_frames_total',
+    'Camera frames by motion gate result: skipped reuses the last analysis, moved and forced run inference',
+    ['result'],
+)
+POINTING_TRANSITIONS = REGISTRY.counter(
+    'gesture_pointing_transitions_total',
+    'Changes of the pointed command, per new value',
+    ['pointing'],
+)
+
+# Notifications
+NOTIFICATION_EVENTS = REGISTRY.counter(
+    'gesture_notification_events_total',
+    'Commands and pointing changes handed to the notifier, before coalescing',
+)
+NOTIFICATION_MESSAGES = REGISTRY.counter(
+    'gesture_notification_messages_total',
+    'Socket.IO messages sent to clients, per protocol encoding',
+    ['encoding'],
+)
+NOTIFICATION_BYTES = REGISTRY.counter(
+    'gesture_notification_bytes_total',
+    'Payload bytes sent to clients, per protocol encoding',
+    ['encoding'],
+)
+
+# Study sets
+STUDYSET_REQUESTS = REGISTRY.counter(
+    'studyset_requests_total',
+    'Compiled study sets served, per cache level that had them (memory, disk or miss)',
+    ['cache'],
+)
+STUDYSET_COMPILE_SECONDS = REGISTRY.histogram(
+    'studyset_compile_seconds',
+    'Time to stream, hash and compile an uploaded study set',
+)
+
+# PDF pages
+PAGE_REQUESTS = REGISTRY.counter(
+    'pdf_page_requests_total',
+    'Rendered PDF pages served, per where they came from (memory, disk, in_flight or render)',
+    ['cache'],
+)
+PAGE_RENDER_SECONDS = REGISTRY.histogram(
+    'pdf_page_render_seconds',
+    'Time a render worker took to render and encode a page',
+)
+PAGE_PREFETCHES = REGISTRY.counter('pdf_page_prefetches_total', 'Pages queued for rendering ahead of a reveal')
+
+# Review log
+REVIEWS = REGISTRY.counter('reviews_total', 'Reviews committed to the review log')
+REVIEW_BATCH_SIZE = REGISTRY.histogram(
+    'review_batch_size',
+    'Reviews committed per transaction',
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512),
+)
+REVIEW_COMMIT_SECONDS = REGISTRY.histogram(
+    'review_commit_seconds',
+    'Time to write and commit one transaction of reviews',
+)
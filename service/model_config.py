@@ -0,0 +1,84 @@
+import json
+import logging
+
+from hand_roi import HandRoi
+
+logger = logging.getLogger(__name__)
+
+
+class ModelConfig:
+    """
+    How the service runs the gesture model: the model asset and options of
+    create_recognizer, and the inference resolution sessions start with.
+
+    `python -m benchmarks.model_tuning` picks one for the machine it runs on
+    and writes it out, load() reads it back at startup. The tracking
+    confidence only matters in the 'live_stream' running mode, IMAGE mode
+    detects the hands in every frame.
+    """
+
+    DEFAULTS = {
+        'model': 'gesture_recognizer.task',
+        'num_hands': 2,
+        'min_detection_confidence': 0.5,
+        'min_presence_confidence': 0.5,
+        'min_tracking_confidence': 0.5,
+        'resolution': HandRoi.DEFAULTS['resolution'],
+    }
+
+    def __init__(self, model='gesture_recognizer.task', num_hands=2, min_detection_confidence=0.5,
+                 min_presence_confidence=0.5, min_tracking_confidence=0.5, resolution=320):
+        if not isinstance(model, str) or not model:
+            raise ValueError('model must be the path of a .task file')
+        num_hands = int(num_hands)
+        if num_hands < 1:
+            raise ValueError('num_hands must be at least 1')
+        confidences = [float(min_detection_confidence), float(min_presence_confidence),
+                       float(min_tracking_confidence)]
+        if not all(0 <= confidence <= 1 for confidence in confidences):
+            raise ValueError('confidences must be between 0 and 1')
+        resolution = int(resolution or 0)
+        if resolution < 0:
+            raise ValueError('resolution must not be negative (0 keeps the camera resolution)')
+
+        self.model = model
+        self.num_hands = num_hands
+        self.min_detection_confidence, self.min_presence_confidence, self.min_tracking_confidence = confidences
+        self.resolution = resolution
+
+    @classmethod
+    def from_config(cls, config):
+        config = config or {}
+        unknown = set(config) - set(cls.DEFAULTS)
+        if unknown:
+            raise ValueError(f"Unknown model settings: {', '.join(sorted(unknown))}")
+        return cls(**{**cls.DEFAULTS, **config})
+
+    def to_config(self):
+        return {name: getattr(self, name) for name in self.DEFAULTS}
+
+    @classmethod
+    def load(cls, path):
+        """The configuration selected in a tuning file, the defaults when there is none"""
+        try:
+            with open(path) as file:
+                return cls.from_config(json.load(file)['selected'])
+        except FileNotFoundError:
+            return cls()
+        except (OSError, ValueError, TypeError, KeyError) as e:
+            logger.warning('Could not read the model configuration %s, using the defaults: %s', path, e)
+            return cls()
+
+    def recognizer_options(self):
+        """Keyword arguments of create_recognizer"""
+        return {
+            'model_asset_path': self.model,
+            'num_hands': self.num_hands,
+            'min_hand_detection_confidence': self.min_detection_confidence,
+            'min_hand_presence_confidence': self.min_presence_confidence,
+            'min_tracking_confidence': self.min_tracking_confidence,
+        }
+
+    def inference_config(self):
+        """The settings of HandRoi.from_config it changes"""
+        return {'resolution': self.resolution}
@@ -0,0 +1,106 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+MODEL_STATES = ('unloaded', 'loading', 'ready', 'error')
+
+
+class _Model:
+    def __init__(self, factory, warm=None):
+        self.factory = factory
+        self.warm = warm
+        self.lock = threading.Lock()
+        self.model = None
+        self.state = 'unloaded'
+        self.error = None
+        self.load_seconds = None
+
+    def load(self):
+        with self.lock:
+            # Another thread may have loaded it while we waited for the lock
+            if self.model is not None:
+                return self.model
+            self.state = 'loading'
+            self.error = None
+            start = time.perf_counter()
+            try:
+                model = self.factory()
+                if self.warm is not None:
+                    self.warm(model)
+            except Exception as e:
+                self.state = 'error'
+                self.error = f'{type(e).__name__}: {e}'
+                raise
+            self.load_seconds = time.perf_counter() - start
+            self.model = model
+            self.state = 'ready'
+            return model
+
+
+class ModelRegistry:
+    """
+    Models created on first use rather than at import time, so the service
+    binds its port without waiting for them.
+
+    Each model is registered with a factory and optionally a `warm` function
+    run once on the new model (e.g. an inference on a blank frame). get()
+    loads a model on the calling thread, or waits for the load already in
+    progress; warm_up() loads them all on a background thread. A model whose
+    load failed is retried on the next get().
+    """
+
+    def __init__(self):
+        self._models = {}
+        self._warm_up_thread = None
+        self._lock = threading.Lock()
+
+    def register(self, name, factory, warm=None):
+        self._models[name] = _Model(factory, warm)
+
+    def get(self, name):
+        entry = self._models[name]
+        if entry.model is not None:
+            return entry.model
+        return entry.load()
+
+    def warm_up(self, names=None):
+        """Load `names` (all models by default) on a background thread, returns the thread"""
+        with self._lock:
+            if self._warm_up_thread is None or not self._warm_up_thread.is_alive():
+                self._warm_up_thread = threading.Thread(
+                    target=self._warm_up, args=(list(names or self._models),), daemon=True)
+                self._warm_up_thread.start()
+            return self._warm_up_thread
+
+    def _warm_up(self, names):
+        for name in names:
+            try:
+                self.get(name)
+                logger.info('Model %s ready in %.2f s', name, self._models[name].load_seconds)
+            except Exception:
+                logger.exception('Could not load model %s', name)
+
+    @property
+    def ready(self):
+        return all(entry.state == 'ready' for entry in self._models.values())
+
+    def status(self):
+        return {
+            name: {
+                'state': entry.state,
+                'load_seconds': round(entry.load_seconds, 3) if entry.load_seconds is not None else None,
+                'error': entry.error,
+            }
+            for name, entry in self._models.items()
+        }
+
+    def close(self):
+        for entry in self._models.values():
+            with entry.lock:
+                if entry.model is not None and hasattr(entry.model, 'close'):
+                    entry.model.close()
+                entry.model = None
+                entry.state = 'unloaded'
+                entry.load_seconds = None
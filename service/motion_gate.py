@@ -0,0 +1,118 @@
+import cv2
+import numpy as np
+
+
+class MotionGate:
+    """
+    Tells the camera loop whether a frame is worth running inference on.
+
+    While a student reads a page the camera sees the same scene frame after
+    frame; the loop can then reuse the last FrameAnalysis instead of
+    detecting the hands again. A frame is compared, downscaled to `size`
+    pixels wide and in grayscale, with the last frame that went to
+    inference: it has moved when more than `min_changed` of its pixels
+    differ from it by more than `pixel_threshold` gray levels. Comparing
+    with the last inferred frame rather than the previous one lets slow
+    changes add up until they pass the threshold, and inference runs every
+    `force_every` frames anyway. A frame only becomes the reference once
+    inference accepted it, see commit(): a frame the backend dropped must
+    not hide the changes it saw.
+
+    The scene is checked before the hand crop, a pointing finger moves
+    enough pixels at the default size to be seen.
+    """
+
+    DEFAULTS = {
+        'enabled': True,
+        'size': 64,
+        'pixel_threshold': 12,
+        'min_changed': 0.001,
+        'force_every': 10,
+    }
+    # check() results
+    MOVED, FORCED, STATIC = 'moved', 'forced', 'static'
+
+    def __init__(self, enabled=True, size=64, pixel_threshold=12, min_changed=0.001, force_every=10):
+        size = int(size)
+        pixel_threshold = int(pixel_threshold)
+        min_changed = float(min_changed)
+        force_every = int(force_every)
+        if size < 8:
+            raise ValueError('size must be at least 8')
+        if not 0 <= pixel_threshold < 255:
+            raise ValueError('pixel_threshold must be between 0 and 254')
+        if not 0 <= min_changed < 1:
+            raise ValueError('min_changed must be between 0 and 1')
+        if force_every < 1:
+            raise ValueError('force_every must be at least 1')
+
+        self.enabled = bool(enabled)
+        self.size = size
+        self.pixel_threshold = pixel_threshold
+        self.min_changed = min_changed
+        self.force_every = force_every
+        self._reference = None      # small grayscale copy of the last inferred frame
+        self._candidate = None      # the same of the last frame check() sent to inference
+        self._since_inference = 0
+        self.frames = 0
+        self.skipped = 0
+
+    @classmethod
+    def from_config(cls, config):
+        """Build from a dict such as the `motion_gate` field of /enable-camera"""
+        config = config or {}
+        unknown = set(config) - set(cls.DEFAULTS)
+        if unknown:
+            raise ValueError(f"Unknown motion gate settings: {', '.join(sorted(unknown))}")
+        return cls(**{**cls.DEFAULTS, **config})
+
+    def to_config(self):
+        return {name: getattr(self, name) for name in self.DEFAULTS}
+
+    @property
+    def hit_rate(self):
+        """Share of the frames checked so far that skipped inference"""
+        return self.skipped / self.frames if self.frames else 0.0
+
+    def check(self, image, reusable=True):
+        """
+        MOVED or FORCED if `image`, a BGR camera frame, goes to inference,
+        STATIC if the last result still holds. Never STATIC when there is no
+        result to reuse (`reusable`). Call commit() once inference accepted
+        a MOVED or FORCED frame.
+        """
+        self.frames += 1
+        height, width = image.shape[:2]
+        small = cv2.resize(image, (self.size, max(1, round(height * self.size / width))),
+                           interpolation=cv2.INTER_AREA)
+        small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        reference = self._reference
+        if reusable and reference is not None and reference.shape == small.shape:
+            if self._since_inference + 1 >= self.force_every:
+                result = self.FORCED
+            else:
+                changed = np.count_nonzero(cv2.absdiff(small, reference) > self.pixel_threshold)
+                result = self.MOVED if changed > self.min_changed * small.size else self.STATIC
+        else:
+            result = self.MOVED
+        if result == self.STATIC:
+            self._since_inference += 1
+            self.skipped += 1
+            self._candidate = None
+        else:
+            self._candidate = small
+        return result
+
+    def commit(self):
+        """Make the last frame check() sent to inference the new reference"""
+        if self._candidate is not None:
+            self._reference, self._candidate = self._candidate, None
+            self._since_inference = 0
+
+    def reset(self):
+        """Forget the reference, e.g. when the camera loop restarts"""
+        self._reference = None
+        self._candidate = None
+        self._since_inference = 0
+        self.frames = 0
+        self.skipped = 0
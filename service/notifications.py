@@ -0,0 +1,198 @@
+import json
+import logging
+import struct
+import threading
+import time
+
+from metrics import NOTIFICATION_EVENTS
+
+logger = logging.getLogger(__name__)
+
+# Version 1 is one {"isPointing", "command"} 'notification' event per event.
+# Version 2 is one 'notifications' message per coalescing window and room:
+#     {"v": 2, "seq": 17, "commands": ["show"], "pointing": "ok"}
+# `seq` counts the messages of the room, so a client can spot a gap.
+# `pointing` is only there when it changed since the previous message
+# (null once the user stops pointing). `commands` are in the order they were
+# recognized.
+PROTOCOL_VERSION = 2
+ENCODINGS = ('json', 'binary')
+
+# Binary encoding of a version 2 message, little endian:
+#     u8 version, u32 seq, u8 flags (bit 0: pointing present),
+#     [code of pointing], u8 number of commands, code of each command
+# A code is a u8: 0 for null, i + 1 for the i-th entry of the code table the
+# client got in the 'protocol' event, or INLINE_CODE followed by a u8 length
+# and the UTF-8 bytes of a string missing from the table.
+INLINE_CODE = 255
+_HEADER = struct.Struct('<BIB')
+
+
+def protocol_room(session_id, protocol=1, encoding='json'):
+    """Socket.IO room of the clients of a session that speak `protocol` in `encoding`"""
+    if protocol == 1:
+        return session_id
+    return f'{session_id}/v{protocol}/{encoding}'
+
+
+def legacy_events(message):
+    """The version 1 'notification' events of a version 2 message"""
+    events = [{'isPointing': False, 'command': command} for command in message['commands']]
+    if 'pointing' in message:
+        events.append({'isPointing': True, 'command': message['pointing']})
+    return events
+
+
+def json_size(message):
+    return len(json.dumps(message, separators=(',', ':')))
+
+
+class BinaryCodec:
+    """Encodes version 2 messages with a table of the known command names"""
+
+    def __init__(self, names):
+        self.names = list(dict.fromkeys(names))[:INLINE_CODE - 1]
+        self._codes = {name: index + 1 for index, name in enumerate(self.names)}
+
+    def _code(self, name):
+        if name is None:
+            return b'\x00'
+        code = self._codes.get(name)
+        if code is not None:
+            return bytes((code,))
+        raw = name.encode('utf-8')[:255]
+        return bytes((INLINE_CODE, len(raw))) + raw
+
+    def encode(self, message):
+        parts = [_HEADER.pack(message['v'], message['seq'] & 0xFFFFFFFF, 1 if 'pointing' in message else 0)]
+        if 'pointing' in message:
+            parts.append(self._code(message['pointing']))
+        commands = message['commands'][:255]
+        parts.append(bytes((len(commands),)))
+        parts.extend(self._code(command) for command in commands)
+        return b''.join(parts)
+
+    def decode(self, data):
+        version, seq, flags = _HEADER.unpack_from(data)
+        offset = _HEADER.size
+
+        def read_code():
+            nonlocal offset
+            code = data[offset]
+            offset += 1
+            if code == 0:
+                return None
+            if code == INLINE_CODE:
+                length = data[offset]
+                name = data[offset + 1:offset + 1 + length].decode('utf-8')
+                offset += 1 + length
+                return name
+            return self.names[code - 1]
+
+        message = {'v': version, 'seq': seq}
+        if flags & 1:
+            message['pointing'] = read_code()
+        count = data[offset]
+        offset += 1
+        message['commands'] = [read_code() for _ in range(count)]
+        return message
+
+
+class _Room:
+    def __init__(self):
+        self.seq = 0
+        self.commands = []
+        self.pointing = None
+        self.pointing_changed = False
+        self.sent_pointing = None
+        self.deadline = None
+
+
+class NotificationCoalescer:
+    """
+    Merges the events of a room that come within `window` seconds of the
+    first one into a single version 2 message, then calls
+    `emit(room, message)` from a flusher thread.
+
+    Pointing is delta encoded: only its last value in the window is sent,
+    and only if it differs from the last one sent, so a flicker that ends
+    where it started sends nothing. With a window of 0 every event is
+    emitted straight away on the caller's thread.
+    """
+
+    def __init__(self, emit, window=0.05):
+        self.emit = emit
+        self.window = window
+        self._cond = threading.Condition()
+        self._rooms = {}
+        self._thread = None
+        self._closed = False
+
+    def send(self, room, is_pointing, command):
+        NOTIFICATION_EVENTS.inc()
+        with self._cond:
+            state = self._rooms.setdefault(room, _Room())
+            if is_pointing:
+                state.pointing = command
+                state.pointing_changed = True
+            else:
+                state.commands.append(command)
+            if self.window > 0:
+                if state.deadline is None:
+                    state.deadline = time.monotonic() + self.window
+                    if self._thread is None:
+                        self._thread = threading.Thread(target=self._run, name='notification-flusher', daemon=True)
+                        self._thread.start()
+                    self._cond.notify()
+                return
+            message = self._take(state)
+        if message is not None:
+            self.emit(room, message)
+
+    def flush(self):
+        """Emit everything pending now"""
+        with self._cond:
+            messages = [(room, self._take(state)) for room, state in self._rooms.items()]
+        for room, message in messages:
+            if message is not None:
+                self.emit(room, message)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self.flush()
+
+    def _take(self, state):
+        # Caller holds the lock
+        state.deadline = None
+        message = {'v': PROTOCOL_VERSION, 'seq': state.seq + 1, 'commands': state.commands}
+        if state.pointing_changed and state.pointing != state.sent_pointing:
+            message['pointing'] = state.pointing
+            state.sent_pointing = state.pointing
+        state.commands = []
+        state.pointing_changed = False
+        if not message['commands'] and 'pointing' not in message:
+            return None
+        state.seq += 1
+        return message
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if self._closed:
+                    return
+                now = time.monotonic()
+                due = [(room, state) for room, state in self._rooms.items()
+                       if state.deadline is not None and state.deadline <= now]
+                if not due:
+                    deadlines = [state.deadline for state in self._rooms.values() if state.deadline is not None]
+                    self._cond.wait(min(deadlines) - now if deadlines else None)
+                    continue
+                messages = [(room, self._take(state)) for room, state in due]
+            for room, message in messages:
+                if message is not None:
+                    try:
+                        self.emit(room, message)
+                    except Exception:
+                        logger.exception('Could not emit the notifications of room %s', room)
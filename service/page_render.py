@@ -0,0 +1,283 @@
+import hashlib
+import importlib.util
+import logging
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import cv2
+
+from loop_bridge import EventLoopBridge
+from metrics import PAGE_REQUESTS, PAGE_RENDER_SECONDS, PAGE_PREFETCHES
+
+logger = logging.getLogger(__name__)
+
+IMAGE_FORMATS = {'webp': 'image/webp', 'jpeg': 'image/jpeg', 'png': 'image/png'}
+# WebP is half the size but takes 25 times longer to encode than JPEG
+DEFAULT_FORMAT = 'jpeg'
+DEFAULT_SCALE = 2.0     # 144 dpi
+MAX_SCALE = 4.0
+MAX_PDF_BYTES = 256 * 1024 * 1024
+# Readers accept a PDF whose header is within its first 1024 bytes
+PDF_HEADER = b'%PDF-'
+PDF_HEADER_WITHIN = 1024
+IMAGE_QUALITY = 80
+
+
+class PageNotFound(LookupError):
+    pass
+
+
+class PdfTooLarge(ValueError):
+    pass
+
+
+class RenderUnavailable(RuntimeError):
+    """A render worker died, the pool is rebuilt for the next request"""
+
+
+def pdf_rendering_available():
+    """Whether the optional pypdfium2 is installed, without importing it"""
+    return importlib.util.find_spec('pypdfium2') is not None
+
+
+# Documents open in a render worker, by path
+_documents = OrderedDict()
+
+
+def _open_document(path):
+    import pypdfium2
+
+    document = _documents.get(path)
+    if document is None:
+        document = _documents[path] = pypdfium2.PdfDocument(path)
+        while len(_documents) > 4:
+            _documents.popitem(last=False)[1].close()
+    _documents.move_to_end(path)
+    return document
+
+
+def _render_page(path, page, scale, image_format):
+    """
+    Render worker: page `page` (from 1) of the PDF at `path`, encoded.
+    Returns (image bytes, render seconds).
+    """
+    start = time.perf_counter()
+    document = _open_document(path)
+    if not 1 <= page <= len(document):
+        raise PageNotFound(f'Page {page} is not in the document, it has {len(document)}')
+    # BGR, as OpenCV encodes it
+    image = document[page - 1].render(scale=scale).to_numpy()
+    if image_format == 'webp':
+        params = [cv2.IMWRITE_WEBP_QUALITY, IMAGE_QUALITY]
+    elif image_format == 'jpeg':
+        params = [cv2.IMWRITE_JPEG_QUALITY, IMAGE_QUALITY]
+    else:
+        params = []
+    ok, encoded = cv2.imencode(f'.{image_format}', image, params)
+    if not ok:
+        raise ValueError(f'Could not encode page {page} as {image_format}')
+    return encoded.tobytes(), time.perf_counter() - start
+
+
+class PdfStore:
+    """Uploaded PDFs in `directory`, named by the SHA-256 of their content"""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path(self, digest):
+        """Path of the PDF `digest`, None if it was never uploaded"""
+        path = os.path.join(self.directory, f'{digest}.pdf')
+        return path if os.path.exists(path) else None
+
+    def put_stream(self, stream, limit=MAX_PDF_BYTES):
+        """
+        Store a PDF read from a binary stream, returns its digest. Raises
+        PdfTooLarge over `limit` bytes, ValueError if it is not a PDF.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        digest = hashlib.sha256()
+        size = 0
+        head = b''
+        fd, temporary = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                while chunk := stream.read(1024 * 1024):
+                    size += len(chunk)
+                    if size > limit:
+                        raise PdfTooLarge(f'PDF is over {limit} bytes')
+                    if len(head) < PDF_HEADER_WITHIN:
+                        head += chunk[:PDF_HEADER_WITHIN - len(head)]
+                    digest.update(chunk)
+                    file.write(chunk)
+            if PDF_HEADER not in head:
+                raise ValueError('Not a PDF, it has no %PDF- header')
+            digest = digest.hexdigest()
+            os.replace(temporary, os.path.join(self.directory, f'{digest}.pdf'))
+            return digest
+        except BaseException:
+            os.unlink(temporary)
+            raise
+
+
+class PageRenderer:
+    """
+    Renders PDF pages to compressed images on a pool of `workers` processes
+    (pdfium is not thread safe, and rendering a big page holds a core).
+
+    A rendered page is identified by (PDF digest, page, scale, format), so
+    entries never go stale. The most recently used ones are kept in memory,
+    up to `memory_bytes`, and all of them under `directory`. A page being
+    rendered is not rendered twice: later requests wait for the first.
+
+    prefetch() renders pages ahead in the background, at most
+    `max_prefetch` at a time so that a page someone is waiting for never
+    queues behind many prefetched ones. The pool starts on first use.
+    render() waits through `bridge`, so that it does not block the gevent hub.
+    """
+
+    def __init__(self, store, directory, workers=2, memory_bytes=64 * 1024 * 1024, max_prefetch=None,
+                 bridge=None):
+        self.store = store
+        self.directory = directory
+        self.workers = workers
+        self.memory_bytes = memory_bytes
+        self.max_prefetch = 2 * workers if max_prefetch is None else max_prefetch
+        self.bridge = bridge or EventLoopBridge()
+        self._memory = OrderedDict()    # key -> image bytes
+        self._memory_size = 0
+        self._in_flight = {}            # key -> Future
+        self._prefetching = 0
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def _key(self, digest, page, scale, image_format):
+        return digest, page, round(scale, 2), image_format
+
+    def _path(self, key):
+        digest, page, scale, image_format = key
+        return os.path.join(self.directory, digest, f'{page}@{scale:g}x.{image_format}')
+
+    def render(self, digest, page, scale=DEFAULT_SCALE, image_format=DEFAULT_FORMAT, timeout=30):
+        """
+        The image of a page. Raises FileNotFoundError for an unknown PDF,
+        PageNotFound for a page it does not have, TimeoutError when it takes
+        over `timeout` seconds (it still lands in the cache) and
+        RenderUnavailable when a worker died rendering it.
+        """
+        key = self._key(digest, page, scale, image_format)
+        data, cache = self._cached(key)
+        if data is None:
+            future, cache = self._submit(key)
+            try:
+                data = self.bridge.blocking(future.result, timeout)[0]
+            except BrokenProcessPool as e:
+                raise RenderUnavailable(f'Could not render page {page}, a render worker died') from e
+        PAGE_REQUESTS.inc(cache=cache)
+        return data
+
+    def prefetch(self, digest, pages, scale=DEFAULT_SCALE, image_format=DEFAULT_FORMAT):
+        """Render `pages` in the background, in order, returns how many were queued"""
+        queued = 0
+        for page in pages:
+            key = self._key(digest, page, scale, image_format)
+            with self._lock:
+                if key in self._memory or key in self._in_flight:
+                    continue
+                if self._prefetching >= self.max_prefetch:
+                    break
+            if os.path.exists(self._path(key)):
+                continue
+            _, cache = self._submit(key, prefetch=True)
+            if cache == 'render':
+                queued += 1
+        PAGE_PREFETCHES.inc(queued)
+        return queued
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _cached(self, key):
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                return data, 'memory'
+        try:
+            with open(self._path(key), 'rb') as file:
+                data = file.read()
+        except OSError:
+            return None, None
+        self._remember(key, data)
+        return data, 'disk'
+
+    def _submit(self, key, prefetch=False):
+        path = self.store.path(key[0])
+        if path is None:
+            raise FileNotFoundError(f'Unknown PDF {key[0]}')
+        with self._lock:
+            future = self._in_flight.get(key)
+            if future is not None:
+                return future, 'in_flight'
+            if self._executor is None:
+                # Forking a process that runs threads is not safe
+                self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+            executor = self._executor
+            try:
+                future = executor.submit(_render_page, path, *key[1:])
+            except BrokenProcessPool as e:
+                self._drop_executor(executor)
+                raise RenderUnavailable(f'Could not render page {key[1]}, a render worker died') from e
+            self._in_flight[key] = future
+            if prefetch:
+                self._prefetching += 1
+        future.add_done_callback(lambda future: self._done(key, future, prefetch, executor))
+        return future, 'render'
+
+    def _drop_executor(self, executor):
+        # Called holding the lock. A pool whose worker died takes no more
+        # work, the next _submit starts a new one
+        if self._executor is executor:
+            self._executor = None
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _done(self, key, future, prefetch, executor):
+        broken = not future.cancelled() and isinstance(future.exception(), BrokenProcessPool)
+        with self._lock:
+            self._in_flight.pop(key, None)
+            if prefetch:
+                self._prefetching -= 1
+            if broken:
+                self._drop_executor(executor)
+        if future.cancelled() or future.exception() is not None:
+            if prefetch and not future.cancelled():
+                logger.warning('Could not prefetch page %d of %s: %s', key[1], key[0], future.exception())
+            return
+        data, seconds = future.result()
+        PAGE_RENDER_SECONDS.observe(seconds)
+        self._remember(key, data)
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, temporary = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            with os.fdopen(fd, 'wb') as file:
+                file.write(data)
+            os.replace(temporary, path)
+        except OSError as e:
+            logger.warning('Could not write the page cache: %s', e)
+
+    def _remember(self, key, data):
+        with self._lock:
+            if key in self._memory:
+                self._memory_size -= len(self._memory.pop(key))
+            self._memory[key] = data
+            self._memory_size += len(data)
+            while self._memory_size > self.memory_bytes and len(self._memory) > 1:
+                self._memory_size -= len(self._memory.popitem(last=False)[1])
@@ -0,0 +1,258 @@
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+
+from loop_bridge import EventLoopBridge
+from metrics import REVIEW_BATCH_SIZE, REVIEW_COMMIT_SECONDS, REVIEWS
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_USER = 'default'
+MAX_NAME_LENGTH = 256
+MAX_REVIEWS_PER_REQUEST = 1000
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS reviews (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user TEXT NOT NULL,
+    deck TEXT NOT NULL,
+    card TEXT NOT NULL,
+    rating INTEGER NOT NULL,
+    reviewed_at REAL NOT NULL,
+    ease REAL NOT NULL,
+    interval REAL NOT NULL,
+    next_review_at REAL NOT NULL,
+    received_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS card_state (
+    user TEXT NOT NULL,
+    deck TEXT NOT NULL,
+    card TEXT NOT NULL,
+    rating INTEGER NOT NULL,
+    reviewed_at REAL NOT NULL,
+    ease REAL NOT NULL,
+    interval REAL NOT NULL,
+    next_review_at REAL NOT NULL,
+    review_count INTEGER NOT NULL,
+    version INTEGER NOT NULL,
+    PRIMARY KEY (user, deck, card)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS card_state_changes ON card_state (user, version);
+'''
+
+# A review only replaces the state of its card if it is the most recent one,
+# clients that were offline may post older reviews after newer ones
+UPSERT_STATE = '''
+INSERT INTO card_state (user, deck, card, rating, reviewed_at, ease, interval, next_review_at, review_count, version)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, 1, ?)
+ON CONFLICT (user, deck, card) DO UPDATE SET
+    rating = excluded.rating,
+    reviewed_at = excluded.reviewed_at,
+    ease = excluded.ease,
+    interval = excluded.interval,
+    next_review_at = excluded.next_review_at,
+    review_count = card_state.review_count + 1,
+    version = excluded.version
+WHERE excluded.reviewed_at >= card_state.reviewed_at
+'''
+
+
+def parse_time(value):
+    """Unix seconds of an ISO 8601 date, as JSON.stringify writes a Date"""
+    if not isinstance(value, str):
+        raise ValueError('Dates must be ISO 8601 strings')
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.timestamp()
+
+
+def format_time(seconds):
+    moment = datetime.fromtimestamp(seconds, timezone.utc)
+    return moment.isoformat(timespec='milliseconds').replace('+00:00', 'Z')
+
+
+def _name(review, field):
+    value = review.get(field)
+    if not isinstance(value, str) or not 0 < len(value) <= MAX_NAME_LENGTH:
+        raise ValueError(f'{field} must be a string of 1 to {MAX_NAME_LENGTH} characters')
+    return value
+
+
+def _number(review, field):
+    value = review.get(field)
+    if not isinstance(value, (int, float)) or isinstance(value, bool) or value != value:
+        raise ValueError(f'{field} must be a number')
+    return float(value)
+
+
+def user_from(value):
+    """User of a request field, DEFAULT_USER when it is missing"""
+    if value is None or value == '':
+        return DEFAULT_USER
+    return _name({'user': value}, 'user')
+
+
+def parse_review(user, review):
+    """
+    A review row from what the client posts, the card as
+    updateFlashcardAfterReview left it:
+        {"deck": ..., "card": ..., "rating": 0-3, "reviewedAt": ..., "ease": ...,
+         "interval": ..., "nextReviewAt": ...}
+    Raises ValueError.
+    """
+    if not isinstance(review, dict):
+        raise ValueError('A review must be an object')
+    rating = review.get('rating')
+    if rating not in (0, 1, 2, 3) or isinstance(rating, bool):
+        raise ValueError('rating must be 0, 1, 2 or 3')
+    return (user, _name(review, 'deck'), _name(review, 'card'), rating, parse_time(review.get('reviewedAt')),
+            _number(review, 'ease'), _number(review, 'interval'), parse_time(review.get('nextReviewAt')))
+
+
+class _Batch:
+    def __init__(self, rows):
+        self.rows = rows
+        self.done = threading.Event()
+        self.error = None
+
+
+class ReviewLog:
+    """
+    Reviews of every user in SQLite: an append-only `reviews` table and
+    `card_state`, the latest state of each card, kept up to date in the
+    same transaction.
+
+    One writer thread owns the write connection. append() queues the
+    reviews of a request and waits: the writer takes everything queued,
+    up to `max_batch` reviews, and commits it as one transaction, so many
+    students posting at once share a commit. The database is in WAL mode
+    with synchronous=NORMAL: commits do not fsync, the WAL is synced at
+    checkpoints. A crash of the machine (not of the process) can lose the
+    last commits, never corrupt the database.
+
+    Every state change gets the id of the review that made it as version;
+    changes() returns the changes after a client's cursor, which is the
+    last version it saw. Readers use their own connections, WAL lets them
+    read while the writer commits. append() waits through `bridge`, so that
+    it does not block the gevent hub.
+    """
+
+    def __init__(self, path, max_batch=512, bridge=None):
+        self.path = path
+        self.max_batch = max_batch
+        self.bridge = bridge or EventLoopBridge()
+        self._queue = queue.Queue()
+        self._readers = threading.local()
+        connection = self._connect()
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.executescript(SCHEMA)
+        self._writer = threading.Thread(target=self._write, args=(connection,), name='review-log-writer',
+                                        daemon=True)
+        self._writer.start()
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        connection.execute('PRAGMA synchronous=NORMAL')
+        connection.execute('PRAGMA busy_timeout=5000')
+        return connection
+
+    def append(self, rows, timeout=10):
+        """Store rows of parse_review, once committed"""
+        if not rows:
+            return
+        batch = _Batch(rows)
+        self._queue.put(batch)
+        if not self.bridge.blocking(batch.done.wait, timeout):
+            raise TimeoutError('The review log did not commit in time')
+        if batch.error is not None:
+            raise batch.error
+
+    def changes(self, user, cursor=0, deck=None, limit=1000):
+        """
+        Card states of `user` (in `deck`) changed after `cursor`, oldest
+        change first: {"cursor": ..., "cards": [...], "more": bool}
+        """
+        connection = getattr(self._readers, 'connection', None)
+        if connection is None:
+            connection = self._readers.connection = self._connect()
+        query = ('SELECT deck, card, rating, reviewed_at, ease, interval, next_review_at, review_count, version '
+                 'FROM card_state WHERE user = ? AND version > ?')
+        parameters = [user, cursor]
+        if deck is not None:
+            query += ' AND deck = ?'
+            parameters.append(deck)
+        rows = connection.execute(query + ' ORDER BY version LIMIT ?', parameters + [limit + 1]).fetchall()
+        more = len(rows) > limit
+        rows = rows[:limit]
+        return {
+            'cursor': rows[-1][-1] if rows else cursor,
+            'cards': [{
+                'deck': deck,
+                'card': card,
+                'rating': rating,
+                'reviewedAt': format_time(reviewed_at),
+                'ease': ease,
+                'interval': interval,
+                'nextReviewAt': format_time(next_review_at),
+                'reviewCount': review_count,
+            } for deck, card, rating, reviewed_at, ease, interval, next_review_at, review_count, _ in rows],
+            'more': more,
+        }
+
+    def close(self):
+        self._queue.put(None)
+        self._writer.join(timeout=5)
+
+    def _take(self):
+        # Blocks for the first batch, then takes what else is already queued
+        batches = [self._queue.get()]
+        size = len(batches[0].rows) if batches[0] is not None else 0
+        while batches[-1] is not None and size < self.max_batch:
+            try:
+                batch = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            batches.append(batch)
+            size += len(batch.rows) if batch is not None else 0
+        return batches
+
+    def _write(self, connection):
+        closing = False
+        while not closing:
+            batches = self._take()
+            if batches[-1] is None:
+                closing = True
+                batches.pop()
+            if not batches:
+                continue
+            start = time.perf_counter()
+            try:
+                self._commit(connection, [row for batch in batches for row in batch.rows])
+            except Exception as e:
+                logger.exception('Could not write %d reviews', sum(len(batch.rows) for batch in batches))
+                for batch in batches:
+                    batch.error = e
+            else:
+                REVIEW_COMMIT_SECONDS.observe(time.perf_counter() - start)
+                REVIEW_BATCH_SIZE.observe(sum(len(batch.rows) for batch in batches))
+                REVIEWS.inc(sum(len(batch.rows) for batch in batches))
+            for batch in batches:
+                batch.done.set()
+        connection.close()
+
+    def _commit(self, connection, rows):
+        received_at = time.time()
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            connection.executemany(
+                'INSERT INTO reviews (user, deck, card, rating, reviewed_at, ease, interval, next_review_at, '
+                'received_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                [row + (received_at,) for row in rows])
+            # Ids are consecutive: this connection is the only writer
+            last_id = connection.execute('SELECT last_insert_rowid()').fetchone()[0]
+            first_id = last_id - len(rows) + 1
+            connection.executemany(UPSERT_STATE, [row + (first_id + i,) for i, row in enumerate(rows)])
@@ -0,0 +1,210 @@
+import heapq
+import json
+import os
+
+from trajectory import MOTIONS
+
+DEFAULT_RULES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gesture_rules.json')
+
+RULE_KEYS = {'command', 'gesture', 'fingers', 'motion', 'index_x', 'index_y', 'cooldown', 'repeat', 'during_pointing'}
+BOUND_OPERATORS = {
+    'lt': lambda value, bound: value < bound,
+    'le': lambda value, bound: value <= bound,
+    'gt': lambda value, bound: value > bound,
+    'ge': lambda value, bound: value >= bound,
+}
+
+
+class CommandState:
+    """Cooldown and debounce state of one command, shared by all its rules"""
+
+    def __init__(self):
+        self.last_sent_ts = None
+        # Still the last command sent, rules with repeat=false cannot fire it again
+        self.latched = False
+
+
+class CompiledRule:
+    def __init__(self, priority, command, state, gesture=None, fingers=None, motion=None, bounds=(),
+                 cooldown=None, repeat=False, during_pointing=False):
+        self.priority = priority
+        self.command = command
+        self.state = state
+        self.gesture = gesture
+        self.fingers = fingers
+        self.motion = motion
+        self.bounds = bounds    # ((axis, operator, bound), ...) on the index finger base
+        self.cooldown = cooldown
+        self.repeat = repeat
+        self.during_pointing = during_pointing
+
+    def ready(self, now, pointing):
+        """Whether cooldown, debounce and pointing allow this rule to fire now"""
+        if pointing and not self.during_pointing:
+            return False
+        if not self.repeat and self.state.latched:
+            return False
+        if self.cooldown is not None and self.state.last_sent_ts is not None:
+            if now - self.state.last_sent_ts < self.cooldown:
+                return False
+        return True
+
+    def matches(self, frame):
+        # The dispatch table already checked the key the rule is indexed by
+        if self.gesture is not None and frame.gesture != self.gesture:
+            return False
+        if self.fingers is not None and frame.finger_count != self.fingers:
+            return False
+        for axis, operator, bound in self.bounds:
+            value = frame.index_pos.get(axis)
+            if value is None or not BOUND_OPERATORS[operator](value, bound):
+                return False
+        return True
+
+
+def _compile_bounds(index, rule):
+    bounds = []
+    for key, axis in (('index_x', 'x'), ('index_y', 'y')):
+        if key not in rule:
+            continue
+        if not isinstance(rule[key], dict) or not rule[key]:
+            raise ValueError(f"Rule {index}: '{key}' must be an object such as {{\"lt\": 0.45}}")
+        for operator, bound in rule[key].items():
+            if operator not in BOUND_OPERATORS:
+                raise ValueError(f"Rule {index}: unknown operator '{operator}' in '{key}', "
+                                 f"expected one of {', '.join(BOUND_OPERATORS)}")
+            bounds.append((axis, operator, float(bound)))
+    return tuple(bounds)
+
+
+class RuleEngine:
+    """
+    Gesture rules compiled from a declarative spec into dispatch tables.
+
+    Each rule is indexed by the hand motion it needs, else by the gesture
+    category it needs, else by the finger count. A frame only evaluates the
+    rules found under its own motion, category and finger count, in the
+    order they appear in the spec, so the cost does not grow with the number
+    of unrelated rules; frames without a motion never see the motion rules.
+
+    A rule is an object with:
+        command: command to emit (required)
+        gesture: top gesture category of the first hand, e.g. "Open_Palm"
+        fingers: total number of raised fingers over all hands
+        motion: hand motion completed in the frame, e.g. "swipe_left" or
+            "flick_up", see TrajectoryTracker
+        index_x, index_y: bounds on the index finger base, e.g. {"lt": 0.45}
+        cooldown: seconds before the command can be emitted again
+        repeat: whether the command can be emitted twice in a row (false)
+        during_pointing: whether the rule fires while pointing (false)
+    Every rule needs `gesture`, `fingers` or `motion`.
+    """
+
+    def __init__(self, rules):
+        self.rules = rules
+        self.states = {}
+        self._latched = None    # state of the last command sent
+        self.by_motion = {}
+        self.by_gesture = {}
+        self.by_fingers = {}
+        for rule in rules:
+            self.states.setdefault(rule.command, rule.state)
+            if rule.motion is not None:
+                self.by_motion.setdefault(rule.motion, []).append(rule)
+            elif rule.gesture is not None:
+                self.by_gesture.setdefault(rule.gesture, []).append(rule)
+            else:
+                self.by_fingers.setdefault(rule.fingers, []).append(rule)
+
+    @classmethod
+    def compile(cls, spec):
+        """Compile a spec: a list of rules or an object with a `rules` list"""
+        if isinstance(spec, dict):
+            spec = spec.get('rules')
+        if not isinstance(spec, list):
+            raise ValueError("Gesture rules must be a list or an object with a 'rules' list")
+
+        states = {}
+        rules = []
+        for index, rule in enumerate(spec):
+            if not isinstance(rule, dict):
+                raise ValueError(f'Rule {index}: must be an object')
+            unknown = set(rule) - RULE_KEYS
+            if unknown:
+                raise ValueError(f"Rule {index}: unknown keys {', '.join(sorted(unknown))}")
+            if 'command' not in rule:
+                raise ValueError(f"Rule {index}: 'command' is required")
+            if rule.get('gesture') is None and rule.get('fingers') is None and rule.get('motion') is None:
+                raise ValueError(f"Rule {index}: needs a 'gesture', 'fingers' or 'motion' condition")
+            if rule.get('motion') is not None and rule['motion'] not in MOTIONS:
+                raise ValueError(f"Rule {index}: unknown motion '{rule['motion']}', "
+                                 f"expected one of {', '.join(MOTIONS)}")
+            command = rule['command']
+            cooldown = rule.get('cooldown')
+            rules.append(CompiledRule(
+                priority=index,
+                command=command,
+                state=states.setdefault(command, CommandState()),
+                gesture=rule.get('gesture'),
+                fingers=int(rule['fingers']) if rule.get('fingers') is not None else None,
+                motion=rule.get('motion'),
+                bounds=_compile_bounds(index, rule),
+                cooldown=float(cooldown) if cooldown is not None else None,
+                repeat=bool(rule.get('repeat', False)),
+                during_pointing=bool(rule.get('during_pointing', False)),
+            ))
+        return cls(rules)
+
+    @classmethod
+    def from_file(cls, path=None):
+        """
+        Load rules from a JSON file: `path`, else $GESTURE_RULES_PATH, else the
+        gesture_rules.json next to this module. gesture_rules.swipes.json
+        adds swipes to turn pages to it; hand motion is only tracked when a
+        rule uses it.
+        """
+        path = path or os.environ.get('GESTURE_RULES_PATH') or DEFAULT_RULES_PATH
+        with open(path) as f:
+            return cls.compile(json.load(f))
+
+    @property
+    def commands(self):
+        return list(self.states)
+
+    def candidates(self, frame, motion=None):
+        """Rules indexed under the frame's motion, gesture category and finger count, by priority"""
+        by_gesture = self.by_gesture.get(frame.gesture, ())
+        by_fingers = self.by_fingers.get(frame.finger_count, ())
+        if motion is not None and motion in self.by_motion:
+            return heapq.merge(self.by_motion[motion], by_gesture, by_fingers, key=lambda rule: rule.priority)
+        if not by_fingers:
+            return by_gesture
+        if not by_gesture:
+            return by_fingers
+        return heapq.merge(by_gesture, by_fingers, key=lambda rule: rule.priority)
+
+    def evaluate(self, frame, now, pointing=False, motion=None):
+        """
+        Return the command of the first candidate rule that is ready and
+        matches the frame, recording it as sent, or None. `motion` is the
+        one the frame completes, see TrajectoryTracker.
+        """
+        for rule in self.candidates(frame, motion):
+            if rule.ready(now, pointing) and rule.matches(frame):
+                self._sent(rule.command, now)
+                return rule.command
+        return None
+
+    def reset(self):
+        for state in self.states.values():
+            state.last_sent_ts = None
+            state.latched = False
+        self._latched = None
+
+    def _sent(self, command, now):
+        state = self.states[command]
+        if self._latched is not None:
+            self._latched.latched = False
+        state.latched = True
+        state.last_sent_ts = now
+        self._latched = state
@@ -0,0 +1,141 @@
+from collections import deque
+
+
+class SlidingVoter:
+    """
+    Vote over the labels of the last `window` frames.
+
+    The stable label only changes once a new label has `min_votes` votes in
+    the window (all of them by default), so a single noisy frame never gets
+    through. Each update is O(1): one label enters the window, one leaves.
+    """
+
+    def __init__(self, window=3, min_votes=None):
+        if window < 1:
+            raise ValueError('window must be at least 1')
+        self.window = window
+        self.min_votes = min(min_votes or window, window)
+        self._labels = deque()
+        self._counts = {}
+        self.stable = None
+
+    def update(self, label):
+        if len(self._labels) == self.window:
+            oldest = self._labels.popleft()
+            self._counts[oldest] -= 1
+        self._labels.append(label)
+        self._counts[label] = self._counts.get(label, 0) + 1
+        if self._counts[label] >= self.min_votes:
+            self.stable = label
+        return self.stable
+
+    def reset(self):
+        self._labels.clear()
+        self._counts.clear()
+        self.stable = None
+
+
+class BucketHysteresis:
+    """
+    Classifies a value into buckets, but only leaves the current bucket once
+    the value is more than `margin` past its edges, so a value hovering on an
+    edge does not flip between the two sides.
+
+    `buckets` is a sequence of (label, low, high) half-open intervals.
+    """
+
+    def __init__(self, buckets, margin=0.0):
+        self.buckets = tuple(buckets)
+        self.margin = margin
+        self._bounds = {label: (low, high) for label, low, high in self.buckets}
+        self.current = None
+
+    def classify(self, value):
+        for label, low, high in self.buckets:
+            if low <= value < high:
+                return label
+        return None
+
+    def update(self, value):
+        """Bucket of `value`; outside every bucket the current one is kept"""
+        if self.current is not None:
+            low, high = self._bounds[self.current]
+            if low - self.margin <= value < high + self.margin:
+                return self.current
+        self.current = self.classify(value) or self.current
+        return self.current
+
+    def reset(self):
+        self.current = None
+
+
+class GestureSmoothing:
+    """
+    Temporal filtering of the per-frame classifications, so that flicker does
+    not turn into commands: the gesture category, the finger count and the
+    pointed command go through a SlidingVoter each. `hysteresis` is the
+    margin of the BucketHysteresis the pipeline puts on the pointing angle.
+
+    Settings:
+        window: number of frames a classification must hold before it counts
+        min_votes: votes needed within the window (0 means the whole window)
+        hysteresis: degrees past a bucket edge the pointing angle must go to
+            switch bucket
+
+    With window=1 and hysteresis=0 every frame goes straight through. A
+    change is delayed by min_votes - 1 frames.
+    """
+
+    DEFAULTS = {
+        'window': 3,
+        'min_votes': 0,
+        'hysteresis': 5.0,
+    }
+
+    def __init__(self, window=3, min_votes=0, hysteresis=5.0):
+        window = int(window)
+        min_votes = int(min_votes or 0)
+        hysteresis = float(hysteresis)
+        if window < 1:
+            raise ValueError('window must be at least 1')
+        if not 0 <= min_votes <= window:
+            raise ValueError('min_votes must be between 0 and window')
+        if hysteresis < 0:
+            raise ValueError('hysteresis must not be negative')
+
+        self.window = window
+        self.min_votes = min_votes
+        self.hysteresis = hysteresis
+        self._gesture = SlidingVoter(window, min_votes)
+        self._fingers = SlidingVoter(window, min_votes)
+        self._pointing = SlidingVoter(window, min_votes)
+
+    @classmethod
+    def from_config(cls, config):
+        """Build from a dict such as the `smoothing` field of /enable-camera"""
+        config = config or {}
+        unknown = set(config) - set(cls.DEFAULTS)
+        if unknown:
+            raise ValueError(f"Unknown smoothing settings: {', '.join(sorted(unknown))}")
+        return cls(**{**cls.DEFAULTS, **config})
+
+    def to_config(self):
+        return {name: getattr(self, name) for name in self.DEFAULTS}
+
+    @property
+    def frames_of_delay(self):
+        return (self.min_votes or self.window) - 1
+
+    def gesture(self, label):
+        return self._gesture.update(label)
+
+    def fingers(self, count):
+        return self._fingers.update(count)
+
+    def pointing(self, command):
+        return self._pointing.update(command)
+
+    def reset(self):
+        self._gesture.reset()
+        self._fingers.reset()
+        self._pointing.reset()
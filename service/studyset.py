@@ -0,0 +1,348 @@
+import gzip
+import hashlib
+import json
+import logging
+import math
+import os
+import re
+import tempfile
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# Bumped whenever the compiled representation changes, older cache entries are ignored
+COMPILED_VERSION = 2
+MAX_STUDYSET_BYTES = 16 * 1024 * 1024
+# Pages one command may reference, '1-999999999' would expand into a list of a billion
+MAX_PAGE_REFS = 10000
+
+COMMENT_SYMBOL = '//'
+SECTIONS = ('[Title]', '[Resources]', '[Cards]', '[Aliases]')
+
+_INT = re.compile(r'\s*([+-]?\d+)')
+_FLOAT = re.compile(r'\s*([+-]?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)')
+_JS_NUMBER = re.compile(r'[+-]?(?:(?:[0-9]+\.?[0-9]*|\.[0-9]+)(?:[eE][+-]?[0-9]+)?|Infinity)')
+_JS_INTEGER = re.compile(r'0(?:[xX][0-9a-fA-F]+|[oO][0-7]+|[bB][01]+)')
+
+
+class StudysetError(ValueError):
+    """A line the client's parser would reject, `line` counts non-blank lines from 0"""
+
+    def __init__(self, line, message):
+        super().__init__(f'Line {line}: {message}')
+        self.line = line
+
+
+def count_tabs(line):
+    """Indentation level: one per tab or per 4 spaces"""
+    count = i = 0
+    while i < len(line):
+        if line[i] == '\t':
+            i += 1
+        elif line.startswith('    ', i):
+            i += 4
+        else:
+            break
+        count += 1
+    return count
+
+
+def _parse_int(text):
+    # parseInt: the leading digits, None for NaN
+    match = _INT.match(text)
+    return int(match.group(1)) if match else None
+
+
+def _parse_float(text):
+    # parseFloat: the leading number, NaN when there is none
+    match = _FLOAT.match(text)
+    return float(match.group(1)) if match else math.nan
+
+
+def _number(value):
+    # Number(): NaN unless the whole string is a number, which JSON sends as null
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    if math.isnan(number) or math.isinf(number):
+        return None
+    return int(number) if number.is_integer() else number
+
+
+def _js_number(value):
+    # Number(): the whole trimmed string as a number, 0 when empty, else NaN
+    if not isinstance(value, str):
+        return value
+    text = value.strip()
+    if not text:
+        return 0
+    if _JS_INTEGER.fullmatch(text):
+        return int(text, 0)
+    if not _JS_NUMBER.fullmatch(text):
+        return math.nan
+    number = float(text)
+    return int(number) if number.is_integer() else number
+
+
+def _json_number(number):
+    # JSON has no NaN or Infinity: their names, which Number() in the client reads back
+    if math.isfinite(number):
+        return number
+    return 'NaN' if math.isnan(number) else ('Infinity' if number > 0 else '-Infinity')
+
+
+def parse_page_refs(pages):
+    """
+    Page numbers of '5', '35-36' or '104, 110, 157'. ValueError over
+    MAX_PAGE_REFS of them.
+    """
+    refs = []
+    for part in (pages or '0').split(','):
+        part = part.strip()
+        if '-' in part:
+            bounds = part.split('-')
+            start, end = _parse_int(bounds[0]), _parse_int(bounds[1])
+            if start is not None and end is not None:
+                if len(refs) + end - start + 1 > MAX_PAGE_REFS:
+                    raise ValueError(f'Page references "{pages}" cover over {MAX_PAGE_REFS} pages')
+                refs.extend(range(start, end + 1))
+        else:
+            number = _parse_int(part)
+            if number is not None:
+                refs.append(number)
+        if len(refs) > MAX_PAGE_REFS:
+            raise ValueError(f'Page references "{pages}" cover over {MAX_PAGE_REFS} pages')
+    return refs
+
+
+def make_command(name, argument):
+    """
+    The JSON of a card command, as CommandsFactory.Make(...).toJson() gives
+    it minus the Vue component, which the client adds back from `name`. A
+    Header level may be NaN or infinite, as Number() makes it.
+    """
+    if name.startswith('\\'):
+        name = name[1:]
+    name = name.split('(', 1)[0]
+    if name in ('+', 'remember'):
+        return {'name': 'Remember', 'what': argument}
+    if name in ('#', 'tag'):
+        return {'name': 'Tag', 'tag': argument or ''}
+    if name in ('@', 'auto_reveal'):
+        return {'name': 'AutoReveal', 'autoReveal': True}
+    if name == '^':
+        return {'name': 'Header', 'level': _js_number(argument or 1)}
+    # '..', 'page' and anything unknown are page references, only the
+    # unknown ones replace a missing argument with ''
+    if name not in ('..', 'page'):
+        argument = argument or ''
+    refs = parse_page_refs(argument)
+    return {'name': 'pageref', 'ref': refs[0] if refs else 0, 'allRefs': refs, 'pagesString': argument}
+
+
+def parse_recall(text):
+    """[reviewedAt, ease, interval, learningPhase] of a '*** ...' line, None if invalid"""
+    parts = [part.strip() for part in text.split(',')]
+    if len(parts) != 4:
+        return None
+    try:
+        datetime.fromisoformat(parts[0])
+    except ValueError:
+        return None
+    ease, interval = _parse_float(parts[1]), _parse_float(parts[2])
+    if math.isnan(ease) or not 1 <= ease <= 10 or math.isnan(interval) or interval < 0:
+        return None
+    # The date is kept as written so the client reads it exactly as its own parser would
+    return [parts[0], _number(ease), _number(interval), parts[3].lower() == 'true']
+
+
+class StudysetParser:
+    """
+    Streaming parser of the study set format of src/FlashcardParser, fed one
+    line at a time.
+
+    compiled() is a compact form of what parseStudyset returns: each card
+    refers to its header path by index in `headerPaths` instead of repeating
+    it, only reviewed cards have `recall`, [reviewedAt, ease, interval,
+    learningPhase], only commands with nested ones have `subParts`, and
+    commands carry no Vue component.
+    """
+
+    def __init__(self):
+        self.index = 0
+        self.section = None
+        self.title = ''
+        self.resources = []
+        self.headers = []           # {"line", "level", "text"}
+        self.cards = []
+        self._header_paths = {}     # header path -> index in headerPaths
+
+    def feed(self, line):
+        stripped = line.strip()
+        if not stripped:
+            return
+        index = self.index
+        self.index += 1
+        if stripped in SECTIONS:
+            self.section = stripped
+        elif self.section == '[Title]':
+            self.title = stripped
+        elif self.section == '[Resources]':
+            self.resources.append(stripped)
+        elif self.section == '[Cards]':
+            self._card_line(index, stripped, count_tabs(line))
+        # Aliases are not used yet
+
+    def _card_line(self, index, line, tabs):
+        if tabs == 1 and line.startswith('***') and self.cards:
+            recall = parse_recall(line[3:].strip())
+            if recall is None:
+                logger.debug('Ignoring invalid recall data at line %d: %s', index, line)
+            else:
+                self.cards[-1]['recall'] = recall
+            return
+
+        if tabs == 0:
+            sub_parts = []
+            text = line
+            if '..' in line:
+                parts = line.split('..')
+                text = '..'.join(parts[:-1]).strip()
+                try:
+                    sub_parts.append(make_command('..', parts[-1]))
+                except ValueError as e:
+                    raise StudysetError(index, str(e)) from None
+            self.cards.append({
+                'line': index,
+                'text': text,
+                'headers': self._header_path(),
+                'subParts': sub_parts,
+            })
+            return
+
+        if not self.cards:
+            raise StudysetError(index, f'Found a command before the first card: "{line}"')
+        sub_parts = self.cards[-1]['subParts']
+        for _ in range(1, tabs):
+            if not sub_parts:
+                raise StudysetError(index, f'Invalid nesting: "{line}"')
+            sub_parts = sub_parts[-1].setdefault('subParts', [])
+
+        name, _, argument = line.partition(' ')
+        try:
+            command = make_command(name, argument.strip() if argument else None)
+        except ValueError as e:
+            raise StudysetError(index, str(e)) from None
+        if command['name'] == 'Header':
+            self.headers.append({'line': index, 'level': _json_number(command['level']),
+                                 'text': self.cards[-1]['text'] or 'NO HEADER TEXT'})
+        else:
+            sub_parts.append(command)
+
+    def _header_path(self):
+        # The closest header, then each earlier one of a strictly lower level
+        path = []
+        level = None
+        for header in reversed(self.headers):
+            # NaN compares false, as in the client
+            current = float(header['level'])
+            if level is not None and current >= level:
+                break
+            path.append(header['text'])
+            level = current
+        path = tuple(reversed(path))
+        return self._header_paths.setdefault(path, len(self._header_paths))
+
+    def compiled(self):
+        return {
+            'v': COMPILED_VERSION,
+            'title': self.title,
+            'resources': self.resources,
+            'headers': self.headers,
+            'headerPaths': [list(path) for path in self._header_paths],
+            'cards': [card for card in self.cards if not card['text'].startswith(COMMENT_SYMBOL)],
+        }
+
+
+def compile_studyset(lines):
+    """The compiled study set of an iterable of lines, StudysetError if one is invalid"""
+    parser = StudysetParser()
+    for line in lines:
+        parser.feed(line)
+    return parser.compiled()
+
+
+def compile_stream(stream, limit=MAX_STUDYSET_BYTES):
+    """
+    Compile a UTF-8 study set read line by line from a binary stream, hashing
+    it on the way. Returns (sha256 hex digest, compiled JSON bytes).
+    ValueError over `limit` bytes, never reading more than one byte past it,
+    however long its lines are.
+    """
+    digest = hashlib.sha256()
+    parser = StudysetParser()
+    size = 0
+    while raw := stream.readline(limit - size + 1):
+        size += len(raw)
+        if size > limit:
+            raise ValueError(f'Study set is over {limit} bytes')
+        digest.update(raw)
+        parser.feed(raw.decode('utf-8'))
+    return digest.hexdigest(), json.dumps(parser.compiled(), separators=(',', ':')).encode('utf-8')
+
+
+class StudysetCache:
+    """
+    Compiled study sets by SHA-256 of their content: the `max_entries` most
+    recently used in memory, all of them in `directory`. Entries are kept
+    as gzipped JSON, served as is to clients that accept gzip.
+    """
+
+    def __init__(self, directory=None, max_entries=32):
+        self.directory = directory or os.path.join(tempfile.gettempdir(), 'studyset-cache')
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _path(self, digest):
+        return os.path.join(self.directory, f'{digest}.v{COMPILED_VERSION}.json.gz')
+
+    def get(self, digest):
+        """(gzipped JSON, 'memory' or 'disk'), or (None, 'miss')"""
+        with self._lock:
+            data = self._entries.get(digest)
+            if data is not None:
+                self._entries.move_to_end(digest)
+                return data, 'memory'
+        try:
+            with open(self._path(digest), 'rb') as file:
+                data = file.read()
+        except OSError:
+            return None, 'miss'
+        self._remember(digest, data)
+        return data, 'disk'
+
+    def put(self, digest, data):
+        """Cache the JSON bytes `data`, returns them gzipped"""
+        data = gzip.compress(data, compresslevel=6, mtime=0)
+        self._remember(digest, data)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            # Written aside and renamed, a reader never sees half a file
+            fd, temporary = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as file:
+                file.write(data)
+            os.replace(temporary, self._path(digest))
+        except OSError as e:
+            logger.warning('Could not write the study set cache: %s', e)
+        return data
+
+    def _remember(self, digest, data):
+        with self._lock:
+            self._entries[digest] = data
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
@@ -0,0 +1,148 @@
+from collections import deque
+
+DIRECTIONS = ('left', 'right', 'up', 'down')
+# Motions TrajectoryTracker.update reports, as rules name them
+MOTIONS = tuple(f'{kind}_{direction}' for kind in ('swipe', 'flick') for direction in DIRECTIONS)
+
+
+def _direction(dx, dy):
+    # Of the larger of the two moves, in image coordinates where y grows downwards
+    if abs(dx) >= abs(dy):
+        return 'right' if dx > 0 else 'left'
+    return 'down' if dy > 0 else 'up'
+
+
+class TrajectoryTracker:
+    """
+    Detects swipes and flicks of the hand center.
+
+    A swipe is a steady move: the hand center is sampled every
+    `sample_interval` seconds, and over the last `window` samples it moved
+    at least `distance` (a fraction of the frame) along one axis, with at
+    least `consistency` * `window` of the steps between them going that
+    way, and at most all of them. The move is the difference of the two
+    ends of the window, and the steps in each direction are counted as
+    samples enter and leave it, so a frame costs the same whatever the
+    window.
+
+    A flick is a fast one, whatever the sampling: the hand moved
+    `flick_distance` within the last `flick_seconds`, 0 turns them off.
+
+    A motion is reported once, by the frame that completes it; tracking
+    then starts over from that frame, and when the hand is lost.
+    """
+
+    DEFAULTS = {
+        'window': 5,
+        'distance': 0.1,
+        'consistency': 0.7,
+        'sample_interval': 0.1,
+        'flick_seconds': 0.25,
+        'flick_distance': 0.25,
+    }
+
+    def __init__(self, window=5, distance=0.1, consistency=0.7, sample_interval=0.1, flick_seconds=0.25,
+                 flick_distance=0.25):
+        window = int(window)
+        distance, consistency, flick_distance = float(distance), float(consistency), float(flick_distance)
+        sample_interval, flick_seconds = float(sample_interval), float(flick_seconds)
+        if window < 2:
+            raise ValueError('window must be at least 2 samples')
+        if distance <= 0 or flick_distance <= 0:
+            raise ValueError('distances must be positive')
+        if not 0 <= consistency <= 1:
+            raise ValueError('consistency must be between 0 and 1')
+        if sample_interval < 0 or flick_seconds < 0:
+            raise ValueError('sample_interval and flick_seconds must not be negative')
+
+        self.window = window
+        self.distance = distance
+        self.consistency = consistency
+        self.sample_interval = sample_interval
+        self.flick_seconds = flick_seconds
+        self.flick_distance = flick_distance
+        # Steps a swipe needs, out of the window - 1 between its samples
+        self._min_steps = min(consistency * window, window - 1)
+        # (x, y, slots in _step_counts of the x and y steps to it) every sample_interval
+        self._samples = deque(maxlen=window)
+        # Steps of the window going left, right, up and down, as indexed by
+        # dx > 0 and 2 + (dy > 0), then a slot for the steps with no move
+        self._step_counts = [0] * 5
+        self._last_sample = None    # time of the last sample
+        self._recent = deque()      # (time, x, y) of every frame of the last flick_seconds
+
+    @classmethod
+    def from_config(cls, config):
+        config = config or {}
+        unknown = set(config) - set(cls.DEFAULTS)
+        if unknown:
+            raise ValueError(f"Unknown trajectory settings: {', '.join(sorted(unknown))}")
+        return cls(**{**cls.DEFAULTS, **config})
+
+    def to_config(self):
+        return {name: getattr(self, name) for name in self.DEFAULTS}
+
+    def update(self, hand_center, now):
+        """
+        Feed the hand center of a frame, None without a hand, and its time in
+        seconds. Returns the motion it completes, one of MOTIONS, or None.
+        """
+        if hand_center is None:
+            if self._samples:
+                self.reset()
+            return None
+        x, y = hand_center
+        motion = None
+
+        # Flick: the move since the oldest frame of the last flick_seconds
+        flick_seconds = self.flick_seconds
+        if flick_seconds:
+            recent = self._recent
+            recent.append((now, x, y))
+            while now - recent[0][0] > flick_seconds:
+                recent.popleft()
+            _, x0, y0 = recent[0]
+            dx, dy = x - x0, y - y0
+            if abs(dx) >= self.flick_distance or abs(dy) >= self.flick_distance:
+                motion = 'flick_' + _direction(dx, dy)
+
+        # Swipe: the move over the last `window` samples
+        if self._last_sample is None or now - self._last_sample >= self.sample_interval:
+            self._last_sample = now
+            samples, counts = self._samples, self._step_counts
+            if samples:
+                last_x, last_y, _, _ = samples[-1]
+                step_x, step_y = x - last_x, y - last_y
+                slot_x = step_x > 0 if step_x else 4
+                slot_y = 2 + (step_y > 0) if step_y else 4
+                counts[slot_x] += 1
+                counts[slot_y] += 1
+                if len(samples) == self.window:
+                    # The step into the second oldest sample leaves the window
+                    _, _, left_x, left_y = samples[1]
+                    counts[left_x] -= 1
+                    counts[left_y] -= 1
+                samples.append((x, y, slot_x, slot_y))
+            else:
+                samples.append((x, y, 4, 4))
+            if motion is None and len(samples) == self.window:
+                dx, dy = x - samples[0][0], y - samples[0][1]
+                if abs(dx) >= self.distance or abs(dy) >= self.distance:
+                    direction = _direction(dx, dy)
+                    if counts[DIRECTIONS.index(direction)] >= self._min_steps:
+                        motion = 'swipe_' + direction
+
+        if motion is not None:
+            # Start over from this frame
+            self.reset()
+            self._last_sample = now
+            self._samples.append((x, y, 4, 4))
+            if flick_seconds:
+                self._recent.append((now, x, y))
+        return motion
+
+    def reset(self):
+        self._samples.clear()
+        self._step_counts = [0] * 5
+        self._last_sample = None
+        self._recent.clear()
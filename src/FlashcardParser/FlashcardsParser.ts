@@ -1,5 +1,8 @@
 import { Header } from "@/commands/allCommands/Header";
 import { CommandsFactory } from "@/commands/CommandsFactory";
+import VuePagRef from "@/commands/allCommandsComponent/VuePagRef.vue";
+import VueRemember from "@/commands/allCommandsComponent/VueRemember.vue";
+import VueTag from "@/commands/allCommandsComponent/VueTag.vue";
 
 const commentSymbol: string = '//'
 
@@ -339,4 +342,80 @@ function countTabs(line: string): number {
     }
 
     return count;
-}
\ No newline at end of file
+}
+
+// Study sets compiled by the service (service/studyset.py): commands without
+// their Vue component, header paths shared through a table, recall data only
+// on reviewed cards and subParts only where commands are nested
+interface ICompiledCommand {
+    name: string;
+    subParts?: ICompiledCommand[];
+    [key: string]: any;
+}
+
+interface ICompiledCard {
+    line: number;
+    text: string;
+    headers: number;
+    subParts: ICompiledCommand[];
+    recall?: [string, number, number, boolean];
+}
+
+export interface ICompiledStudySet {
+    v: number;
+    title: string;
+    resources: string[];
+    // A level JSON cannot hold (NaN, Infinity) comes as its name, Header reads it back with Number()
+    headers: { line: number; level: number | string; text: string }[];
+    headerPaths: string[][];
+    cards: ICompiledCard[];
+}
+
+const commandComponents: { [name: string]: any } = {
+    pageref: VuePagRef,
+    Remember: VueRemember,
+    Tag: VueTag,
+};
+
+function fromCompiledCommand(command: ICompiledCommand): ISubPart {
+    return {
+        ...command,
+        vueComponent: commandComponents[command.name] ?? null,
+        subParts: (command.subParts ?? []).map(fromCompiledCommand),
+    };
+}
+
+// The study set parseStudyset(lines) would give, from its compiled form
+export function fromCompiledStudyset(compiled: ICompiledStudySet, lines: string[]): IStudySet {
+    return {
+        title: compiled.title,
+        resources: compiled.resources,
+        aliases: [],
+        headers: compiled.headers.map((h) => ({ line: h.line, header: new Header(h.level, h.text) })),
+        flashcards: compiled.cards.map((card) => {
+            const flashcard: IFlashcard = {
+                line: card.line,
+                headers: [...compiled.headerPaths[card.headers]],
+                text: card.text,
+                subParts: card.subParts.map(fromCompiledCommand),
+                reviewedAt: null,
+                // FSRS initial difficulty and stability
+                ease: 5,
+                interval: 0.5,
+                learningPhase: true,
+                nextReviewAt: new Date(),
+            };
+            if (card.recall) {
+                const [reviewedAt, ease, interval, learningPhase] = card.recall;
+                flashcard.reviewedAt = new Date(reviewedAt);
+                flashcard.ease = ease;
+                flashcard.interval = interval;
+                flashcard.learningPhase = learningPhase;
+                flashcard.nextReviewAt = new Date(flashcard.reviewedAt.getTime() + interval * 24 * 60 * 60 * 1000);
+            }
+            return flashcard;
+        }),
+        studiedCards: 0,
+        originalLines: lines.filter((l) => l.trim() !== ""),
+    };
+}
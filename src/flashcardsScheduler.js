@@ -1,15 +1,32 @@
+// Weights of nextInterval, the service fits them to each student
+// (GET /scheduler/parameters). Lists are indexed by retrievalSuccess.
+export const DEFAULT_PARAMETERS = {
+  // Default difficulty used by the Free Spaced Repetition Scheduler (FSRS)
+  // Difficulty is scaled between 1 and 10. 5 represents a medium difficulty.
+  initialDifficulty: 5,
+  difficultyDelta: [0.8, 0.4, -0.1, -0.2],
+  // Again restarts learning at againStability, stabilityFactor[0] is unused
+  stabilityFactor: [0, 1.2, 1.8, 2.5],
+  againStability: 0.5,
+  // Stability after the first review of a card
+  initialStability: [0.5, 0.5, 0.5, 0.5],
+};
+
 export default class FlashcardsScheduler {
-  constructor() {
+  constructor(parameters = DEFAULT_PARAMETERS) {
     this.flashcards = [];
     this.initialLearningPhaseFixedSteps = ["30m", "2h", "2d"];
     this.easyIntervalOnExitingLearningMode = "4d";
-    // Default difficulty used by the Free Spaced Repetition Scheduler (FSRS)
-    // Difficulty is scaled between 1 and 10. 5 represents a medium difficulty.
-    this.defaultDifficulty = 5;
+    this.setParameters(parameters);
     // Maximum allowed interval expressed in days
     this.maximumIntervals = 1825; // Days
   }
 
+  setParameters(parameters) {
+    this.parameters = { ...DEFAULT_PARAMETERS, ...parameters };
+    this.defaultDifficulty = this.parameters.initialDifficulty;
+  }
+
   resetCards() {
     this.flashcards = [];
   }
@@ -63,7 +80,8 @@ export default class FlashcardsScheduler {
       retrievalSuccess,
       flashcard.interval || 0,
       flashcard.ease ?? this.defaultDifficulty,
-      lastReview
+      lastReview,
+      this.parameters
     );
 
     flashcard.interval = result.interval;
@@ -189,7 +207,8 @@ export default class FlashcardsScheduler {
     retrievalSuccess,
     currentStability = 0,
     difficulty = 5,
-    lastReviewDate = null
+    lastReviewDate = null,
+    parameters = DEFAULT_PARAMETERS
   ) {
     // Implementation of a simplified Free Spaced Repetition Scheduler (FSRS)
     // https://github.com/open-spaced-repetition/fsrs4anki/wiki/The-Algorithm
@@ -202,44 +221,42 @@ export default class FlashcardsScheduler {
       ? Math.exp(Math.log(0.9) * (elapsedDays / currentStability))
       : 0;
 
-    // weights tuned roughly according to the public implementation
-    const AGAIN_DIFFICULTY_DELTA = 0.8;
-    const HARD_DIFFICULTY_DELTA = 0.4;
-    const GOOD_DIFFICULTY_DELTA = -0.1;
-    const EASY_DIFFICULTY_DELTA = -0.2;
-
-    const HARD_FACTOR = 1.2;
-    const GOOD_FACTOR = 1.8;
-    const EASY_FACTOR = 2.5;
+    // weights tuned roughly according to the public implementation,
+    // or fitted to the student's reviews
+    const { difficultyDelta, stabilityFactor } = parameters;
 
     let newDifficulty = difficulty;
     let newStability = currentStability;
 
     switch (retrievalSuccess) {
       case 0: // Again
-        newDifficulty = Math.min(10, difficulty + AGAIN_DIFFICULTY_DELTA);
-        newStability = 0.5; // restart learning
+        newDifficulty = Math.min(
+          10,
+          Math.max(1, difficulty + difficultyDelta[0])
+        );
+        newStability = parameters.againStability; // restart learning
         break;
       case 1: // Hard
-        newDifficulty = Math.min(10, difficulty + HARD_DIFFICULTY_DELTA);
-        newStability =
-          currentStability *
-          (1 + HARD_FACTOR * (10 - difficulty) * (1 - retrievability));
-        break;
       case 2: // Good
-        newDifficulty = Math.max(1, difficulty + GOOD_DIFFICULTY_DELTA);
-        newStability =
-          currentStability *
-          (1 + GOOD_FACTOR * (10 - difficulty) * (1 - retrievability));
-        break;
       case 3: // Easy
-        newDifficulty = Math.max(1, difficulty + EASY_DIFFICULTY_DELTA);
+        newDifficulty = Math.min(
+          10,
+          Math.max(1, difficulty + difficultyDelta[retrievalSuccess])
+        );
         newStability =
           currentStability *
-          (1 + EASY_FACTOR * (10 - difficulty) * (1 - retrievability));
+          (1 +
+            stabilityFactor[retrievalSuccess] *
+              (10 - difficulty) *
+              (1 - retrievability));
         break;
     }
 
+    // The first review of a card starts at the initial stability of its rating
+    if (!currentStability && retrievalSuccess >= 0 && retrievalSuccess <= 3) {
+      newStability = parameters.initialStability[retrievalSuccess];
+    }
+
     newStability = Math.min(
       Math.max(newStability * FlashcardsScheduler.intervalNoise(), 0.5),
       1825